@@ -3,6 +3,7 @@ from rest_framework import serializers
 from django.contrib.auth import authenticate, get_user_model
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from rest_framework.exceptions import ValidationError, AuthenticationFailed
+from catalog.serializers import ImageVariantsField
 
 User = get_user_model()
 
@@ -76,6 +77,8 @@ class UserLoginSerializer(serializers.Serializer):
       
       
 class UserSerializer(serializers.ModelSerializer):
+   avatar_variants = ImageVariantsField(source='avatar')
+
    class Meta:
       model = User
       fields = '__all__'
@@ -83,7 +86,8 @@ class UserSerializer(serializers.ModelSerializer):
 
 
 class UserProfileSerializer(serializers.ModelSerializer):
-   
+   avatar_variants = ImageVariantsField(source='avatar')
+
    class Meta:
       model = User
       # fields = '__all__' # when i use exclude i can't use it
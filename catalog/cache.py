@@ -0,0 +1,76 @@
+import time
+from django.core.cache import cache
+from .models import Category
+
+# Versioned cache keys: every cached entry embeds the current version of its namespace in the key,
+# so bumping the version on a write makes all workers miss and rebuild, without deleting anything.
+VERSION_KEY = 'catalog:version:{namespace}'
+
+CATEGORY_TREE = 'category_tree'
+CATEGORY_TREE_KEY = 'catalog:category_tree:{version}'
+CATEGORY_TREE_TIMEOUT = 60 * 60 * 24  # Old versions are never read again, they just expire
+
+FACETS = 'facets'
+
+# Dependency tags of the public catalog responses (ETags and cached responses), bumped by signals after each write commits
+BRANDS = 'brands'
+BRAND = 'brand:{id}'  # A brand with its photos and videos
+CATEGORIES = 'categories'  # Any category or attribute group, products show their category's attribute groups
+CATEGORY = 'category:{id}'  # The detail of a category: itself, its children and its ancestors' names and groups
+ATTRIBUTE_GROUPS = 'attribute_groups'
+ATTRIBUTES = 'attributes'  # Attribute types and values, shown with the SKUs
+PRODUCTS = 'products'  # Any product or SKU, for the product lists
+PRODUCT = 'product:{id}'  # One version per product, covering its SKUs, details and media
+REVIEWS = 'reviews:{id}'  # The review sections of a product with their items
+
+
+def get_version(namespace):
+    """Return the current version of a cache namespace, initializing it if missing, or None if the cache is down."""
+    key = VERSION_KEY.format(namespace=namespace)
+    version = cache.get(key)
+    if version is None:
+        # Start from the clock rather than 1, so a lost version key can't bring back stale entries
+        version = time.time_ns()
+        if not cache.add(key, version, timeout=None):
+            version = cache.get(key)
+    return version
+
+
+def get_versions(namespaces):
+    """Return the current versions of several namespaces with one cache read, or None if the cache is down."""
+    keys = [VERSION_KEY.format(namespace=namespace) for namespace in namespaces]
+    found = cache.get_many(keys)
+    versions = [found[key] if key in found else get_version(namespace) for key, namespace in zip(keys, namespaces)]
+    return None if None in versions else versions
+
+
+def bump_version(namespace):
+    """Invalidate every entry of a cache namespace and return its new version (None if the cache is down)."""
+    key = VERSION_KEY.format(namespace=namespace)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # The key is missing, any new version will do
+        version = time.time_ns()
+        cache.set(key, version, timeout=None)
+        return version
+
+
+def bump_versions(namespaces):
+    """Invalidate several namespaces with a single cache write, their new versions are not sequential."""
+    version = time.time_ns()
+    cache.set_many({VERSION_KEY.format(namespace=namespace): version for namespace in namespaces}, timeout=None)
+
+
+def get_category_tree():
+    """Return the nested tree of active categories, built once per version of the category data."""
+    version = get_version(CATEGORY_TREE)
+    if version is None:
+        return Category.build_tree()
+
+    key = CATEGORY_TREE_KEY.format(version=version)
+    tree = cache.get(key)
+    if tree is None:
+        tree = Category.build_tree()
+        cache.set(key, tree, timeout=CATEGORY_TREE_TIMEOUT)
+    return tree
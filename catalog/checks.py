@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+
+@register(Tags.security, deploy=True)
+def check_media_accel(app_configs, **kwargs):
+    """Media must be sent by the front proxy in production, Django only streams files itself in development."""
+    if settings.DEBUG or settings.MEDIA_ACCEL in ('nginx', 'sendfile'):
+        return []
+    return [Error(
+        "MEDIA_ACCEL is not set, media requests would be refused.",
+        hint="Set MEDIA_ACCEL to 'nginx' (X-Accel-Redirect) or 'sendfile' (X-Sendfile) and configure the front proxy.",
+        id='catalog.E001',
+    )]
@@ -0,0 +1,122 @@
+import csv
+import json
+import sys
+import zlib
+from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
+from .importer import escape_pair_text
+from .models import Product, ProductDetail, ProductSKU, ProductSKUAttribute
+
+# Exports are generated while they are sent: rows come from QuerySet.iterator(), which reads them from the
+# database in chunks (a server-side cursor on PostgreSQL), and are encoded and optionally gzipped on the fly,
+# so memory use doesn't depend on the size of the tables.
+
+EXPORT_FORMATS = ['csv', 'jsonl']
+CHUNK_SIZE = 2000
+BUFFER_SIZE = 64 * 1024  # Encoded bytes collected before a piece is sent
+CONTENT_TYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+# Catalog rows use the import format (see catalog/importer.py), so an export can be imported elsewhere
+CATALOG_FIELDS = ['product', 'name', 'category', 'description', 'summary', 'is_active', 'sku', 'price', 'quantity', 'attributes', 'details']
+
+
+class Echo:
+    """File-like object handing back what is written to it, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def format_pairs(pairs, format):
+    """Attributes and details, as a list of pairs in JSONL and as "key=value;key=value" in CSV, escaped for parse_pairs()."""
+    if format == 'jsonl':
+        return [list(pair) for pair in pairs]
+    return ';'.join(f'{escape_pair_text(key)}={escape_pair_text(value)}' for key, value in pairs)
+
+
+def encode_rows(rows, fields, format):
+    """Yield the rows (dicts) as CSV with a header line or as JSONL, in encoded pieces of about BUFFER_SIZE."""
+    buffer, size = [], 0
+    if format == 'csv':
+        writer = csv.writer(Echo())
+        lines = (writer.writerow([row.get(field, '') for field in fields]) for row in rows)
+        buffer.append(writer.writerow(fields))
+    else:
+        lines = (json.dumps(row, default=str, ensure_ascii=False) + '\n' for row in rows)
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= BUFFER_SIZE:
+            yield ''.join(buffer).encode()
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer).encode()
+
+
+def gzip_chunks(chunks):
+    """Compress a stream of bytes into a gzip stream, piece by piece."""
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_stream(rows, fields, format, compress=False):
+    chunks = encode_rows(rows, fields, format)
+    return gzip_chunks(chunks) if compress else chunks
+
+
+def write_export(chunks, path):
+    """Write an export stream to a file, or to standard output for '-'."""
+    if path == '-':
+        for chunk in chunks:
+            sys.stdout.buffer.write(chunk)
+        sys.stdout.buffer.flush()
+        return
+    with open(path, 'wb') as file:
+        for chunk in chunks:
+            file.write(chunk)
+
+
+def export_response(rows, fields, format, filename, compress=False):
+    """A download of the rows, generated while it is sent."""
+    filename = f'{filename}.{format}' + ('.gz' if compress else '')
+    response = StreamingHttpResponse(
+        export_stream(rows, fields, format, compress),
+        content_type='application/gzip' if compress else CONTENT_TYPES[format],
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def catalog_rows(format, chunk_size=CHUNK_SIZE):
+    """
+    One row per SKU, the first row of a product carrying its fields and details. Products without SKUs get a
+    single row. Products are read in chunks, each with one query per prefetched relation.
+    """
+    products = Product.objects.select_related('category').prefetch_related(
+        Prefetch('details', queryset=ProductDetail.objects.order_by('order_num', 'id')),
+        Prefetch('skus', queryset=ProductSKU.objects.order_by('id').prefetch_related(
+            Prefetch('sku_attributes', queryset=ProductSKUAttribute.objects.select_related('attribute_value__type').order_by('id')),
+        )),
+    ).order_by('id')
+    for product in products.iterator(chunk_size=chunk_size):
+        first = {
+            'product': product.pk,
+            'name': product.name,
+            'category': product.category.name,
+            'description': product.description,
+            'summary': product.summary,
+            'is_active': product.is_active,
+            'details': format_pairs([(detail.title, detail.value) for detail in product.details.all()], format),
+        }
+        skus = product.skus.all()
+        if not skus:
+            yield first
+        for index, sku in enumerate(skus):
+            row = first if index == 0 else {'product': product.pk}
+            attributes = [(item.attribute_value.type.name, item.attribute_value.value) for item in sku.sku_attributes.all()]
+            row.update(sku=sku.sku, price=sku.price, quantity=sku.quantity, attributes=format_pairs(attributes, format))
+            yield row
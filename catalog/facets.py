@@ -0,0 +1,292 @@
+import threading
+from django.core.cache import cache
+from django.db import transaction
+from .cache import FACETS, bump_version, get_version
+from .models import AttributeType, Product, ProductAttributeValue, ProductSKU, ProductSKUAttribute
+
+# Product ids changed by each version bump, so other workers can replay small changes instead of rebuilding
+FACET_CHANGE_KEY = 'catalog:facets:change:{version}'
+FACET_CHANGE_TIMEOUT = 60 * 60
+MAX_REPLAYED_CHANGES = 500
+
+
+def _bitmap(positions):
+    """Build an int bitmap from bit positions in one pass, setting bits one by one on a big int is quadratic."""
+    positions = list(positions)
+    if not positions:
+        return 0
+    buffer = bytearray(max(positions) // 8 + 1)
+    for position in positions:
+        buffer[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+class FacetIndex:
+    """
+    In-process inverted index from attribute values to in-stock SKUs, stored as Python int bitmaps,
+    so filters and counts are big-int AND/OR/popcount operations over the whole category at once.
+
+    Every product owns a contiguous run of bits (one per SKU plus spare slots) followed by a zero guard bit.
+    Adding the mask of all SKU bits to a SKU bitmap carries into the guard bit of exactly the products that
+    have at least one SKU set, so distinct products are counted without decoding the bitmap.
+    Filters match SKUs (size 42 AND black means one SKU that is both), counts are in products.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.version = None  # Shared version the index is up to date with
+        self.ready = False
+        self._reset()
+
+    def _reset(self):
+        self.end = 0  # First unallocated bit
+        self.ones = 0  # All SKU bits
+        self.guards = 0  # All guard bits
+        self.available = 0  # Active, in-stock SKUs of active products
+        self.values = {}  # Attribute value id -> SKUs having it
+        self.categories = {}  # Category id -> all SKU bits of its products
+        self.products = {}  # Product id -> allocation, category and SKU slots
+        self.guard_products = {}  # Guard bit -> product id
+        self.value_info = {}  # Attribute value id -> (attribute type id, value)
+        self.type_names = {}  # Attribute type id -> name
+        self.type_values = {}  # Attribute type id -> attribute value ids
+
+    # Loading
+    def _fetch(self, product_ids=None):
+        """Read the products, SKUs and SKU attribute values needed to index the given products (all if None)."""
+        products = Product.objects.order_by('id')
+        skus = ProductSKU.objects.order_by('product_id', 'id')
+        links = ProductSKUAttribute.objects.all()
+        if product_ids is not None:
+            products = products.filter(id__in=product_ids)
+            skus = skus.filter(product_id__in=product_ids)
+            links = links.filter(sku__product_id__in=product_ids)
+
+        sku_values = {}
+        for sku_id, value_id in links.values_list('sku_id', 'attribute_value_id'):
+            sku_values.setdefault(sku_id, []).append(value_id)
+        product_skus = {}
+        for sku_id, product_id, quantity, is_active in skus.values_list('id', 'product_id', 'quantity', 'is_active'):
+            product_skus.setdefault(product_id, []).append(
+                (sku_id, is_active and quantity > 0, tuple(sku_values.get(sku_id, ())))
+            )
+        return [
+            (product_id, category_id, is_active, product_skus.get(product_id, []))
+            for product_id, category_id, is_active in products.values_list('id', 'category_id', 'is_active')
+        ]
+
+    def _load_values(self, value_ids=None):
+        """Load the labels of active attribute values (only the given ones if value_ids is set)."""
+        values = ProductAttributeValue.objects.filter(is_active=True, type__is_active=True)
+        if value_ids is not None:
+            values = values.filter(id__in=value_ids)
+        else:
+            self.type_names = dict(AttributeType.objects.filter(is_active=True).values_list('id', 'name'))
+        for value_id, type_id, value in values.values_list('id', 'type_id', 'value'):
+            self.value_info[value_id] = (type_id, value)
+            self.type_values.setdefault(type_id, []).append(value_id)
+
+    def rebuild(self):
+        """Index every SKU from scratch, positions follow product ids so higher bits are newer products."""
+        with self.lock:
+            self._reset()
+            available, values, categories, ones, guards = [], {}, {}, [], []
+            for product_id, category_id, is_active, skus in self._fetch():
+                start, capacity = self._allocate(product_id, category_id, len(skus))
+                ones.extend(range(start, start + capacity))
+                guards.append(start + capacity)
+                categories.setdefault(category_id, []).extend(range(start, start + capacity))
+                for slot, (sku_id, in_stock, value_ids) in enumerate(skus, start):
+                    self.products[product_id]['skus'][sku_id] = slot
+                    if in_stock and is_active:
+                        available.append(slot)
+                    for value_id in value_ids:
+                        values.setdefault(value_id, []).append(slot)
+                self.products[product_id]['values'] = {value_id for sku in skus for value_id in sku[2]}
+
+            self.ones, self.guards, self.available = _bitmap(ones), _bitmap(guards), _bitmap(available)
+            self.values = {value_id: _bitmap(slots) for value_id, slots in values.items()}
+            self.categories = {category_id: _bitmap(slots) for category_id, slots in categories.items()}
+            self._load_values()
+            self.ready = True
+
+    def _allocate(self, product_id, category_id, sku_count):
+        """Reserve a run of bits for a product at the end of the index, with room for more SKUs."""
+        start, capacity = self.end, sku_count + max(4, sku_count)
+        self.end = start + capacity + 1
+        self.products[product_id] = {'start': start, 'capacity': capacity, 'category_id': category_id, 'skus': {}, 'values': set()}
+        self.guard_products[start + capacity] = product_id
+        return start, capacity
+
+    # Incremental updates
+    def apply(self, product_ids):
+        """
+        Re-index the given products from the database. Returns False when a product outgrew its spare
+        slots, the index is then marked stale and rebuilt on the next query.
+        """
+        with self.lock:
+            if not self.ready:
+                return True
+            rows = {row[0]: row for row in self._fetch(product_ids)}
+            missing_values = set()
+            for product_id in product_ids:
+                self._clear(product_id)
+                if product_id not in rows:
+                    continue
+                _, category_id, is_active, skus = rows[product_id]
+                if product_id not in self.products:
+                    start, capacity = self._allocate(product_id, category_id, len(skus))
+                    group = ((1 << capacity) - 1) << start
+                    self.ones |= group
+                    self.guards |= 1 << (start + capacity)
+                record = self.products[product_id]
+                if len(skus) > record['capacity']:
+                    self.ready = False
+                    return False
+
+                group = ((1 << record['capacity']) - 1) << record['start']
+                record['category_id'] = category_id
+                self.categories[category_id] = self.categories.get(category_id, 0) | group
+                for slot, (sku_id, in_stock, value_ids) in enumerate(skus, record['start']):
+                    bit = 1 << slot
+                    record['skus'][sku_id] = slot
+                    if in_stock and is_active:
+                        self.available |= bit
+                    for value_id in value_ids:
+                        self.values[value_id] = self.values.get(value_id, 0) | bit
+                        record['values'].add(value_id)
+                        if value_id not in self.value_info:
+                            missing_values.add(value_id)
+            if missing_values:
+                self._load_values(missing_values)
+            return True
+
+    def _clear(self, product_id):
+        """Clear every bit of a product, keeping its allocation for the re-index."""
+        record = self.products.get(product_id)
+        if record is None:
+            return
+        keep = ~(((1 << record['capacity']) - 1) << record['start'])
+        self.available &= keep
+        for value_id in record['values']:
+            self.values[value_id] &= keep
+        if record['category_id'] in self.categories:
+            self.categories[record['category_id']] &= keep
+        record['skus'], record['values'] = {}, set()
+
+    def sync(self):
+        """Bring the index up to date with writes made by other workers, replaying small changes or rebuilding."""
+        shared = get_version(FACETS)
+        if self.ready and (shared is None or shared == self.version):
+            return
+        with self.lock:
+            if self.ready and self.version is not None and shared is not None and 0 < shared - self.version <= MAX_REPLAYED_CHANGES:
+                keys = [FACET_CHANGE_KEY.format(version=version) for version in range(self.version + 1, shared + 1)]
+                changes = cache.get_many(keys)
+                if len(changes) == len(keys) and self.apply({pid for ids in changes.values() for pid in ids}):
+                    self.version = shared
+                    return
+            # Read before rebuilding, writes committed meanwhile are replayed again later, which is harmless
+            self.version = shared
+            self.rebuild()
+
+    def _advance(self, version):
+        with self.lock:
+            if version is not None and self.version is not None and version == self.version + 1:
+                self.version = version
+
+    # Queries
+    def count_products(self, skus):
+        """Number of distinct products with at least one SKU in the bitmap."""
+        return ((skus + self.ones) & self.guards).bit_count()
+
+    def search(self, category_ids, value_ids, offset=0, limit=20):
+        """
+        Filter the in-stock SKUs of the given categories by attribute values, ORed within an attribute type
+        and ANDed across types. Returns the matching product count, one page of product ids (newest first)
+        and the facet counts of every attribute type, each computed without that type's own selection.
+        """
+        value_ids = set(value_ids)
+        self.sync()
+        with self.lock:
+            scope = 0
+            for category_id in category_ids:
+                scope |= self.categories.get(category_id, 0)
+            scope &= self.available
+
+            selected = {}
+            for value_id in value_ids:
+                if value_id in self.value_info:
+                    type_id = self.value_info[value_id][0]
+                    selected[type_id] = selected.get(type_id, 0) | self.values.get(value_id, 0)
+
+            matched = scope
+            for skus in selected.values():
+                matched &= skus
+
+            facets = []
+            for type_id, type_value_ids in self.type_values.items():
+                if type_id not in self.type_names:
+                    continue
+                base = scope
+                for other_type_id, skus in selected.items():
+                    if other_type_id != type_id:
+                        base &= skus
+                counts = []
+                for value_id in type_value_ids:
+                    skus = self.values.get(value_id, 0) & base
+                    if skus:
+                        counts.append({
+                            'id': value_id,
+                            'value': self.value_info[value_id][1],
+                            'count': self.count_products(skus),
+                            'selected': value_id in value_ids,
+                        })
+                if counts:
+                    facets.append({'id': type_id, 'name': self.type_names[type_id], 'values': counts})
+
+            hits = (matched + self.ones) & self.guards
+            return {
+                'count': hits.bit_count(),
+                'product_ids': self._decode(hits, offset, limit),
+                'facets': facets,
+            }
+
+    def _decode(self, hits, offset, limit):
+        """Product ids of the set guard bits, from the highest bit down, skipping `offset` of them."""
+        bits = bin(hits)[2:]
+        product_ids, index, seen = [], -1, 0
+        while len(product_ids) < limit:
+            index = bits.find('1', index + 1)
+            if index == -1:
+                break
+            if seen >= offset:
+                product_ids.append(self.guard_products[len(bits) - 1 - index])
+            seen += 1
+        return product_ids
+
+
+facet_index = FacetIndex()
+
+
+def products_changed(product_ids):
+    """Re-index the given products once the current transaction commits, here and in every other worker."""
+    product_ids = set(product_ids)
+
+    def publish():
+        facet_index.apply(product_ids)
+        version = bump_version(FACETS)
+        if version is not None:
+            cache.set(FACET_CHANGE_KEY.format(version=version), product_ids, timeout=FACET_CHANGE_TIMEOUT)
+            facet_index._advance(version)
+
+    transaction.on_commit(publish)
+
+
+def invalidate_facets():
+    """Force a full rebuild everywhere, for changes to attribute types and values themselves."""
+    def publish():
+        facet_index.ready = False
+        bump_version(FACETS)
+
+    transaction.on_commit(publish)
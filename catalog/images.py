@@ -0,0 +1,141 @@
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from PIL import Image, ImageOps
+
+# Resized variants of uploaded images, generated by the background task workers (see the tasks app) once the
+# upload is committed, so requests don't wait for the resizing. Variants are stored next to the original with
+# derived names, e.g. blobs/ab/cd/abcd...jpg -> blobs/ab/cd/abcd....thumb.webp, so serializers can link them without
+# any lookup. Until a variant is written its URL answers 404 and clients show the original. Variants stay when a row
+# lets go of the original, and are deleted with it by collect_media_garbage.
+# This module is also imported by generate_image_variants' pool processes, which don't set up Django: keep Django
+# imports in functions.
+
+# Longest side in pixels, images are never upscaled
+VARIANTS = {
+    'thumb': 160,
+    'small': 480,
+    'large': 1280,
+}
+FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+DEFAULT_WORKERS = 2
+
+# Image fields with variants, as (model label, field name)
+IMAGE_FIELDS = [
+    ('catalog.Brand', 'icon'),
+    ('catalog.BrandPhoto', 'photo'),
+    ('catalog.Category', 'photo'),
+    ('catalog.Product', 'cover'),
+    ('catalog.ProductPhoto', 'photo'),
+    ('catalog.ReviewPhoto', 'image'),
+    ('accounts.User', 'avatar'),
+]
+
+_pool = None
+
+
+def variant_name(name, variant, format):
+    """Storage name of a variant of the file `name`."""
+    return f"{os.path.splitext(name)[0]}.{variant}.{format}"
+
+
+def variant_names(name):
+    return [variant_name(name, variant, format) for variant in VARIANTS for format in FORMATS]
+
+
+def resize(source, targets):
+    """
+    Write the variants of the image at path `source` to the paths in `targets`, {(variant, format): path}.
+    Runs in the worker processes. Every file is written under a temporary name and moved into place.
+    """
+    with Image.open(source) as original:
+        # JPEG can decode straight to a reduced size, enough for the largest variant
+        original.draft('RGB', (max(VARIANTS.values()),) * 2)
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+
+        # Largest first, each smaller variant is resized from the previous one
+        for variant, size in sorted(VARIANTS.items(), key=lambda item: -item[1]):
+            image = image.copy()
+            image.thumbnail((size, size), Image.LANCZOS)
+            for format, options in FORMATS.items():
+                encoded = image
+                if options['format'] == 'JPEG' and image.mode != 'RGB':
+                    # No transparency in JPEG, flatten onto white
+                    encoded = Image.new('RGB', image.size, 'white')
+                    encoded.paste(image, mask=image.getchannel('A'))
+                path = targets[(variant, format)]
+                file, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+                try:
+                    with os.fdopen(file, 'wb') as output:
+                        encoded.save(output, **options)
+                    os.replace(temp_path, path)
+                except BaseException:
+                    os.unlink(temp_path)
+                    raise
+
+
+def try_resize(source, targets):
+    """resize(), returning the error message on failure instead of raising."""
+    try:
+        resize(source, targets)
+    except Exception as e:
+        return str(e)
+
+
+def paths(storage, name):
+    """File system paths of the original and of its variants, {(variant, format): path}."""
+    targets = {
+        (variant, format): storage.path(variant_name(name, variant, format))
+        for variant in VARIANTS for format in FORMATS
+    }
+    return storage.path(name), targets
+
+
+def get_pool():
+    """Process pool of the generate_image_variants command, new uploads are resized by the task workers."""
+    global _pool
+    if _pool is None:
+        from django.conf import settings
+        # Spawned rather than forked, the workers must not share the parent's database connections
+        _pool = ProcessPoolExecutor(
+            max_workers=getattr(settings, 'IMAGE_WORKERS', DEFAULT_WORKERS), mp_context=get_context('spawn'),
+        )
+    return _pool
+
+
+def schedule(field_file):
+    """Queue the generation of the variants of an image field's file for the task workers."""
+    if not field_file or not hasattr(field_file.storage, 'path'):
+        return  # Only storages on the local file system can be written by the workers
+    from .tasks import generate_image_variants
+    generate_image_variants.delay(field_file.name)
+
+
+def register(model, field_name):
+    """Generate the variants of `field_name` whenever an instance of `model` is saved with a new file in it."""
+    from django.db.models.signals import post_init, post_save
+
+    loaded_attr = f'_loaded_{field_name}'
+
+    def remember_name(sender, instance, **kwargs):
+        value = instance.__dict__.get(field_name)
+        instance.__dict__[loaded_attr] = getattr(value, 'name', value)
+
+    def schedule_changed(sender, instance, raw=False, update_fields=None, **kwargs):
+        if raw or (update_fields is not None and field_name not in update_fields):
+            return
+        field_file = getattr(instance, field_name)
+        changed = field_file and field_file.name != instance.__dict__.get(loaded_attr)
+        instance.__dict__[loaded_attr] = field_file.name
+        if changed:
+            schedule(field_file)  # Queued with the save, run once it's committed
+
+    # The receivers are closures, keep strong references to them
+    post_init.connect(remember_name, sender=model, weak=False)
+    post_save.connect(schedule_changed, sender=model, weak=False)
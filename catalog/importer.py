@@ -0,0 +1,378 @@
+import codecs
+import csv
+import json
+from django.db import IntegrityError, transaction
+from .cache import PRODUCT, PRODUCTS
+from .conditional import invalidate_etags
+from .facets import products_changed
+from .mixins import ORDER_GAP
+from .models import (
+    AttributeType, Category, Product, ProductAttributeValue, ProductDetail, ProductSearchDocument, ProductSKU,
+    ProductSKUAttribute, ProductSummary, Sequence,
+)
+
+# Bulk catalog import. Every row of a CSV or JSONL file describes one SKU (or only details) of a product:
+#   product      reference grouping the rows of one product within the file (required)
+#   name, category, description, summary
+#                product fields, required on the first row of a product, the category by name
+#   is_active    whether the product is listed, true by default (true/false, 1/0 or yes/no)
+#   sku          SKU code, generated when empty
+#   price, quantity
+#                SKU fields, a row without them adds no SKU
+#   attributes   attribute values of the SKU by type name: "Color=black;Size=42" in CSV, an object in JSONL
+#   details      product details appended in order: "Material=Leather;Sole=Rubber" in CSV, an object in JSONL
+#                In CSV, a backslash escapes a ';', '=' or backslash in a key or value: "Fabric=Cotton\; Polyester"
+# Categories and attribute values are resolved from maps loaded once, rows are validated and written a chunk
+# at a time with bulk_create(), each chunk in its own transaction.
+
+FORMATS = ['csv', 'jsonl']
+DEFAULT_BATCH_SIZE = 2000
+
+
+def detect_format(filename):
+    """The import format of a file by its extension, None if unknown."""
+    extension = filename.rsplit('.', 1)[-1].lower()
+    return {'csv': 'csv', 'jsonl': 'jsonl', 'ndjson': 'jsonl'}.get(extension)
+
+
+class ImportFileError(ValueError):
+    """The file can't be read past `line_num`, e.g. it isn't UTF-8 or not CSV at all."""
+
+    def __init__(self, line_num, message):
+        super().__init__(message)
+        self.line_num = line_num
+
+
+def decode_lines(lines, encoding='utf-8-sig'):
+    """Text lines from byte lines, e.g. of a file opened in binary mode. A byte order mark is dropped."""
+    decoder = codecs.getincrementaldecoder(encoding)()
+    for line in lines:
+        yield decoder.decode(line)
+    decoder.decode(b'', final=True)
+
+
+def read_rows(stream, format):
+    """
+    Yield (line number, row) pairs from a text stream. Rows that can't be parsed are yielded as the exception,
+    a stream that can't be read any further raises ImportFileError.
+    """
+    line_num = 0
+    try:
+        if format == 'csv':
+            reader = csv.DictReader(stream)
+            for row in reader:
+                line_num = reader.line_num
+                yield line_num, row
+            return
+        for line_num, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                yield line_num, json.loads(line)
+            except ValueError as e:
+                yield line_num, e
+    except UnicodeDecodeError as e:
+        raise ImportFileError(line_num + 1, f"The file isn't valid UTF-8: {e.reason}.")
+    except csv.Error as e:
+        raise ImportFileError(reader.line_num + 1, f"The file isn't valid CSV: {e}.")
+
+
+def check_file(file, format):
+    """
+    Parse a file opened in binary mode without importing it, raising ImportFileError if it can't be read to
+    the end, so an unreadable file is rejected before any of it is written. The file is rewound afterwards.
+    """
+    for _ in read_rows(decode_lines(file), format):
+        pass
+    file.seek(0)
+
+
+PAIR_SEPARATOR, KEY_SEPARATOR, ESCAPE = ';', '=', '\\'
+BOOLEANS = {'true': True, '1': True, 'yes': True, 'false': False, '0': False, 'no': False}
+
+
+def escape_pair_text(text):
+    """A key or value of "key=value;key=value" text, with its separators escaped."""
+    return ''.join(ESCAPE + char if char in (PAIR_SEPARATOR, KEY_SEPARATOR, ESCAPE) else char for char in str(text))
+
+
+def has_nul(value):
+    """Whether a row value, or any key or item nested in it, contains a NUL character."""
+    if isinstance(value, str):
+        return '\x00' in value
+    if isinstance(value, dict):
+        return any(has_nul(key) or has_nul(item) for key, item in value.items())
+    if isinstance(value, list):
+        return any(has_nul(item) for item in value)
+    return False
+
+
+def parse_pairs(value):
+    """Attributes and details as (key, value) pairs, from an object, a list of pairs or "key=value;key=value"."""
+    if not value:
+        return []
+    if isinstance(value, dict):
+        return [(str(key), str(item)) for key, item in value.items()]
+    if isinstance(value, list):
+        return [(str(key), str(item)) for key, item in value]
+
+    pairs = []
+
+    def add_pair(key, text):
+        if key is not None:
+            pairs.append((key.strip(), text.strip()))
+        elif text.strip():
+            raise ValueError(f"'{text.strip()}' is not in key=value form.")
+
+    key, current, escaped = None, [], False
+    for char in str(value):
+        if escaped:
+            current.append(char)
+            escaped = False
+        elif char == ESCAPE:
+            escaped = True
+        elif char == KEY_SEPARATOR and key is None:
+            key, current = ''.join(current), []
+        elif char == PAIR_SEPARATOR:
+            add_pair(key, ''.join(current))
+            key, current = None, []
+        else:
+            current.append(char)
+    if escaped:
+        current.append(ESCAPE)  # A trailing backslash escapes nothing
+    add_pair(key, ''.join(current))
+    return pairs
+
+
+def parse_boolean(value):
+    if isinstance(value, bool):
+        return value
+    parsed = BOOLEANS.get(str(value).strip().lower())
+    if parsed is None:
+        raise ValueError(f"{value!r} is not true or false.")
+    return parsed
+
+
+class ImportResult:
+    """Counts and per-row errors of an import, updated after every chunk."""
+
+    def __init__(self):
+        self.rows = 0
+        self.products = 0
+        self.details = 0
+        self.skus = 0
+        self.errors = []  # (line number, message)
+
+    def as_dict(self, max_errors=None):
+        return {
+            'rows': self.rows,
+            'products': self.products,
+            'details': self.details,
+            'skus': self.skus,
+            'error_count': len(self.errors),
+            'errors': [{'line': line, 'error': error} for line, error in self.errors[:max_errors]],
+        }
+
+
+class CatalogImporter:
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+        self.batch_size = batch_size
+        self.progress = progress  # Called with the result after every chunk
+        self.result = ImportResult()
+        self.products = {}  # Product reference -> id of the product created for it
+        self.detail_counts = {}  # Product id -> number of details imported so far
+        self.sku_codes = set()  # Codes of the SKUs written by this import so far
+
+        self.categories = dict(Category.objects.values_list('name', 'id'))
+        self.types = {}
+        for type_id, name in AttributeType.objects.order_by('-is_active', 'id').values_list('id', 'name'):
+            self.types.setdefault(name.casefold(), type_id)
+        # Values are JSON, files carry them as text: 42 and "42" both match the value 42
+        self.values = {
+            (type_id, str(value)): value_id
+            for value_id, type_id, value in ProductAttributeValue.objects.values_list('id', 'type_id', 'value')
+        }
+
+    def run(self, rows):
+        """Import (line number, row) pairs, as yielded by read_rows(), and return the result."""
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == self.batch_size:
+                self.import_chunk(chunk)
+                chunk = []
+        if chunk:
+            self.import_chunk(chunk)
+        return self.result
+
+    def import_chunk(self, chunk):
+        self.result.rows += len(chunk)
+        # SKU codes already taken in the database, one query for the whole chunk
+        codes = [str(row['sku']) for _, row in chunk if isinstance(row, dict) and row.get('sku') not in (None, '')]
+        taken = set(ProductSKU.objects.filter(sku__in=codes).values_list('sku', flat=True)) if codes else set()
+
+        valid = []
+        new_refs, new_codes = set(), set()
+        for line_num, row in chunk:
+            try:
+                cleaned = self.clean(row, new_refs, taken, new_codes)
+            except ValueError as e:
+                self.result.errors.append((line_num, str(e)))
+                continue
+            if cleaned['product'] not in self.products:
+                new_refs.add(cleaned['product'])
+            if cleaned['sku'] is not None:
+                new_codes.add(cleaned['sku'])
+            valid.append((line_num, cleaned))
+
+        if valid:
+            try:
+                self.write(valid)
+            except IntegrityError as e:
+                # E.g. a SKU code taken concurrently, nothing of the chunk was written
+                self.result.errors.extend((line_num, f"Chunk not imported: {e}") for line_num, _ in valid)
+        if self.progress is not None:
+            self.progress(self.result)
+
+    def clean(self, row, new_refs, taken=(), new_codes=()):
+        """
+        Validate a row and resolve its references, raising ValueError with the message to report. `new_refs` and
+        `new_codes` hold the products and SKU codes of the chunk's rows cleaned so far.
+        """
+        if isinstance(row, Exception):
+            raise ValueError(f"Invalid row: {row}")
+        if not isinstance(row, dict):
+            raise ValueError("Rows must be objects.")
+        if has_nul(row):
+            # Databases can't store them in text columns
+            raise ValueError("Rows can't contain NUL characters.")
+
+        def value(key):
+            # Empty CSV cells count as missing
+            return row.get(key) if row.get(key) not in (None, '') else None
+
+        ref = value('product')
+        if ref is None:
+            raise ValueError("product is required.")
+        cleaned = {'product': str(ref), 'sku': None, 'price': None, 'attributes': []}
+
+        # Product fields, only read from the first row of a product
+        if cleaned['product'] not in self.products and cleaned['product'] not in new_refs:
+            name = value('name')
+            if name is None:
+                raise ValueError("name is required on the first row of a product.")
+            if len(str(name)) > Product._meta.get_field('name').max_length:
+                raise ValueError("name is too long.")
+            if value('category') is None:
+                raise ValueError("category is required on the first row of a product.")
+            category_id = self.categories.get(str(value('category')))
+            if category_id is None:
+                raise ValueError(f"Unknown category {value('category')!r}.")
+            try:
+                is_active = parse_boolean(value('is_active')) if value('is_active') is not None else True
+            except ValueError as e:
+                raise ValueError(f"is_active: {e}")
+            cleaned.update(
+                name=str(name), category_id=category_id,
+                description=str(value('description') or ''), summary=str(value('summary') or ''), is_active=is_active,
+            )
+
+        cleaned['details'] = parse_pairs(value('details'))
+        for title, _ in cleaned['details']:
+            if len(title) > ProductDetail._meta.get_field('title').max_length:
+                raise ValueError(f"Detail title {title!r} is too long.")
+
+        if value('price') is not None or value('quantity') is not None:
+            try:
+                cleaned['price'] = int(value('price'))
+                cleaned['quantity'] = int(value('quantity'))
+            except (TypeError, ValueError):
+                raise ValueError("price and quantity must be whole numbers.")
+            if cleaned['price'] < 0 or cleaned['quantity'] < 0:
+                raise ValueError("price and quantity can't be negative.")
+
+            code = value('sku')
+            if code is not None:
+                code = str(code)
+                if len(code) > ProductSKU._meta.get_field('sku').max_length:
+                    raise ValueError("sku is too long.")
+                if code in taken:
+                    raise ValueError(f"SKU {code} already exists.")
+                if code in self.sku_codes or code in new_codes:
+                    raise ValueError(f"SKU {code} appears twice.")
+                cleaned['sku'] = code
+
+            for type_name, item in parse_pairs(value('attributes')):
+                type_id = self.types.get(type_name.casefold())
+                if type_id is None:
+                    raise ValueError(f"Unknown attribute type {type_name!r}.")
+                value_id = self.values.get((type_id, item))
+                if value_id is None:
+                    raise ValueError(f"Unknown value {item!r} for attribute {type_name!r}.")
+                cleaned['attributes'].append(value_id)
+        elif value('attributes') is not None:
+            raise ValueError("attributes need a price and quantity.")
+
+        return cleaned
+
+    def write(self, rows):
+        with transaction.atomic():
+            # Products first, their ids are needed by everything else
+            new_products = {}
+            for _, cleaned in rows:
+                if cleaned['product'] not in self.products and cleaned['product'] not in new_products:
+                    new_products[cleaned['product']] = Product(
+                        name=cleaned['name'], category_id=cleaned['category_id'],
+                        description=cleaned['description'], summary=cleaned['summary'], is_active=cleaned['is_active'],
+                    )
+            Product.objects.bulk_create(new_products.values(), batch_size=self.batch_size)
+            products = {**self.products, **{ref: product.pk for ref, product in new_products.items()}}
+
+            ProductSKU.reserve_codes([cleaned['sku'] for _, cleaned in rows if cleaned['sku']])
+            missing_codes = sum(1 for _, cleaned in rows if cleaned['price'] is not None and not cleaned['sku'])
+            generated = iter(ProductSKU.allocate_codes(missing_codes))
+            details, skus, sku_values, touched = [], [], [], set()
+            detail_counts = dict(self.detail_counts)
+            for _, cleaned in rows:
+                product_id = products[cleaned['product']]
+                touched.add(product_id)
+                for title, text in cleaned['details']:
+                    detail_counts[product_id] = detail_counts.get(product_id, 0) + 1
+                    details.append(ProductDetail(
+                        product_id=product_id, title=title, value=text, order_num=detail_counts[product_id] * ORDER_GAP,
+                    ))
+                if cleaned['price'] is not None:
+                    skus.append(ProductSKU(
+                        product_id=product_id, sku=cleaned['sku'] or next(generated),
+                        price=cleaned['price'], quantity=cleaned['quantity'],
+                    ))
+                    sku_values.append(cleaned['attributes'])
+            ProductDetail.objects.bulk_create(details, batch_size=self.batch_size)
+            # The products are this import's own: start their detail sequences after the imported details
+            Sequence.objects.bulk_create(
+                [
+                    Sequence(name=ProductDetail.order_sequence(product_id), value=detail_counts[product_id] * ORDER_GAP)
+                    for product_id in {detail.product_id for detail in details}
+                ],
+                update_conflicts=True, unique_fields=['name'], update_fields=['value'], batch_size=self.batch_size,
+            )
+            ProductSKU.objects.bulk_create(skus, batch_size=self.batch_size)
+            ProductSKUAttribute.objects.bulk_create([
+                ProductSKUAttribute(sku_id=sku.pk, attribute_value_id=value_id)
+                for sku, value_ids in zip(skus, sku_values) for value_id in dict.fromkeys(value_ids)
+            ], batch_size=self.batch_size)
+
+            # bulk_create() skips the model signals, refresh what they would have
+            ProductSummary.refresh_for_products(touched)
+            if new_products:
+                ProductSearchDocument.refresh_for_products([product.pk for product in new_products.values()])
+            products_changed(touched)
+            invalidate_etags(PRODUCTS, *(PRODUCT.format(id=product_id) for product_id in touched))
+
+        # Only kept once the chunk is committed
+        self.products = products
+        self.detail_counts = detail_counts
+        self.sku_codes.update(cleaned['sku'] for _, cleaned in rows if cleaned['sku'])
+        self.result.products += len(new_products)
+        self.result.details += len(details)
+        self.result.skus += len(skus)
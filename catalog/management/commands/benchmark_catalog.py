@@ -0,0 +1,295 @@
+import time
+import uuid
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.urls import reverse
+from rest_framework.test import APIRequestFactory, force_authenticate
+from accounts.models import User
+from catalog.facets import facet_index
+from catalog.importer import CatalogImporter
+from catalog.variants import create_sku_matrix
+from catalog.search import search_product_ids
+from catalog.models import (
+    AttributeGroup, AttributeType, Category, CategoryClosure, Product, ProductAttributeValue, ProductDetail, ProductSKU,
+    ProductSearchDocument, ProductSKUAttribute, ProductSummary, ReviewPhoto, ReviewSection, ReviewText, ReviewVideo,
+)
+from catalog.serializers import ReviewSectionDetailSerializer
+from catalog.views import PublicProductListView
+
+
+class Rollback(Exception):
+    """Raised to roll back the benchmark data once a scenario has run."""
+
+
+class Command(BaseCommand):
+    help = "Benchmark catalog operations against generated data. Everything is rolled back afterwards."
+
+    scenarios = ['propagation', 'facets', 'search', 'price', 'reviews', 'details', 'import', 'matrix']
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=self.scenarios, help="Scenario to run.")
+        parser.add_argument('--nodes', type=int, default=5000, help="Number of generated categories.")
+        parser.add_argument('--fanout', type=int, default=10, help="Subcategories per category in the generated tree.")
+        parser.add_argument('--skus', type=int, default=100000, help="Number of generated SKUs.")
+        parser.add_argument('--products', type=int, default=1000000, help="Number of generated products.")
+        parser.add_argument('--sizes', default='10000,50000,200000', help="Catalog sizes (products) the price scenario grows through.")
+        parser.add_argument('--pages', type=int, default=50, help="Depth of the deep page of the price scenario.")
+        parser.add_argument('--sections', type=int, default=20, help="Review sections of the generated product.")
+        parser.add_argument('--items', type=int, default=30, help="Review items (texts, photos, videos) per section.")
+        parser.add_argument('--details', type=int, default=500, help="Specification rows (product details) of the generated product.")
+        parser.add_argument('--variants', default='25,20', help="Values per attribute type of the matrix scenario.")
+        parser.add_argument('--batch-size', type=int, default=2000, help="Rows per chunk of the import scenario.")
+        parser.add_argument('--repeat', type=int, default=3, help="Number of timed runs.")
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                getattr(self, f"run_{options['scenario']}")(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def measure(self, label, func, repeat):
+        """Run func `repeat` times and report the best time and the statements of the last run."""
+        timings = []
+        for _ in range(repeat):
+            statements = []
+
+            def count(execute, sql, params, many, context):
+                statements.append(sql)
+                return execute(sql, params, many, context)
+
+            with connection.execute_wrapper(count):
+                start = time.perf_counter()
+                func()
+                timings.append(time.perf_counter() - start)
+        self.stdout.write(f"{label}: best {min(timings) * 1000:.1f} ms, {len(statements)} statements")
+
+    def build_category_tree(self, nodes, fanout):
+        """Bulk-create a balanced category tree of `nodes` categories and return its root."""
+        prefix = uuid.uuid4().hex[:8]
+        root = Category.objects.create(name=f'bench-{prefix}-0')
+        created, level, parents = 1, 1, [root]
+        while created < nodes:
+            batch = []
+            for parent in parents:
+                for _ in range(fanout):
+                    if created + len(batch) >= nodes:
+                        break
+                    batch.append(Category(name=f'bench-{prefix}-{created + len(batch)}', parent=parent, level=level))
+            parents = Category.objects.bulk_create(batch, batch_size=1000)
+            created, level = created + len(batch), level + 1
+        CategoryClosure.rebuild()
+        return root
+
+    def run_propagation(self, options):
+        root = self.build_category_tree(options['nodes'], options['fanout'])
+        groups = AttributeGroup.objects.bulk_create([AttributeGroup(name=f'bench-group-{i}') for i in range(3)])
+        Category.attribute_groups.through.objects.bulk_create([
+            Category.attribute_groups.through(category_id=root.id, attributegroup_id=group.id) for group in groups
+        ])
+        self.stdout.write(f"Propagating {len(groups)} attribute groups over {options['nodes']} categories")
+        self.measure('propagate_attribute_groups_to_subcategories', root.propagate_attribute_groups_to_subcategories, options['repeat'])
+
+    def run_facets(self, options):
+        """Facet search over one category holding `skus` SKUs, 4 per product, sized and colored."""
+        category = Category.objects.create(name=f'bench-{uuid.uuid4().hex[:8]}')
+        size, color = AttributeType.objects.create(name='bench-size'), AttributeType.objects.create(name='bench-color')
+        sizes = ProductAttributeValue.objects.bulk_create([ProductAttributeValue(type=size, value=36 + i) for i in range(10)])
+        colors = ProductAttributeValue.objects.bulk_create([ProductAttributeValue(type=color, value=f'color-{i}') for i in range(8)])
+
+        products = Product.objects.bulk_create(
+            [Product(name=f'bench-{i}', description='', summary='', category=category) for i in range(options['skus'] // 4)],
+            batch_size=1000,
+        )
+        skus = ProductSKU.objects.bulk_create([
+            ProductSKU(sku=f'bench-{product.id}-{i}', product=product, price=100, quantity=(product.id + i) % 3)
+            for product in products for i in range(4)
+        ], batch_size=1000)
+        ProductSKUAttribute.objects.bulk_create([
+            ProductSKUAttribute(sku=sku, attribute_value=value)
+            for n, sku in enumerate(skus) for value in (sizes[n % 10], colors[(n // 3) % 8])
+        ], batch_size=1000)
+
+        self.stdout.write(f"Facet search over {len(skus)} SKUs of {len(products)} products")
+        category_ids = [category.id]
+        self.measure('rebuild', facet_index.rebuild, 1)
+        self.measure('search, no filter', lambda: facet_index.search(category_ids, []), options['repeat'])
+        self.measure('search, size 42', lambda: facet_index.search(category_ids, [sizes[6].id]), options['repeat'])
+        self.measure(
+            'search, size 42 or 43 and color-1',
+            lambda: facet_index.search(category_ids, [sizes[6].id, sizes[7].id, colors[1].id]),
+            options['repeat'],
+        )
+
+    def run_search(self, options):
+        """Ranked search over `products` generated products, reporting the p95 of a set of queries."""
+        words = ['leather', 'running', 'trail', 'boot', 'sandal', 'canvas', 'waterproof', 'classic', 'light', 'winter']
+        category = Category.objects.create(name=f'bench-{uuid.uuid4().hex[:8]}')
+        total = options['products']
+        for start in range(0, total, 10000):
+            products = Product.objects.bulk_create([
+                Product(
+                    name=f'{words[i % 10]} {words[(i // 10) % 10]} {i}',
+                    summary=f'{words[(i // 100) % 10]} shoe',
+                    description=f'{words[(i // 1000) % 10]} {words[(i * 7) % 10]} design',
+                    category=category,
+                )
+                for i in range(start, min(start + 10000, total))
+            ], batch_size=1000)
+            ProductSearchDocument.refresh_for_products([product.id for product in products])
+
+        self.stdout.write(f"Search over {total} products")
+        for query in ['boot', 'leather trail', 'wint', 'running shoe design', 'running shoe design ', 'shoe', 'nomatch']:
+            timings = []
+            for _ in range(max(options['repeat'], 20)):
+                start = time.perf_counter()
+                search_product_ids(query, limit=21)
+                timings.append(time.perf_counter() - start)
+            timings.sort()
+            p95 = timings[int(len(timings) * 0.95) - 1]
+            self.stdout.write(f"'{query}': p95 {p95 * 1000:.1f} ms")
+
+    def run_price(self, options):
+        """
+        Pages of the public list filtered by a price range and sorted by price, as the catalog grows: the first page
+        and the one --pages deep, through the view with its queryset and cursors. Signed in, so the response cache
+        doesn't answer.
+        """
+        factory = APIRequestFactory()
+        list_view = PublicProductListView.as_view()
+
+        def get(url):
+            request = factory.get(url)
+            force_authenticate(request, user=User(username='bench'))
+            response = list_view(request)
+            response.render()
+            return response
+
+        category = Category.objects.create(name=f'bench-{uuid.uuid4().hex[:8]}')
+        created = 0
+        for size in [int(size) for size in options['sizes'].split(',')]:
+            while created < size:
+                batch = min(10000, size - created)
+                products = Product.objects.bulk_create(
+                    [Product(name=f'bench-{created + i}', description='', summary='', category=category) for i in range(batch)],
+                    batch_size=1000,
+                )
+                # Three SKUs per product, one of them out of stock
+                skus = [
+                    ProductSKU(sku=f'bench-{product.id}-{i}', product=product, price=(product.id * 37 + i * 211) % 1000, quantity=(product.id + i) % 3)
+                    for product in products for i in range(3)
+                ]
+                ProductSKU.objects.bulk_create(skus, batch_size=1000)
+                ProductSummary.refresh_for_products([product.id for product in products])
+                created += batch
+
+            for ordering in ['price', '-price']:
+                first = f"{reverse('public-product-list')}?category={category.id}&min_price=200&max_price=400&ordering={ordering}"
+                deep = first
+                for _ in range(options['pages'] - 1):
+                    deep = get(deep).data['next'] or deep
+                self.measure(f"{size} products, 200-400 by {ordering}, first page", lambda: get(first), options['repeat'])
+                self.measure(f"{size} products, 200-400 by {ordering}, page {options['pages']}", lambda: get(deep), options['repeat'])
+
+    def run_reviews(self, options):
+        """Render the review sections of one product with many items, with and without prefetching the items."""
+        category = Category.objects.create(name=f'bench-{uuid.uuid4().hex[:8]}')
+        product = Product.objects.create(name='bench', description='', summary='', category=category)
+        sections = ReviewSection.objects.bulk_create([
+            ReviewSection(product=product, title=f'Section {i}', order_num=i + 1) for i in range(options['sections'])
+        ])
+        texts, photos, videos = [], [], []
+        for section in sections:
+            # Item types interleave, so every section really needs merging
+            for i in range(options['items']):
+                if i % 3 == 0:
+                    texts.append(ReviewText(review_section=section, text='text', order_num=i + 1))
+                elif i % 3 == 1:
+                    photos.append(ReviewPhoto(review_section=section, image='review_photos/bench.jpg', position=ReviewPhoto.CENTER_LARGE, order_num=i + 1))
+                else:
+                    videos.append(ReviewVideo(review_section=section, video='review_videos/bench.mp4', order_num=i + 1))
+        ReviewText.objects.bulk_create(texts, batch_size=1000)
+        ReviewPhoto.objects.bulk_create(photos, batch_size=1000)
+        ReviewVideo.objects.bulk_create(videos, batch_size=1000)
+
+        queryset = ReviewSection.objects.filter(product=product).order_by('order_num')
+        self.stdout.write(f"{len(sections)} review sections with {len(texts) + len(photos) + len(videos)} items")
+        self.measure('without prefetch', lambda: ReviewSectionDetailSerializer(queryset.all(), many=True).data, options['repeat'])
+        self.measure(
+            'prefetched',
+            lambda: ReviewSectionDetailSerializer(queryset.prefetch_related('texts', 'photos', 'videos'), many=True).data,
+            options['repeat'],
+        )
+
+    def run_details(self, options):
+        """Apply a full permutation to the details of one product, row by row and in bulk."""
+        category = Category.objects.create(name=f'bench-{uuid.uuid4().hex[:8]}')
+        product = Product.objects.create(name='bench', description='', summary='', category=category)
+        details = ProductDetail.objects.bulk_create([
+            ProductDetail(product=product, title=f'Spec {i}', value='value', order_num=i + 1) for i in range(options['details'])
+        ], batch_size=1000)
+        ids = [detail.id for detail in details]
+
+        def permutation():
+            # Rotate the current order by one, so every run moves every row
+            current = list(ProductDetail.objects.filter(product=product).order_by('order_num').values_list('id', flat=True))
+            return {pk: position for position, pk in enumerate(current[1:] + current[:1], 1)}
+
+        def row_by_row():
+            # Temporary numbers above the current ones, then the final ones, one UPDATE per row each time
+            order_nums = permutation()
+            temp = max(ProductDetail.objects.filter(product=product).values_list('order_num', flat=True)) + 1
+            for offset, pk in enumerate(ids):
+                ProductDetail.objects.filter(id=pk).update(order_num=temp + offset)
+            for pk, order_num in order_nums.items():
+                ProductDetail.objects.filter(id=pk).update(order_num=order_num)
+
+        self.stdout.write(f"Reordering {len(details)} details of one product")
+        self.measure('row by row', row_by_row, options['repeat'])
+        self.measure('bulk', lambda: ProductDetail.reorder(product.id, permutation()), options['repeat'])
+
+    def run_import(self, options):
+        """Import `skus` SKU rows, 4 per product with a size and a color each, through the bulk importer."""
+        category = Category.objects.create(name=f'bench-{uuid.uuid4().hex[:8]}')
+        size, color = AttributeType.objects.create(name='bench-size'), AttributeType.objects.create(name='bench-color')
+        ProductAttributeValue.objects.bulk_create([ProductAttributeValue(type=size, value=36 + i) for i in range(10)])
+        ProductAttributeValue.objects.bulk_create([ProductAttributeValue(type=color, value=f'color-{i}') for i in range(8)])
+
+        def rows():
+            for n in range(options['skus']):
+                row = {
+                    'product': str(n // 4), 'price': n % 1000, 'quantity': n % 3,
+                    'attributes': {'bench-size': 36 + n % 10, 'bench-color': f'color-{n % 8}'},
+                }
+                if n % 4 == 0:
+                    row.update(name=f'bench-{n // 4}', category=category.name, details={'Material': 'Leather'})
+                yield n + 1, row
+
+        self.stdout.write(f"Importing {options['skus']} SKUs")
+        start = time.perf_counter()
+        result = CatalogImporter(batch_size=options['batch_size']).run(rows())
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"{result.skus} SKUs of {result.products} products in {elapsed:.1f} s, "
+            f"{result.skus / elapsed:.0f} SKUs/s, {len(result.errors)} errors"
+        )
+
+    def run_matrix(self, options):
+        """Create the SKU matrix of one product, a fresh product each run."""
+        category = Category.objects.create(name=f'bench-{uuid.uuid4().hex[:8]}')
+        values_by_type = {}
+        for index, count in enumerate(int(count) for count in options['variants'].split(',')):
+            attribute_type = AttributeType.objects.create(name=f'bench-type-{index}')
+            values = ProductAttributeValue.objects.bulk_create([ProductAttributeValue(type=attribute_type, value=i) for i in range(count)])
+            values_by_type[attribute_type.id] = [value.id for value in values]
+
+        def create():
+            product = Product.objects.create(name='bench', description='', summary='', category=category)
+            create_sku_matrix(product.id, values_by_type, price=100, quantity=1)
+
+        variants = 1
+        for values in values_by_type.values():
+            variants *= len(values)
+        self.stdout.write(f"Creating a matrix of {variants} SKUs")
+        self.measure('create_sku_matrix', create, options['repeat'])
@@ -0,0 +1,19 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from catalog.media import SHARDS, collect_garbage
+
+
+class Command(BaseCommand):
+    help = "Delete stored media files that no row references any more, a few shards of the store per run."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shards', type=int, default=16, help=f"Shards walked, out of {SHARDS}, from where the last run stopped.")
+        parser.add_argument('--all', action='store_true', help="Walk the whole store.")
+        parser.add_argument('--grace-hours', type=float, default=24, help="Keep files written or reused this recently.")
+
+    def handle(self, *args, **options):
+        shards = SHARDS if options['all'] else options['shards']
+        walked, deleted, freed = collect_garbage(default_storage, shards=shards, grace=options['grace_hours'] * 3600)
+        self.stdout.write(self.style.SUCCESS(
+            f"Walked shards {walked[0]} to {walked[-1]}, deleted {deleted} files ({freed / (1024 * 1024):.1f} MB)."
+        ))
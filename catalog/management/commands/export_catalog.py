@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from catalog.export import CATALOG_FIELDS, CHUNK_SIZE, EXPORT_FORMATS, catalog_rows, export_stream, write_export
+
+
+class Command(BaseCommand):
+    help = "Export the catalog, one row per SKU, in the format accepted by import_catalog."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help="File to write, standard output by default.")
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv', help="File format.")
+        parser.add_argument('--gzip', action='store_true', help="Compress the output.")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="Products read from the database at a time.")
+
+    def handle(self, *args, **options):
+        rows = catalog_rows(options['format'], chunk_size=options['chunk_size'])
+        write_export(export_stream(rows, CATALOG_FIELDS, options['format'], options['gzip']), options['path'])
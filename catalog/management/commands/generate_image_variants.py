@@ -0,0 +1,37 @@
+import os
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from catalog.images import IMAGE_FIELDS, get_pool, paths, try_resize
+
+
+class Command(BaseCommand):
+    help = "Generate the resized variants of stored images missing them, e.g. images uploaded before variants existed."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Regenerate every variant, even existing ones.")
+
+    def handle(self, *args, **options):
+        jobs = {}
+        for label, field_name in IMAGE_FIELDS:
+            model = apps.get_model(label)
+            storage = model._meta.get_field(field_name).storage
+            names = model.objects.exclude(**{f'{field_name}__isnull': True}).exclude(**{field_name: ''}) \
+                .values_list(field_name, flat=True).distinct()
+            for name in names.iterator():
+                source, targets = paths(storage, name)
+                if source in jobs or not os.path.exists(source):
+                    continue
+                if options['force'] or not all(os.path.exists(path) for path in targets.values()):
+                    jobs[source] = targets
+
+        if settings.IMAGE_WORKERS == 0:
+            errors = [try_resize(source, targets) for source, targets in jobs.items()]
+        else:
+            errors = get_pool().map(try_resize, jobs.keys(), jobs.values())
+        failed = 0
+        for source, error in zip(jobs, errors):
+            if error is not None:
+                failed += 1
+                self.stderr.write(f"{source}: {error}")
+        self.stdout.write(self.style.SUCCESS(f"Generated the variants of {len(jobs) - failed} images, {failed} failed."))
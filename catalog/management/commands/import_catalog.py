@@ -0,0 +1,41 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from catalog.importer import (
+    DEFAULT_BATCH_SIZE, FORMATS, CatalogImporter, ImportFileError, check_file, decode_lines, detect_format, read_rows,
+)
+
+
+class Command(BaseCommand):
+    help = "Import products, details, SKUs and SKU attribute values from a CSV or JSONL file, see catalog/importer.py."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import.")
+        parser.add_argument('--format', choices=FORMATS, help="File format, by default from the extension.")
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="Rows validated and written per transaction.")
+
+    def handle(self, *args, **options):
+        format = options['format'] or detect_format(options['path'])
+        if format is None:
+            raise CommandError("Unknown file format, pass --format.")
+        start = time.perf_counter()
+
+        def progress(result):
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f"{result.rows} rows, {result.skus} SKUs ({result.skus / elapsed:.0f}/s), {len(result.errors)} errors")
+
+        importer = CatalogImporter(batch_size=options['batch_size'], progress=progress)
+        try:
+            with open(options['path'], 'rb') as file:
+                check_file(file, format)
+                result = importer.run(read_rows(decode_lines(file), format))
+        except OSError as e:
+            raise CommandError(e)
+        except ImportFileError as e:
+            raise CommandError(f"Line {e.line_num}: {e} Nothing was imported.")
+
+        for line_num, error in result.errors:
+            self.stderr.write(f"Line {line_num}: {error}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {result.products} products, {result.details} details and {result.skus} SKUs "
+            f"from {result.rows} rows in {time.perf_counter() - start:.1f}s, {len(result.errors)} rows failed."
+        ))
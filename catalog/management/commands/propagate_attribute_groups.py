@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+from catalog.models import Category
+
+
+class Command(BaseCommand):
+    help = "Propagate the attribute groups of the given categories to all of their subcategories, in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('category_ids', nargs='+', type=int, help="Ids of the categories to propagate from.")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Number of subcategories updated per transaction.")
+
+    def handle(self, *args, **options):
+        categories = list(Category.objects.filter(pk__in=options['category_ids']).order_by('level'))
+        missing = set(options['category_ids']) - {category.pk for category in categories}
+        if missing:
+            raise CommandError(f"Categories not found: {', '.join(map(str, sorted(missing)))}")
+
+        for category in categories:
+            category.propagate_attribute_groups_to_subcategories(batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f"Propagated attribute groups of '{category.name}'."))
@@ -0,0 +1,15 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from catalog.models import ChunkedUpload
+
+
+class Command(BaseCommand):
+    help = "Delete chunked uploads that stopped receiving chunks, with their staging files."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24, help="Delete uploads without a chunk for this long.")
+
+    def handle(self, *args, **options):
+        count = ChunkedUpload.discard_stale(timezone.now() - timedelta(hours=options['hours']))
+        self.stdout.write(self.style.SUCCESS(f"Deleted {count} stale uploads."))
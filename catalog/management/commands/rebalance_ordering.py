@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from catalog.ordering import MIN_GAP, SCOPES
+
+
+class Command(BaseCommand):
+    help = "Respace the order numbers of product details, review sections and review items whose gaps ran low."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-gap', type=int, default=MIN_GAP, help="Respace collections with two positions closer than this.")
+        parser.add_argument('--all', action='store_true', help="Respace every collection, however wide its gaps.")
+
+    def handle(self, *args, **options):
+        min_gap = None if options['all'] else options['min_gap']
+        collections = rows = 0
+
+        for scope in SCOPES:
+            # Each collection is respaced in its own short transaction, so moves elsewhere aren't held up
+            for key in scope.keys() if min_gap is None else scope.crowded_keys(min_gap):
+                with transaction.atomic():
+                    scope.lock(key)
+                    rows += scope.rebalance(key)
+                collections += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Respaced {collections} collections ({rows} rows)."))
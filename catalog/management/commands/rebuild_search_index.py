@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from catalog.models import Product, ProductSearchDocument
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search documents of all products."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Number of products refreshed per statement.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        processed = 0
+
+        batch = []
+        for product_id in Product.objects.order_by('id').values_list('id', flat=True).iterator(chunk_size=batch_size):
+            batch.append(product_id)
+            if len(batch) == batch_size:
+                ProductSearchDocument.refresh_for_products(batch)
+                processed += len(batch)
+                batch = []
+        if batch:
+            ProductSearchDocument.refresh_for_products(batch)
+            processed += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt search documents for {processed} products."))
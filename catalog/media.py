@@ -0,0 +1,355 @@
+import hashlib
+import mimetypes
+import os
+import re
+import stat
+import tempfile
+import time
+from collections import Counter
+from urllib.parse import quote
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, SuspiciousFileOperation
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import parse_etags
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+from django.views.static import was_modified_since
+
+# Uploads are content-addressed: MediaStorage hashes them while writing them and stores each content once, as
+# blobs/<2 hex>/<2 hex>/<sha256><extension>, whatever the field's upload_to. Saving the same image for another
+# product only adds a reference (MediaBlob), and collect_media_garbage deletes blobs left without any.
+#
+# Media is served in production as well as in development. A blob's URL changes with its content, so blobs are
+# cacheable for a year, and so are the image variants of a blob, named after its hash (<sha256>.<variant>.<format>).
+# Their URLs are known without touching the disk. Other files (from before blobs) get a fingerprint in their URL
+# (?v=...), and a request with the current fingerprint is cacheable for a year too. The view only checks the request and hands the
+# file to the front proxy (X-Accel-Redirect for nginx, X-Sendfile for Apache/lighttpd, see MEDIA_ACCEL), which sends
+# the bytes and answers Range requests: workers never stream media in production. With DEBUG on and no proxy, e.g.
+# under runserver, Django sends the files itself, with single byte ranges for video seeking.
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+STREAM_BUFFER_SIZE = 64 * 1024
+HASH_BUFFER_SIZE = 1024 * 1024
+
+BLOB_DIR = 'blobs'
+BLOB_NAME = re.compile(r'^blobs/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.[a-z0-9]{1,10})?$')
+# Image variants of a blob (see catalog/images.py), derived from its content like the blob itself
+BLOB_VARIANT_NAME = re.compile(r'^blobs/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.[a-z]{1,10}\.[a-z0-9]{1,10}$')
+SHARDS = 256  # First level directories, walked one at a time by the garbage collection
+GC_SEQUENCE = 'media:gc_shard'
+
+# Every file field storing blobs, as (model label, field name)
+MEDIA_FIELDS = [
+    ('catalog.Brand', 'icon'),
+    ('catalog.BrandPhoto', 'photo'),
+    ('catalog.BrandVideo', 'video'),
+    ('catalog.Category', 'photo'),
+    ('catalog.Product', 'cover'),
+    ('catalog.ProductPhoto', 'photo'),
+    ('catalog.ProductVideo', 'video'),
+    ('catalog.ReviewPhoto', 'image'),
+    ('catalog.ReviewVideo', 'video'),
+    ('accounts.User', 'avatar'),
+]
+
+
+def fingerprint(file_stat):
+    """Short token changing whenever the file is replaced, from its size and modification time."""
+    return hashlib.md5(f'{file_stat.st_mtime_ns}:{file_stat.st_size}'.encode()).hexdigest()[:12]
+
+
+def blob_name(digest, extension):
+    extension = extension.lower()
+    if not re.fullmatch(r'\.[a-z0-9]{1,10}', extension):
+        extension = ''
+    return f'{BLOB_DIR}/{digest[:2]}/{digest[2:4]}/{digest}{extension}'
+
+
+def is_blob(name):
+    return bool(name) and BLOB_NAME.match(name) is not None
+
+
+def is_immutable(name):
+    """Whether the file's content can never change under its name: a blob or an image variant of one."""
+    return bool(name) and (BLOB_NAME.match(name) is not None or BLOB_VARIANT_NAME.match(name) is not None)
+
+
+class MediaStorage(FileSystemStorage):
+    """
+    File system storage saving files under the hash of their content, each content once. URLs of files that may
+    change under their name carry the file's fingerprint, so they can be cached as immutable.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        return name  # _save() names the file after its content, an existing blob is the same file
+
+    def _save(self, name, content):
+        digest = hashlib.sha256()
+        if hasattr(content, 'temporary_file_path'):
+            # Already on disk (large uploads, chunked uploads): hash it, then move it rather than copy it
+            source = content.temporary_file_path()
+            with open(source, 'rb') as file:
+                for data in iter(lambda: file.read(HASH_BUFFER_SIZE), b''):
+                    digest.update(data)
+        else:
+            temp_dir = os.path.join(self.location, BLOB_DIR, 'tmp')
+            os.makedirs(temp_dir, exist_ok=True)
+            file, source = tempfile.mkstemp(dir=temp_dir)
+            try:
+                with os.fdopen(file, 'wb') as output:
+                    for data in content.chunks():
+                        digest.update(data)
+                        output.write(data)
+            except BaseException:
+                os.remove(source)
+                raise
+
+        name = blob_name(digest.hexdigest(), os.path.splitext(name)[1])
+        path = self.path(name)
+        if os.path.exists(path):
+            os.remove(source)
+            os.utime(path)  # Newly referenced, keeps the garbage collection's grace period from running out
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True, mode=self.directory_permissions_mode or 0o777)
+            file_move_safe(source, path, allow_overwrite=True)
+            if self.file_permissions_mode is not None:
+                os.chmod(path, self.file_permissions_mode)
+        return name
+
+    def url(self, name):
+        url = super().url(name)
+        if is_immutable(name):
+            return url
+        try:
+            return f'{url}?v={fingerprint(os.stat(self.path(name)))}'
+        except (OSError, ValueError):
+            return url  # Not written yet, e.g. an image variant of an older file being generated
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """
+    The (first, last) byte of a single range "bytes=first-last", "bytes=first-" or "bytes=-suffix" of a file of
+    `size` bytes. None when there is no usable range (several ranges are answered with the whole file).
+    """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    first, _, last = header[len('bytes='):].strip().partition('-')
+    try:
+        if not first:
+            suffix = int(last)
+            if suffix <= 0 or size == 0:
+                raise RangeNotSatisfiable
+            return max(size - suffix, 0), size - 1
+        first, last = int(first), int(last) if last else size - 1
+    except ValueError:
+        return None
+    if first >= size:
+        raise RangeNotSatisfiable
+    if last < first:
+        return None
+    return first, min(last, size - 1)
+
+
+def read_range(file, length):
+    with file:
+        while length > 0:
+            data = file.read(min(STREAM_BUFFER_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+def file_response(request, full_path, file_stat, etag):
+    """The file's bytes, or the requested range of them, sent by Django. For development only."""
+    byte_range = None
+    if request.headers.get('If-Range', etag) == etag:
+        try:
+            byte_range = parse_range(request.headers.get('Range'), file_stat.st_size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{file_stat.st_size}'
+            return response
+    if byte_range is None:
+        return FileResponse(open(full_path, 'rb'))
+
+    first, last = byte_range
+    file = open(full_path, 'rb')
+    file.seek(first)
+    response = StreamingHttpResponse(read_range(file, last - first + 1), status=206)
+    response['Content-Range'] = f'bytes {first}-{last}/{file_stat.st_size}'
+    response['Content-Length'] = last - first + 1
+    return response
+
+
+def accel_response(path, full_path):
+    """An empty response telling the front proxy to send the file itself."""
+    response = HttpResponse()
+    if settings.MEDIA_ACCEL == 'nginx':
+        response['X-Accel-Redirect'] = quote(settings.MEDIA_ACCEL_PREFIX.rstrip('/') + '/' + path)
+    else:
+        response['X-Sendfile'] = full_path
+    return response
+
+
+@require_safe
+def serve_media(request, path):
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        file_stat = os.stat(full_path)
+    except (OSError, ValueError, SuspiciousFileOperation):
+        raise Http404
+    staging = os.path.join(os.path.abspath(settings.CHUNKED_UPLOAD_ROOT), '')
+    if not stat.S_ISREG(file_stat.st_mode) or full_path.startswith(staging):
+        raise Http404
+
+    version = fingerprint(file_stat)
+    etag = f'"{version}"'
+    if_none_match = request.headers.get('If-None-Match')
+    if (if_none_match and (etag in parse_etags(if_none_match) or if_none_match.strip() == '*')) or (
+            not if_none_match and not was_modified_since(request.headers.get('If-Modified-Since'), file_stat.st_mtime)):
+        response = HttpResponseNotModified()
+    elif settings.MEDIA_ACCEL:
+        response = accel_response(path, full_path)
+    elif settings.DEBUG:
+        response = file_response(request, full_path, file_stat, etag)
+    else:
+        # Reported by `check --deploy` too (catalog.E001)
+        raise ImproperlyConfigured("MEDIA_ACCEL must be set when DEBUG is off, media is sent by the front proxy.")
+
+    content_type, _ = mimetypes.guess_type(full_path)
+    if response.status_code != 304:
+        response['Content-Type'] = content_type or 'application/octet-stream'
+    if response.status_code != 416:
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(file_stat.st_mtime)
+        response['Accept-Ranges'] = 'bytes'
+        # Blobs, their variants and versioned URLs change with the file, others may be replaced in place
+        if is_immutable(path) or request.GET.get('v') == version:
+            response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        else:
+            response['Cache-Control'] = f'public, max-age={settings.MEDIA_CACHE_MAX_AGE}'
+    return response
+
+
+def track_references(model, field_name):
+    """Count the references of `model`'s `field_name` to blobs in MediaBlob, as rows are saved and deleted."""
+    from django.db.models.signals import post_delete, post_init, post_save
+    from .models import MediaBlob
+
+    stored_attr = f'_stored_{field_name}'
+
+    def remember_name(sender, instance, **kwargs):
+        value = instance.__dict__.get(field_name)
+        instance.__dict__[stored_attr] = getattr(value, 'name', value)
+
+    def count_reference(sender, instance, **kwargs):
+        name = getattr(instance, field_name).name
+        stored = instance.__dict__.get(stored_attr)
+        if name != stored:
+            if is_blob(name):
+                MediaBlob.reference(name)
+            if is_blob(stored):
+                MediaBlob.release(stored)
+            instance.__dict__[stored_attr] = name
+
+    def release_reference(sender, instance, **kwargs):
+        stored = instance.__dict__.get(stored_attr)
+        if is_blob(stored):
+            MediaBlob.release(stored)
+
+    # The receivers are closures, keep strong references to them
+    post_init.connect(remember_name, sender=model, weak=False)
+    post_save.connect(count_reference, sender=model, weak=False)
+    post_delete.connect(release_reference, sender=model, weak=False)
+
+
+def count_references(names):
+    """How many rows of the media fields reference each of the blob `names`, straight from the tables."""
+    counts = Counter()
+    for label, field_name in MEDIA_FIELDS:
+        counts.update(apps.get_model(label).objects.filter(**{f'{field_name}__in': names}).values_list(field_name, flat=True))
+    return counts
+
+
+def collect_shard(storage, shard, grace):
+    """
+    Delete the blobs of one shard (first level directory) that nothing references and that weren't written or
+    reused in the last `grace` seconds, with their image variants. Returns the number of files and bytes deleted.
+    Reference counts pick the candidates, which are checked against the tables before going: counts that drifted
+    (e.g. after a queryset update()) are repaired instead.
+    """
+    from .models import MediaBlob
+
+    # Files by content hash: the blob (once per extension it was uploaded with) and its variants
+    groups = {}
+    for directory, _, filenames in os.walk(storage.path(f'{BLOB_DIR}/{shard}')):
+        for filename in filenames:
+            groups.setdefault(filename.split('.', 1)[0], []).append(os.path.join(directory, filename))
+    blobs = {}
+    for digest, paths in groups.items():
+        for path in paths:
+            name = os.path.relpath(path, storage.location).replace(os.sep, '/')
+            if is_blob(name):
+                blobs[name] = digest
+
+    used = set(MediaBlob.objects.filter(name__in=list(blobs), refcount__gt=0).values_list('name', flat=True))
+    candidates = [name for name in blobs if name not in used]
+    for name, count in count_references(candidates).items():
+        MediaBlob.objects.update_or_create(name=name, defaults={'refcount': count})
+        used.add(name)
+
+    deleted = freed = 0
+    cutoff = time.time() - grace
+    used_digests = {blobs[name] for name in used}
+    for digest, paths in groups.items():
+        if digest in used_digests:
+            continue
+        try:
+            if any(os.stat(path).st_mtime > cutoff for path in paths):
+                continue
+            for path in paths:
+                freed += os.stat(path).st_size
+                os.remove(path)
+                deleted += 1
+        except FileNotFoundError:
+            continue
+    MediaBlob.objects.filter(name__in=[name for name in candidates if name not in used], refcount__lte=0).delete()
+    return deleted, freed
+
+
+def collect_garbage(storage, shards=SHARDS, grace=24 * 3600):
+    """
+    Collect `shards` shards, continuing from where the previous collection stopped, so a large store is walked a
+    bit at a time. Returns the shards walked and the number of files and bytes deleted.
+    """
+    from .models import Sequence
+
+    first = Sequence.allocate(GC_SEQUENCE, count=shards) - 1  # Numbers start at 1
+    walked = [f'{number % SHARDS:02x}' for number in range(first, first + shards)]
+    deleted = freed = 0
+
+    # Leftovers of uploads interrupted while being hashed
+    temp_dir = storage.path(f'{BLOB_DIR}/tmp')
+    for filename in os.listdir(temp_dir) if os.path.isdir(temp_dir) else []:
+        path = os.path.join(temp_dir, filename)
+        try:
+            if os.stat(path).st_mtime < time.time() - grace:
+                freed += os.stat(path).st_size
+                os.remove(path)
+                deleted += 1
+        except FileNotFoundError:
+            continue
+    for shard in dict.fromkeys(walked):
+        files, size = collect_shard(storage, shard, grace)
+        deleted += files
+        freed += size
+    return walked, deleted, freed
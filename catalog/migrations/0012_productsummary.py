@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Q, Sum
+
+
+def build_product_summaries(apps, schema_editor):
+    Product = apps.get_model('catalog', 'Product')
+    ProductSKU = apps.get_model('catalog', 'ProductSKU')
+    ProductSummary = apps.get_model('catalog', 'ProductSummary')
+
+    stats = {
+        row['product']: row
+        for row in ProductSKU.objects.order_by().values('product').annotate(
+            min_price=Min('price'),
+            max_price=Max('price'),
+            total_stock=Sum('quantity'),
+            active_sku_count=Count('id', filter=Q(is_active=True)),
+            in_stock_count=Count('id', filter=Q(quantity__gt=0)),
+        )
+    }
+    summaries = []
+    for product_id in Product.objects.values_list('id', flat=True):
+        row = stats.get(product_id)
+        if row is None:
+            summaries.append(ProductSummary(product_id=product_id))
+            continue
+        summaries.append(ProductSummary(
+            product_id=product_id,
+            min_price=row['min_price'],
+            max_price=row['max_price'],
+            total_stock=row['total_stock'] or 0,
+            active_sku_count=row['active_sku_count'],
+            is_available=row['in_stock_count'] > 0,
+        ))
+    ProductSummary.objects.bulk_create(summaries, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0011_alter_productsku_price'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSummary',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='sku_summary', serialize=False, to='catalog.product')),
+                ('min_price', models.IntegerField(blank=True, null=True)),
+                ('max_price', models.IntegerField(blank=True, null=True)),
+                ('total_stock', models.IntegerField(default=0)),
+                ('active_sku_count', models.PositiveIntegerField(default=0)),
+                ('is_available', models.BooleanField(default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(build_product_summaries, migrations.RunPython.noop),
+    ]
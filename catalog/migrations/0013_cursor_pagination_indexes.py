@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0012_productsummary'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['is_active', 'created_at', 'id'], name='category_active_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['is_active', 'created_at', 'id'], name='product_active_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productsku',
+            index=models.Index(fields=['created_at', 'id'], name='productsku_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productphoto',
+            index=models.Index(fields=['product', 'id'], name='productphoto_product_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productvideo',
+            index=models.Index(fields=['product', 'id'], name='productvideo_product_id_idx'),
+        ),
+    ]
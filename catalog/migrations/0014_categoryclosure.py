@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def build_category_closure(apps, schema_editor):
+    Category = apps.get_model('catalog', 'Category')
+    CategoryClosure = apps.get_model('catalog', 'CategoryClosure')
+
+    rows = list(Category.objects.values_list('id', 'parent_id', 'level'))
+    parents = {category_id: parent_id for category_id, parent_id, _ in rows}
+    links = []
+    levels = {}
+    for category_id in parents:
+        # Walk up to the root, the number of steps is the category's level
+        depth, ancestor_id = 0, category_id
+        while ancestor_id is not None:
+            links.append(CategoryClosure(ancestor_id=ancestor_id, descendant_id=category_id, depth=depth))
+            depth, ancestor_id = depth + 1, parents[ancestor_id]
+        levels[category_id] = depth - 1
+    CategoryClosure.objects.bulk_create(links, batch_size=1000)
+
+    # Fix levels left stale on descendants of categories moved before the closure existed
+    stale = [
+        Category(id=category_id, level=levels[category_id])
+        for category_id, _, level in rows
+        if levels[category_id] != level
+    ]
+    Category.objects.bulk_update(stale, ['level'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0013_cursor_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryClosure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveIntegerField()),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='catalog.category')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='catalog.category')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['descendant', 'depth'], name='category_closure_desc_idx')],
+                'constraints': [models.UniqueConstraint(fields=('ancestor', 'descendant'), name='unique_category_closure_link')],
+            },
+        ),
+        migrations.RunPython(build_category_closure, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,122 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+POSTGRESQL_INDEX = [
+    """
+    ALTER TABLE catalog_productsearchdocument ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(categories, '')), 'B') ||
+        setweight(to_tsvector('simple', coalesce(body, '')), 'C')
+    ) STORED
+    """,
+    "CREATE INDEX catalog_productsearch_vector_idx ON catalog_productsearchdocument USING GIN (search_vector) WHERE is_active",
+]
+POSTGRESQL_INDEX_REVERSE = [
+    "DROP INDEX IF EXISTS catalog_productsearch_vector_idx",
+    "ALTER TABLE catalog_productsearchdocument DROP COLUMN IF EXISTS search_vector",
+]
+
+# External content FTS5 table holding only active products, the triggers keep it in sync with the documents.
+# The prefix indexes let search-as-you-type queries stream their matches instead of merging every completion.
+SQLITE_INDEX = [
+    """
+    CREATE VIRTUAL TABLE catalog_productsearch_fts USING fts5(
+        name, categories, body,
+        content='catalog_productsearchdocument', content_rowid='product_id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3 4 5 6'
+    )
+    """,
+    """
+    CREATE TRIGGER catalog_productsearch_fts_insert AFTER INSERT ON catalog_productsearchdocument
+    WHEN new.is_active BEGIN
+        INSERT INTO catalog_productsearch_fts(rowid, name, categories, body)
+        VALUES (new.product_id, new.name, new.categories, new.body);
+    END
+    """,
+    """
+    CREATE TRIGGER catalog_productsearch_fts_delete AFTER DELETE ON catalog_productsearchdocument
+    WHEN old.is_active BEGIN
+        INSERT INTO catalog_productsearch_fts(catalog_productsearch_fts, rowid, name, categories, body)
+        VALUES ('delete', old.product_id, old.name, old.categories, old.body);
+    END
+    """,
+    """
+    CREATE TRIGGER catalog_productsearch_fts_update AFTER UPDATE ON catalog_productsearchdocument BEGIN
+        INSERT INTO catalog_productsearch_fts(catalog_productsearch_fts, rowid, name, categories, body)
+        SELECT 'delete', old.product_id, old.name, old.categories, old.body WHERE old.is_active;
+        INSERT INTO catalog_productsearch_fts(rowid, name, categories, body)
+        SELECT new.product_id, new.name, new.categories, new.body WHERE new.is_active;
+    END
+    """,
+]
+SQLITE_INDEX_REVERSE = [
+    "DROP TRIGGER IF EXISTS catalog_productsearch_fts_update",
+    "DROP TRIGGER IF EXISTS catalog_productsearch_fts_delete",
+    "DROP TRIGGER IF EXISTS catalog_productsearch_fts_insert",
+    "DROP TABLE IF EXISTS catalog_productsearch_fts",
+]
+
+
+def run_vendor_sql(statements):
+    def run(apps, schema_editor):
+        vendor = schema_editor.connection.vendor
+        for statement in statements.get(vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+def build_search_documents(apps, schema_editor):
+    Category = apps.get_model('catalog', 'Category')
+    Product = apps.get_model('catalog', 'Product')
+    ProductSearchDocument = apps.get_model('catalog', 'ProductSearchDocument')
+
+    categories = {category_id: (parent_id, name) for category_id, parent_id, name in Category.objects.values_list('id', 'parent_id', 'name')}
+    paths = {}
+    for category_id in categories:
+        names, ancestor_id = [], category_id
+        while ancestor_id is not None:
+            ancestor_id, name = categories[ancestor_id]
+            names.append(name)
+        paths[category_id] = ' '.join(reversed(names))
+
+    documents = [
+        ProductSearchDocument(
+            product_id=product_id,
+            name=name,
+            categories=paths.get(category_id, ''),
+            body=f'{summary}\n{description}',
+            is_active=is_active,
+        )
+        for product_id, name, summary, description, category_id, is_active in Product.objects.values_list(
+            'id', 'name', 'summary', 'description', 'category_id', 'is_active'
+        ).iterator(chunk_size=1000)
+    ]
+    ProductSearchDocument.objects.bulk_create(documents, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0014_categoryclosure'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchDocument',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='catalog.product')),
+                ('name', models.CharField(max_length=100)),
+                ('categories', models.TextField(blank=True)),
+                ('body', models.TextField(blank=True)),
+                ('is_active', models.BooleanField(default=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(
+            run_vendor_sql({'postgresql': POSTGRESQL_INDEX, 'sqlite': SQLITE_INDEX}),
+            run_vendor_sql({'postgresql': POSTGRESQL_INDEX_REVERSE, 'sqlite': SQLITE_INDEX_REVERSE}),
+        ),
+        migrations.RunPython(build_search_documents, migrations.RunPython.noop),
+    ]
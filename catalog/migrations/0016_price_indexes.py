@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:30
+
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def fill_price_sort_keys(apps, schema_editor):
+    # The lowest price of an active, in-stock SKU, products without one keep the defaults that sort them last
+    ProductSKU = apps.get_model('catalog', 'ProductSKU')
+    ProductSummary = apps.get_model('catalog', 'ProductSummary')
+    prices = ProductSKU.objects.filter(is_active=True, quantity__gt=0).order_by().values('product').annotate(price=Min('price'))
+    ProductSummary.objects.bulk_update(
+        [ProductSummary(product_id=row['product'], price_sort_key=row['price'], price_sort_key_desc=row['price']) for row in prices],
+        ['price_sort_key', 'price_sort_key_desc'],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0015_productsearchdocument'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productsummary',
+            name='price_sort_key',
+            field=models.IntegerField(default=2147483647),
+        ),
+        migrations.AddField(
+            model_name='productsummary',
+            name='price_sort_key_desc',
+            field=models.IntegerField(default=-2147483648),
+        ),
+        migrations.RunPython(fill_price_sort_keys, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='productsku',
+            index=models.Index(condition=models.Q(('is_active', True), ('quantity__gt', 0)), fields=['product', 'price'], name='productsku_instock_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productsummary',
+            index=models.Index(fields=['min_price', 'product'], name='productsummary_min_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productsummary',
+            index=models.Index(fields=['price_sort_key', 'product'], name='productsummary_price_asc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productsummary',
+            index=models.Index(fields=['price_sort_key_desc', 'product'], name='productsummary_price_desc_idx'),
+        ),
+    ]
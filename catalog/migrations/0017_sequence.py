@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:45
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def seed_review_item_sequences(apps, schema_editor):
+    # Start every section's item sequence after its highest order number across texts, photos and videos
+    Sequence = apps.get_model('catalog', 'Sequence')
+    highest = {}
+    for model_name in ('ReviewText', 'ReviewPhoto', 'ReviewVideo'):
+        model = apps.get_model('catalog', model_name)
+        for row in model.objects.order_by().values('review_section').annotate(highest=Max('order_num')):
+            highest[row['review_section']] = max(highest.get(row['review_section'], 0), row['highest'] or 0)
+    Sequence.objects.bulk_create(
+        [Sequence(name=f'review_section:{section_id}:items', value=value) for section_id, value in highest.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0016_price_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Sequence',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(seed_review_item_sequences, migrations.RunPython.noop),
+    ]
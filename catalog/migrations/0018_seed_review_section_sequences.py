@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:52
+
+from django.db import migrations
+from django.db.models import Max
+
+
+def seed_review_section_sequences(apps, schema_editor):
+    # Start every product's section sequence after its highest section order number
+    Sequence = apps.get_model('catalog', 'Sequence')
+    ReviewSection = apps.get_model('catalog', 'ReviewSection')
+    Sequence.objects.bulk_create(
+        [
+            Sequence(name=f"product:{row['product']}:review_sections", value=row['highest'] or 0)
+            for row in ReviewSection.objects.order_by().values('product').annotate(highest=Max('order_num'))
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0017_sequence'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_review_section_sequences, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:52
+
+import catalog.mixins
+import django.db.models.constraints
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0018_seed_review_section_sequences'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='productdetail',
+            unique_together=set(),
+        ),
+        migrations.AddConstraint(
+            model_name='productdetail',
+            constraint=catalog.mixins.DeferrableUniqueConstraint(deferrable=django.db.models.constraints.Deferrable['IMMEDIATE'], fields=('product', 'order_num'), name='unique_order_num_per_product_detail'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-17 08:10
+
+import re
+from django.db import migrations
+from django.db.models import Max
+
+GENERATED_CODE = re.compile(r'SKU-(\d{10}|[1-9]\d{10,})')
+
+
+def seed_product_detail_sequences(apps, schema_editor):
+    # Start every product's detail sequence after its highest detail order number
+    Sequence = apps.get_model('catalog', 'Sequence')
+    ProductDetail = apps.get_model('catalog', 'ProductDetail')
+    Sequence.objects.bulk_create(
+        [
+            Sequence(name=f"product:{row['product']}:details", value=row['highest'] or 0)
+            for row in ProductDetail.objects.order_by().values('product').annotate(highest=Max('order_num'))
+        ],
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+
+
+def reserve_product_sku_codes(apps, schema_editor):
+    # Move the code sequence past codes imported by hand in the generated format, so it never hands them out again
+    Sequence = apps.get_model('catalog', 'Sequence')
+    ProductSKU = apps.get_model('catalog', 'ProductSKU')
+    numbers = [
+        int(match[1]) for match in map(GENERATED_CODE.fullmatch, ProductSKU.objects.filter(sku__startswith='SKU-').values_list('sku', flat=True))
+        if match
+    ]
+    if numbers:
+        sequence, _ = Sequence.objects.get_or_create(name='product_sku:codes')
+        if sequence.value < max(numbers):
+            sequence.value = max(numbers)
+            sequence.save(update_fields=['value'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0021_media_blob'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_product_detail_sequences, migrations.RunPython.noop),
+        migrations.RunPython(reserve_product_sku_codes, migrations.RunPython.noop),
+    ]
@@ -1,65 +1,125 @@
+import copy
 from django.db import models
 from rest_framework.exceptions import ValidationError  # Import ValidationError
 
+# New positions are handed out this far apart, so an item can later be moved between two others with one write
+ORDER_GAP = 1024
+
+
+class DeferrableUniqueConstraint(models.UniqueConstraint):
+    """
+    A unique constraint that is deferrable (initially immediate) where the database supports it and a plain one
+    elsewhere, so every database enforces it and those that can let a transaction defer it to commit.
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('deferrable', models.Deferrable.IMMEDIATE)
+        super().__init__(*args, **kwargs)
+
+    def for_connection(self, connection):
+        """The constraint as the database creates it."""
+        if connection.features.supports_deferrable_unique_constraints:
+            return self
+        constraint = copy.copy(self)
+        constraint.deferrable = None
+        return constraint
+
+    def constraint_sql(self, model, schema_editor):
+        return super(DeferrableUniqueConstraint, self.for_connection(schema_editor.connection)).constraint_sql(model, schema_editor)
+
+    def create_sql(self, model, schema_editor):
+        return super(DeferrableUniqueConstraint, self.for_connection(schema_editor.connection)).create_sql(model, schema_editor)
+
+    def remove_sql(self, model, schema_editor):
+        return super(DeferrableUniqueConstraint, self.for_connection(schema_editor.connection)).remove_sql(model, schema_editor)
+
+    def _check(self, model, connection):
+        return super(DeferrableUniqueConstraint, self.for_connection(connection))._check(model, connection)
+
+
 class ReviewOrderMixin(models.Model):
     # this class use for give order to order_num
     order_num = models.PositiveIntegerField()
 
+    # Sections are numbered per product from a counter row, so a number costs one statement whatever the table size
+    ORDER_SEQUENCE = 'product:{product_id}:review_sections'
+
     class Meta:
         abstract = True
         ordering = ['order_num']
 
     def save(self, *args, **kwargs):
+        from .models import Sequence  # Avoid circular imports
+
+        sequence = self.ORDER_SEQUENCE.format(product_id=self.product_id)
         if not self.order_num:
             # Automatically set the order number if it's not set
-            last_order = self.__class__.objects.filter().order_by('order_num').last()
-            if last_order:
-                self.order_num = last_order.order_num + 1
-            else:
-                self.order_num = 1
+            self.order_num = Sequence.allocate(sequence, step=ORDER_GAP)
+        else:
+            # Keep numbers set by hand out of the sequence
+            Sequence.advance_to(sequence, self.order_num)
         super().save(*args, **kwargs)
 
 class ReviewOrderItemMixin(models.Model):
     order_num = models.PositiveIntegerField(null=True)  # Allow null temporarily for auto-assignment
 
+    # Texts, photos and videos of a section share one sequence, so the numbers it hands out are unique across them
+    ITEM_SEQUENCE = 'review_section:{section_id}:items'
+
     class Meta:
         abstract = True
         ordering = ['order_num']
 
     def save(self, *args, **kwargs):
-        # Set order_num if not provided
         if self.order_num is None:
             self.assign_order_num()
-        # Validate unique order_num across all models for the same review_section
-        self.validate_unique_order_num()
+        else:
+            # Numbers set by hand are checked against the other item types and kept out of the sequence
+            self.validate_unique_order_num()
+            self.reserve_order_num()
         super().save(*args, **kwargs)
 
-    def assign_order_num(self):
-        from .models import ReviewText, ReviewPhoto, ReviewVideo  # Avoid circular imports
+    @classmethod
+    def item_sequence(cls, review_section_id):
+        return cls.ITEM_SEQUENCE.format(section_id=review_section_id)
 
-        # Get maximum order_num used in the same review_section across all models
-        max_order_text = ReviewText.objects.filter(review_section=self.review_section).aggregate(models.Max('order_num'))['order_num__max'] or 0
-        max_order_photo = ReviewPhoto.objects.filter(review_section=self.review_section).aggregate(models.Max('order_num'))['order_num__max'] or 0
-        max_order_video = ReviewVideo.objects.filter(review_section=self.review_section).aggregate(models.Max('order_num'))['order_num__max'] or 0
+    def assign_order_num(self):
+        from .models import Sequence  # Avoid circular imports
+        self.order_num = Sequence.allocate(self.item_sequence(self.review_section_id), step=ORDER_GAP)
 
-        # Assign the next available order_num
-        self.order_num = max(max_order_text, max_order_photo, max_order_video) + 1
+    def reserve_order_num(self):
+        from .models import Sequence  # Avoid circular imports
+        Sequence.advance_to(self.item_sequence(self.review_section_id), self.order_num)
 
     def validate_unique_order_num(self):
         from .models import ReviewText, ReviewPhoto, ReviewVideo  # Avoid circular imports
 
-        # Check if order_num already exists in other models for the same review_section
-        existing_text = ReviewText.objects.filter(
-            review_section=self.review_section, order_num=self.order_num
-        ).exists() if not isinstance(self, ReviewText) else False
-
-        existing_photo = ReviewPhoto.objects.filter(
-            review_section=self.review_section, order_num=self.order_num
-        ).exists() if not isinstance(self, ReviewPhoto) else False
+        # Check if order_num already exists in the other models for the same review_section, in one query
+        others = [
+            model.objects.filter(review_section_id=self.review_section_id, order_num=self.order_num).values('pk')
+            for model in (ReviewText, ReviewPhoto, ReviewVideo) if not isinstance(self, model)
+        ]
+        if others[0].union(*others[1:]).exists():
+            raise ValidationError(f"The order number {self.order_num} is already taken for this review section.")
 
-        existing_video = ReviewVideo.objects.filter(
-            review_section=self.review_section, order_num=self.order_num
-        ).exists() if not isinstance(self, ReviewVideo) else False
+    @classmethod
+    def bulk_create_ordered(cls, items, batch_size=None):
+        """
+        Insert many items at once. Items without an order_num are numbered after everything already in their
+        section, in one statement per section, in the order given. Numbers set by hand are not checked.
+        """
+        from .models import Sequence  # Avoid circular imports
 
-        if existing_text or existing_photo or existing_video:
-            raise ValidationError(f"The order number {self.order_num} is already taken for this review section.")
+        unnumbered, highest = {}, {}
+        for item in items:
+            if item.order_num is None:
+                unnumbered.setdefault(item.review_section_id, []).append(item)
+            else:
+                highest[item.review_section_id] = max(highest.get(item.review_section_id, 0), item.order_num)
+        for section_id, order_num in highest.items():
+            Sequence.advance_to(cls.item_sequence(section_id), order_num)
+        for section_id, section_items in unnumbered.items():
+            first = Sequence.allocate(cls.item_sequence(section_id), len(section_items), step=ORDER_GAP)
+            for offset, item in enumerate(section_items):
+                item.order_num = first + offset * ORDER_GAP
+        return cls.objects.bulk_create(items, batch_size=batch_size)
@@ -1,9 +1,15 @@
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models import Count, Exists, F, Min, Max, OuterRef, Prefetch, Q, Subquery, Sum, Value
+from django.db.models.functions import Greatest
 from decimal import Decimal
-import uuid  # Import the uuid module
 from django.core.validators import FileExtensionValidator, MinValueValidator
 from .mixins import *
 import mimetypes
+import os
+import re
+import uuid
+from django.conf import settings
+from django.utils import timezone
 from django.core.exceptions import ValidationError
 
 
@@ -97,47 +103,288 @@ class Category(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     is_active = models.BooleanField(default=True)
 
+    # Subtrees larger than this get the attribute groups from a background task
+    PROPAGATE_INLINE_LIMIT = 1000
+
+    class Meta:
+        indexes = [
+            # Backs the (created_at, id) cursor pagination of the active categories list
+            models.Index(fields=['is_active', 'created_at', 'id'], name='category_active_created_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored parent, so save() can tell when the category is moved in the tree
+        instance._loaded_parent_id = instance.__dict__.get('parent_id')
+        instance._loaded_name = instance.__dict__.get('name')
+        return instance
+
     def save(self, *args, **kwargs):
-        """Override save method to calculate and set category level based on parent, and propagate attribute groups to subcategories."""
+        """Override save method to calculate and set category level based on parent, keep the closure table in sync and propagate attribute groups to subcategories."""
+        is_new = self.pk is None or self._state.adding
+        is_moved = not is_new and self.parent_id != getattr(self, '_loaded_parent_id', self.parent_id)
+
+        if is_moved and self.parent_id is not None and CategoryClosure.objects.filter(
+            ancestor_id=self.pk, descendant_id=self.parent_id
+        ).exists():
+            raise ValidationError("A category can't be moved under itself or one of its subcategories.")
+
         if self.parent:
             self.level = self.parent.level + 1
         else:
             self.level = 0
-        
-        # Save the category first
-        super().save(*args, **kwargs)
-
-        # After saving, propagate the attribute groups to subcategories
-        self.propagate_attribute_groups_to_subcategories()
 
-    def propagate_attribute_groups_to_subcategories(self):
-        """Propagate this category's attribute groups to all subcategories."""
-        # Get all subcategories
-        subcategories = self.subcategories.all()
-
-        # Get current attribute groups of the parent category
-        inherited_groups = list(self.attribute_groups.all())
-
-        for subcategory in subcategories:
-            # Sync subcategory attribute groups with the parent's attribute groups
-            subcategory.attribute_groups.set(inherited_groups)
-            
-            # Recursively propagate the changes to further nested subcategories
-            subcategory.save()
+        with transaction.atomic():
+            # Save the category first
+            super().save(*args, **kwargs)
+
+            if is_new:
+                self._insert_closure_links()
+            elif is_moved:
+                self._move_closure_links()
+        self._loaded_parent_id, self._loaded_name = self.parent_id, self.name
+
+        # After saving, propagate the attribute groups to subcategories (a new category has none yet)
+        if not is_new:
+            self.propagate_attribute_groups()
+
+    def _insert_closure_links(self):
+        """Link a new (leaf) category to itself and to every ancestor of its parent."""
+        links = [CategoryClosure(ancestor_id=self.pk, descendant_id=self.pk, depth=0)]
+        if self.parent_id is not None:
+            links += [
+                CategoryClosure(ancestor_id=ancestor_id, descendant_id=self.pk, depth=depth + 1)
+                for ancestor_id, depth in CategoryClosure.objects.filter(
+                    descendant_id=self.parent_id
+                ).values_list('ancestor_id', 'depth')
+            ]
+        CategoryClosure.objects.bulk_create(links)
+
+    def _move_closure_links(self):
+        """Re-attach this category's whole subtree under its new parent and re-level every node in it."""
+        subtree = list(CategoryClosure.objects.filter(ancestor_id=self.pk).values_list('descendant_id', 'depth'))
+        subtree_ids = [descendant_id for descendant_id, depth in subtree]
+
+        # Detach the subtree from its old ancestors, links inside the subtree stay valid
+        CategoryClosure.objects.filter(descendant_id__in=subtree_ids).exclude(ancestor_id__in=subtree_ids).delete()
+
+        # Link every new ancestor to every node of the subtree
+        if self.parent_id is not None:
+            new_ancestors = CategoryClosure.objects.filter(descendant_id=self.parent_id).values_list('ancestor_id', 'depth')
+            CategoryClosure.objects.bulk_create([
+                CategoryClosure(ancestor_id=ancestor_id, descendant_id=descendant_id, depth=ancestor_depth + 1 + depth)
+                for ancestor_id, ancestor_depth in new_ancestors
+                for descendant_id, depth in subtree
+            ])
+
+        # A node's level is this category's level plus its depth below it, one statement for the whole subtree
+        Category.objects.filter(id__in=subtree_ids).exclude(id=self.pk).update(
+            level=self.level + Subquery(
+                CategoryClosure.objects.filter(ancestor_id=self.pk, descendant_id=OuterRef('pk')).values('depth')[:1]
+            )
+        )
+
+    def propagate_attribute_groups(self):
+        """
+        Propagate this category's attribute groups to its subcategories right away, or from a background task in
+        batches when the subtree is larger than PROPAGATE_INLINE_LIMIT, so saving a top category stays quick.
+        """
+        if self.get_descendants()[:self.PROPAGATE_INLINE_LIMIT + 1].count() > self.PROPAGATE_INLINE_LIMIT:
+            from .tasks import propagate_attribute_groups  # Avoid circular imports
+            propagate_attribute_groups.delay(self.pk)
+        else:
+            self.propagate_attribute_groups_to_subcategories()
+
+    def propagate_attribute_groups_to_subcategories(self, batch_size=None):
+        """
+        Propagate this category's attribute groups to all subcategories, as a set operation on the
+        whole subtree: one delete plus one bulk insert on the through table, in a single transaction.
+        A batch_size splits very large subtrees into one transaction per batch, for background runs.
+        """
+        through = Category.attribute_groups.through
+        group_ids = list(self.attribute_groups.values_list('id', flat=True))
+        descendants = self.get_descendants().values_list('id', flat=True)
+
+        if batch_size is None:
+            batches = [descendants]
+        else:
+            descendant_ids = list(descendants.order_by('id'))
+            batches = [descendant_ids[start:start + batch_size] for start in range(0, len(descendant_ids), batch_size)]
+
+        for batch in batches:
+            with transaction.atomic():
+                # Drop the groups the subcategories no longer inherit, then add the missing ones
+                through.objects.filter(category_id__in=batch).exclude(attributegroup_id__in=group_ids).delete()
+                through.objects.bulk_create(
+                    [through(category_id=cid, attributegroup_id=gid) for cid in batch for gid in group_ids],
+                    batch_size=1000, ignore_conflicts=True,
+                )
+
+    def get_ancestors(self, include_self=False):
+        """Ancestors of this category ordered from the root down, in a single query on the closure table."""
+        ancestors = Category.objects.filter(descendant_links__descendant=self)
+        if not include_self:
+            ancestors = ancestors.exclude(pk=self.pk)
+        return ancestors.order_by('-descendant_links__depth')
+
+    def get_descendants(self, include_self=False):
+        """The whole subtree below this category, in a single query on the closure table."""
+        descendants = Category.objects.filter(ancestor_links__ancestor=self)
+        if not include_self:
+            descendants = descendants.exclude(pk=self.pk)
+        return descendants
+
+    def get_breadcrumbs(self):
+        """Root-to-self path as a list of {'id', 'name'} items."""
+        return list(self.get_ancestors(include_self=True).values('id', 'name'))
+
+    def get_subtree_products(self):
+        """All products in this category and its subcategories."""
+        return Product.objects.in_category(self.pk)
 
     def get_all_attribute_groups(self):
         """Fetch this category's attribute groups, plus parent categories' attribute groups, ensuring uniqueness."""
-        groups = set(self.attribute_groups.all())
-        if self.parent:
-            parent_groups = self.parent.get_all_attribute_groups()
-            groups.update(parent_groups)
-        return list(groups)
+        return list(
+            AttributeGroup.objects.filter(categories__descendant_links__descendant=self).distinct().order_by('id')
+        )
+
+    @classmethod
+    def build_tree(cls):
+        """
+        Build the nested tree of active categories from a single query.
+        A subcategory is only shown while all of its ancestors are active.
+        """
+        nodes = {}
+        children = {}
+        for category_id, parent_id, name in cls.objects.filter(is_active=True).order_by('id').values_list('id', 'parent_id', 'name'):
+            nodes[category_id] = {'id': category_id, 'name': name, 'subcategories': children.setdefault(category_id, [])}
+            children.setdefault(parent_id, []).append(nodes[category_id])
+        # Roots are the active categories without a parent, children of inactive categories are never reached
+        return children.get(None, [])
+
+    @classmethod
+    def get_attribute_groups_map(cls, category_ids):
+        """
+        Resolve the combined (own + ancestors) attribute groups for many categories at once.
+        Returns {category_id: [{'id': ..., 'name': ...}, ...]} using two queries in total.
+        """
+        category_ids = set(category_ids)
+        if not category_ids:
+            return {}
+
+        # Every (category, ancestor) pair from the closure table, including the category itself
+        chains = {}
+        for descendant_id, ancestor_id in CategoryClosure.objects.filter(
+            descendant_id__in=category_ids
+        ).values_list('descendant_id', 'ancestor_id'):
+            chains.setdefault(descendant_id, []).append(ancestor_id)
+
+        # Load the attribute groups of every category that appears in any chain
+        groups_by_category = {}
+        through_rows = cls.attribute_groups.through.objects.filter(
+            category_id__in={cid for chain in chains.values() for cid in chain}
+        ).values_list('category_id', 'attributegroup_id', 'attributegroup__name')
+        for category_id, group_id, group_name in through_rows:
+            groups_by_category.setdefault(category_id, {})[group_id] = group_name
+
+        result = {}
+        for category_id in category_ids:
+            groups = {}
+            for cid in chains.get(category_id, []):
+                groups.update(groups_by_category.get(cid, {}))
+            result[category_id] = [{'id': gid, 'name': groups[gid]} for gid in sorted(groups)]
+        return result
+
+
+class CategoryClosure(models.Model):
+    """Ancestor/descendant pairs of the category tree, every category is also linked to itself at depth 0."""
+    ancestor = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='descendant_links')
+    descendant = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='ancestor_links')
+    depth = models.PositiveIntegerField()  # Number of levels between ancestor and descendant
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['ancestor', 'descendant'], name='unique_category_closure_link')
+        ]
+        indexes = [
+            models.Index(fields=['descendant', 'depth'], name='category_closure_desc_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.ancestor_id} -> {self.descendant_id} ({self.depth})"
+
+    @classmethod
+    def rebuild(cls, batch_size=1000):
+        """Rebuild the whole closure table from the parent links, e.g. after categories were bulk-created."""
+        parents = dict(Category.objects.values_list('id', 'parent_id'))
+        links = []
+        for category_id in parents:
+            depth, ancestor_id = 0, category_id
+            while ancestor_id is not None:
+                links.append(cls(ancestor_id=ancestor_id, descendant_id=category_id, depth=depth))
+                depth, ancestor_id = depth + 1, parents[ancestor_id]
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create(links, batch_size=batch_size)
 
 
 # Product models
+class ProductQuerySet(models.QuerySet):
+    def with_listing_data(self):
+        """
+        Join the category and the denormalized SKU summary of each product,
+        so product serializers don't have to query the SKUs of every row.
+        """
+        return self.select_related('category', 'sku_summary')
+
+    def with_page_data(self):
+        """
+        Everything the product page shows, in a fixed number of queries whatever the product has:
+        ordered details, photos, videos, active SKUs with their attribute values, and ordered review sections with their items.
+        """
+        return self.with_listing_data().prefetch_related(
+            Prefetch('details', queryset=ProductDetail.objects.order_by('order_num', 'id')),
+            Prefetch('photos', queryset=ProductPhoto.objects.order_by('id')),
+            Prefetch('videos', queryset=ProductVideo.objects.order_by('id')),
+            Prefetch('skus', queryset=ProductSKU.objects.filter(is_active=True).order_by('id').prefetch_related(
+                Prefetch('sku_attributes', queryset=ProductSKUAttribute.objects.select_related('attribute_value__type').order_by('id')),
+            )),
+            Prefetch('review', queryset=ReviewSection.objects.order_by('order_num').prefetch_related('texts', 'photos', 'videos')),
+        )
+
+    def in_category(self, category_id):
+        """Products in the given category and all of its subcategories, through the closure table."""
+        return self.filter(category__ancestor_links__ancestor_id=category_id)
+
+    def with_price(self, descending=False):
+        """
+        Annotate `price_key`, the summary's sort key for sorting by price in the given direction, so the sort walks
+        the matching summary index. Every product gets a summary when it's created, the join to it is inner.
+        """
+        field = 'price_sort_key_desc' if descending else 'price_sort_key'
+        return self.filter(sku_summary__isnull=False).annotate(price_key=F(f'sku_summary__{field}'))
+
+    def priced_between(self, min_price=None, max_price=None):
+        """
+        Products with an active, in-stock SKU priced within the bounds (inclusive).
+        The summary's price span must overlap the bounds, which limits the price index scan to that range,
+        the EXISTS probe is then answered from the partial (product, price) index of in-stock SKUs.
+        """
+        queryset = self
+        skus = ProductSKU.objects.filter(product=OuterRef('pk'), is_active=True, quantity__gt=0)
+        if min_price is not None:
+            queryset = queryset.filter(sku_summary__max_price__gte=min_price)
+            skus = skus.filter(price__gte=min_price)
+        if max_price is not None:
+            queryset = queryset.filter(sku_summary__min_price__lte=max_price)
+            skus = skus.filter(price__lte=max_price)
+        return queryset.filter(Exists(skus))
+
+
 class Product(models.Model):
     name = models.CharField(max_length=100)
     description = models.TextField()
@@ -147,6 +394,14 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     is_active = models.BooleanField(default=True)
 
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Backs the (created_at, id) cursor pagination of the public products list
+            models.Index(fields=['is_active', 'created_at', 'id'], name='product_active_created_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -155,22 +410,68 @@ class ProductDetail(models.Model):  # This contains details of each product
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='details')
     title = models.CharField(max_length=50)
     value = models.TextField()
-    order_num = models.PositiveIntegerField()  # New field for ordering
+    order_num = models.PositiveIntegerField()  # New field for ordering, assigned from the product's sequence if not given
+
+    # Details are numbered per product from a counter row, ORDER_GAP apart (see catalog/ordering.py)
+    ORDER_SEQUENCE = 'product:{product_id}:details'
 
     class Meta:
-        # Ensure that order_num is unique per product
-        unique_together = ('product', 'order_num')
+        constraints = [
+            # Ensure that order_num is unique per product. Where the database supports it the constraint is
+            # deferrable (initially immediate), so a reorder can permute the numbers in one statement; it is still
+            # checked per statement unless a transaction defers it. Elsewhere it is a plain unique constraint
+            DeferrableUniqueConstraint(fields=['product', 'order_num'], name='unique_order_num_per_product_detail'),
+        ]
 
     def __str__(self):
         return f"{self.product.name} - {self.title}: {self.value}"
 
+    def save(self, *args, **kwargs):
+        sequence = self.order_sequence(self.product_id)
+        if not self.order_num:
+            self.order_num = Sequence.allocate(sequence, step=ORDER_GAP)
+        else:
+            # Keep numbers set by hand out of the sequence
+            Sequence.advance_to(sequence, self.order_num)
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def order_sequence(cls, product_id):
+        return cls.ORDER_SEQUENCE.format(product_id=product_id)
+
+    @classmethod
+    def reorder(cls, product_id, order_nums):
+        """
+        Give the details of a product new order numbers, {detail id: order_num}, in one UPDATE.
+        Without deferrable constraints the rows are first moved above every current number, in one more.
+        """
+        details = [cls(pk=pk, order_num=order_num) for pk, order_num in order_nums.items()]
+        if not details:
+            return
+        with transaction.atomic():
+            Sequence.advance_to(cls.order_sequence(product_id), max(order_nums.values()))
+            queryset = cls.objects.filter(product_id=product_id)
+            if connection.features.supports_deferrable_unique_constraints:
+                with connection.cursor() as cursor:
+                    cursor.execute('SET CONSTRAINTS %s DEFERRED' % connection.ops.quote_name('unique_order_num_per_product_detail'))
+            else:
+                highest = queryset.aggregate(highest=Max('order_num'))['highest'] or 0
+                queryset.filter(pk__in=order_nums).update(order_num=F('order_num') + max(highest, *order_nums.values()) + 1)
+            queryset.bulk_update(details, ['order_num'])
+
 
 class ProductPhoto(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='photos')
     alt = models.TextField()
     photo = models.ImageField(upload_to='product/product_photos/')
     uploaded_at = models.DateTimeField(auto_now_add=True)
-    
+
+    class Meta:
+        indexes = [
+            # Backs the id cursor pagination of a product's photos
+            models.Index(fields=['product', 'id'], name='productphoto_product_id_idx'),
+        ]
+
     def __str__(self):
         return f"Photo for {self.product.name}"
 
@@ -184,6 +485,12 @@ class ProductVideo(models.Model):
     )
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Backs the id cursor pagination of a product's videos
+            models.Index(fields=['product', 'id'], name='productvideo_product_id_idx'),
+        ]
+
     def __str__(self):
         return f"Video for {self.product.name}"
 
@@ -201,13 +508,45 @@ class ProductSKU(models.Model):  # SKU specifies price, quantity based on produc
     quantity = models.IntegerField(validators=[MinValueValidator(0)])  # Prevent negative quantity
     created_at = models.DateTimeField(auto_now_add=True)
     is_active = models.BooleanField(default=True)
-    
+
+    class Meta:
+        indexes = [
+            # Backs the (created_at, id) cursor pagination of the SKU list
+            models.Index(fields=['created_at', 'id'], name='productsku_created_idx'),
+            # Covers the price filter of the product list, only sellable SKUs are indexed
+            models.Index(
+                fields=['product', 'price'], condition=Q(is_active=True, quantity__gt=0), name='productsku_instock_price_idx'
+            ),
+        ]
+
+    # Generated codes are numbered from this sequence, older random ones (SKU- and 8 hex digits) can't collide with them
+    CODE_SEQUENCE = 'product_sku:codes'
+    # Codes in the generated format, a code given by hand in this format moves the sequence past it
+    GENERATED_CODE = re.compile(r'SKU-(\d{10}|[1-9]\d{10,})')
+
     def save(self, *args, **kwargs):
         if not self.sku:
             # Generate a unique SKU if it doesn't exist
-            self.sku = f"SKU-{uuid.uuid4().hex[:8].upper()}"
+            self.sku = self.allocate_codes(1)[0]
+        else:
+            self.reserve_codes([self.sku])
         super().save(*args, **kwargs)
 
+    @classmethod
+    def allocate_codes(cls, count):
+        """`count` new SKU codes in one statement, for SKUs created with bulk_create() which skips save()."""
+        if not count:
+            return []
+        first = Sequence.allocate(cls.CODE_SEQUENCE, count)
+        return [f"SKU-{number:010d}" for number in range(first, first + count)]
+
+    @classmethod
+    def reserve_codes(cls, codes):
+        """Keep the sequence from handing out codes given by hand, for SKUs imported with their codes."""
+        numbers = [int(match[1]) for match in map(cls.GENERATED_CODE.fullmatch, codes) if match]
+        if numbers:
+            Sequence.advance_to(cls.CODE_SEQUENCE, max(numbers))
+
     def __str__(self):
         return f"SKU: {self.sku}, Product: {self.product.name}"
 
@@ -223,6 +562,292 @@ class ProductSKUAttribute(models.Model):
         return f"SKU: {self.sku.sku}, Attribute: {self.attribute_value.type.name}, Value: {self.attribute_value.value}"
 
 
+class ProductSummary(models.Model):
+    """Denormalized price and stock figures of a product, maintained from ProductSKU writes."""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='sku_summary')
+    min_price = models.IntegerField(null=True, blank=True)  # NULL while the product has no SKUs
+    max_price = models.IntegerField(null=True, blank=True)
+    total_stock = models.IntegerField(default=0)
+    active_sku_count = models.PositiveIntegerField(default=0)
+    is_available = models.BooleanField(default=False)  # True when any SKU has quantity > 0
+    # Sort keys of the product list by price: the lowest price of an active, in-stock SKU, the SKUs the price filter
+    # matches. Products without one get a stand-in past the end of the direction, so they come last either way and
+    # the cursor always has a key to seek from.
+    price_sort_key = models.IntegerField(default=2 ** 31 - 1)
+    price_sort_key_desc = models.IntegerField(default=-2 ** 31)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Backs the price range filter of the product list
+            models.Index(fields=['min_price', 'product'], name='productsummary_min_price_idx'),
+            # Back sorting the product list by price, ties follow the product id
+            models.Index(fields=['price_sort_key', 'product'], name='productsummary_price_asc_idx'),
+            models.Index(fields=['price_sort_key_desc', 'product'], name='productsummary_price_desc_idx'),
+        ]
+
+    def __str__(self):
+        return f"Summary for product {self.product_id}"
+
+    @classmethod
+    def refresh_for_products(cls, product_ids):
+        """Recalculate the summaries of the given products from their SKUs and upsert them in one statement."""
+        product_ids = list(Product.objects.filter(id__in=set(product_ids)).values_list('id', flat=True))
+        if not product_ids:
+            return
+
+        stats = {
+            row['product']: row
+            for row in ProductSKU.objects.filter(product_id__in=product_ids).order_by().values('product').annotate(
+                min_price=Min('price'),
+                max_price=Max('price'),
+                total_stock=Sum('quantity'),
+                active_sku_count=Count('id', filter=Q(is_active=True)),
+                in_stock_count=Count('id', filter=Q(quantity__gt=0)),
+                in_stock_price=Min('price', filter=Q(is_active=True, quantity__gt=0)),
+            )
+        }
+
+        summaries = []
+        for product_id in product_ids:
+            row = stats.get(product_id)
+            if row is None:
+                summaries.append(cls(product_id=product_id))  # Product without SKUs
+                continue
+            summaries.append(cls(
+                product_id=product_id,
+                min_price=row['min_price'],
+                max_price=row['max_price'],
+                total_stock=row['total_stock'] or 0,
+                active_sku_count=row['active_sku_count'],
+                is_available=row['in_stock_count'] > 0,
+            ))
+            if row['in_stock_price'] is not None:
+                summaries[-1].price_sort_key = summaries[-1].price_sort_key_desc = row['in_stock_price']
+
+        cls.objects.bulk_create(
+            summaries,
+            update_conflicts=True,
+            unique_fields=['product'],
+            update_fields=[
+                'min_price', 'max_price', 'total_stock', 'active_sku_count', 'is_available',
+                'price_sort_key', 'price_sort_key_desc', 'updated_at',
+            ],
+        )
+
+
+class ProductSearchDocument(models.Model):
+    """
+    Searchable text of a product, maintained from Product and Category writes.
+    The full-text index over it is database specific, see catalog/search.py.
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='search_document')
+    name = models.CharField(max_length=100)
+    categories = models.TextField(blank=True)  # Names of the product's category and all of its ancestors
+    body = models.TextField(blank=True)  # Summary and description
+    is_active = models.BooleanField(default=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Search document for product {self.product_id}"
+
+    @classmethod
+    def refresh_for_products(cls, product_ids):
+        """Rebuild the documents of the given products and upsert them in one statement."""
+        products = list(Product.objects.filter(id__in=set(product_ids)).values_list(
+            'id', 'name', 'summary', 'description', 'category_id', 'is_active'
+        ))
+        if not products:
+            return
+
+        # Category paths from the closure table, root first
+        paths = {}
+        for category_id, name in CategoryClosure.objects.filter(
+            descendant_id__in={product[4] for product in products}
+        ).order_by('descendant_id', '-depth').values_list('descendant_id', 'ancestor__name'):
+            paths.setdefault(category_id, []).append(name)
+
+        cls.objects.bulk_create(
+            [
+                cls(
+                    product_id=product_id,
+                    name=name,
+                    categories=' '.join(paths.get(category_id, [])),
+                    body=f'{summary}\n{description}',
+                    is_active=is_active,
+                )
+                for product_id, name, summary, description, category_id, is_active in products
+            ],
+            update_conflicts=True,
+            unique_fields=['product'],
+            update_fields=['name', 'categories', 'body', 'is_active', 'updated_at'],
+        )
+
+    @classmethod
+    def refresh_for_categories(cls, category_ids, batch_size=1000):
+        """Rebuild the documents of every product in the given categories and their subcategories."""
+        product_ids = Product.objects.filter(
+            category__ancestor_links__ancestor_id__in=category_ids
+        ).order_by('id').values_list('id', flat=True).distinct()
+        batch = []
+        for product_id in product_ids.iterator(chunk_size=batch_size):
+            batch.append(product_id)
+            if len(batch) == batch_size:
+                cls.refresh_for_products(batch)
+                batch = []
+        if batch:
+            cls.refresh_for_products(batch)
+
+
+# Named counters
+class Sequence(models.Model):
+    """
+    Named counters handing out blocks of numbers in a single statement. The row is locked by the upsert
+    until the transaction ends, so concurrent writers never get the same number.
+    """
+    name = models.CharField(max_length=100, primary_key=True)
+    value = models.BigIntegerField(default=0)  # Last number handed out
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+    @classmethod
+    def allocate(cls, name, count=1, step=1):
+        """
+        Reserve the next `count` numbers of the sequence (created on first use), `step` apart,
+        and return the first one.
+        """
+        table = connection.ops.quote_name(cls._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} (name, value) VALUES (%s, %s) "
+                f"ON CONFLICT (name) DO UPDATE SET value = {table}.value + excluded.value RETURNING value",
+                [name, count * step],
+            )
+            return cursor.fetchone()[0] - (count - 1) * step
+
+    @classmethod
+    def advance_to(cls, name, value):
+        """Make sure the sequence never hands out `value` or anything below it, for numbers assigned by hand."""
+        table = connection.ops.quote_name(cls._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} (name, value) VALUES (%s, %s) "
+                f"ON CONFLICT (name) DO UPDATE SET value = excluded.value WHERE {table}.value < excluded.value",
+                [name, value],
+            )
+
+
+
+class ChunkedUpload(models.Model):
+    """
+    A video sent in chunks: started with its size, filled by chunks written at an offset, then attached to a
+    ProductVideo, BrandVideo or ReviewVideo. Chunks go straight into a staging file under CHUNKED_UPLOAD_ROOT, and
+    `offset` counts the bytes received so an interrupted upload resumes from there.
+    """
+    TARGET_CHOICES = [
+        ('product_video', 'Product video'),
+        ('brand_video', 'Brand video'),
+        ('review_video', 'Review video'),
+    ]
+    COPY_BUFFER_SIZE = 1024 * 1024
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='chunked_uploads')
+    target = models.CharField(max_length=20, choices=TARGET_CHOICES)
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()  # Announced when the upload starts
+    offset = models.PositiveBigIntegerField(default=0)  # Bytes received so far
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.filename}: {self.offset}/{self.size}"
+
+    @property
+    def path(self):
+        return os.path.join(settings.CHUNKED_UPLOAD_ROOT, f'{self.pk}.part')
+
+    @property
+    def is_complete(self):
+        return self.offset == self.size
+
+    def create_file(self):
+        os.makedirs(settings.CHUNKED_UPLOAD_ROOT, exist_ok=True)
+        open(self.path, 'wb').close()
+
+    def write(self, offset, stream, length):
+        """
+        Copy `length` bytes of `stream` into the staging file at `offset`, a buffer at a time. A chunk may be sent
+        again but can't start past the bytes received so far. No transaction is held while the chunk is read from
+        the client: the offset only grows, and is advanced afterwards by a conditional update, so a chunk written
+        concurrently never leaves a gap. Returns the number of bytes written, fewer than `length` when the client
+        went away mid-chunk.
+        """
+        received = type(self).objects.values_list('offset', flat=True).get(pk=self.pk)
+        if offset > received:
+            raise ValidationError(f"The chunk starts at byte {offset}, only {received} bytes were received.")
+        if offset + length > self.size:
+            raise ValidationError(f"The chunk ends past the announced size of {self.size} bytes.")
+
+        written = 0
+        with open(self.path, 'r+b') as file:
+            file.seek(offset)
+            while written < length:
+                data = stream.read(min(self.COPY_BUFFER_SIZE, length - written))
+                if not data:
+                    break
+                file.write(data)
+                written += len(data)
+
+        type(self).objects.filter(pk=self.pk, offset__gte=offset).update(
+            offset=Greatest('offset', Value(offset + written)), updated_at=timezone.now(),
+        )
+        self.refresh_from_db(fields=['offset', 'updated_at'])
+        return written
+
+    def discard(self):
+        """Delete the upload and its staging file."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.delete()
+
+    @classmethod
+    def discard_stale(cls, before):
+        """Discard the uploads without a chunk since `before`, returns how many there were."""
+        stale = list(cls.objects.filter(updated_at__lt=before))
+        for upload in stale:
+            upload.discard()
+        return len(stale)
+
+
+
+class MediaBlob(models.Model):
+    """
+    Reference count of a content-addressed file (see catalog/media.py), across every media field. Kept up to date
+    by the models' signals; blobs nobody references any more are deleted by collect_media_garbage.
+    """
+    name = models.CharField(max_length=100, primary_key=True)
+    refcount = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name}: {self.refcount}"
+
+    @classmethod
+    def reference(cls, name):
+        table = connection.ops.quote_name(cls._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} (name, refcount) VALUES (%s, 1) "
+                f"ON CONFLICT (name) DO UPDATE SET refcount = {table}.refcount + 1",
+                [name],
+            )
+
+    @classmethod
+    def release(cls, name):
+        cls.objects.filter(name=name).update(refcount=F('refcount') - 1)
+
+
 # Review models
 class ReviewSection(ReviewOrderMixin):  # ReviewSection model
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='review')
@@ -0,0 +1,187 @@
+from django.db import transaction
+from django.db.models import F
+from .cache import PRODUCT, REVIEWS
+from .conditional import invalidate_etags
+from .mixins import ORDER_GAP, ReviewOrderItemMixin, ReviewOrderMixin
+from .models import Product, ProductDetail, ReviewPhoto, ReviewSection, ReviewText, ReviewVideo, Sequence
+
+# Ordered catalog collections use sparse positions in their order_num: new rows are numbered ORDER_GAP apart,
+# and a move takes the midpoint between its new neighbours, a single-row write. When two neighbours end up
+# adjacent the collection is respaced, which `rebalance_ordering` also does ahead of time for crowded ones.
+
+# Collections whose smallest gap is below this are respaced by the rebalance_ordering command
+MIN_GAP = 16
+
+
+class OrderedScope:
+    """
+    One kind of ordered collection: the rows of `models` sharing the same `field` value (the key),
+    ordered by order_num across all the models.
+    """
+
+    def __init__(self, models, field, parent, sequence=None):
+        self.models = models
+        self.field = field
+        self.parent = parent  # Model of the key, locked while a collection is reordered
+        self.sequence = sequence  # Name format of the sequence numbering new rows, kept ahead of moved rows
+
+    def key(self, item):
+        return getattr(item, self.field)
+
+    def lock(self, key):
+        """Serialize reorders of one collection, two moves into the same gap would pick the same position."""
+        list(self.parent.objects.select_for_update().filter(pk=key).values_list('pk', flat=True))
+
+    def positions(self, key, exclude=None, **filters):
+        """order_num values of the collection as one query, without the `exclude` row."""
+        querysets = []
+        for model in self.models:
+            queryset = model.objects.filter(**{self.field: key}, **filters)
+            if exclude is not None and isinstance(exclude, model):
+                queryset = queryset.exclude(pk=exclude.pk)
+            querysets.append(queryset.order_by().values_list('order_num', flat=True))
+        return querysets[0].union(*querysets[1:]) if len(querysets) > 1 else querysets[0]
+
+    def neighbour(self, key, order_num, below, exclude=None):
+        """The closest position below (or above) `order_num`, None at the ends."""
+        if below:
+            positions = self.positions(key, exclude, order_num__lt=order_num).order_by('-order_num')
+        else:
+            positions = self.positions(key, exclude, order_num__gt=order_num).order_by('order_num')
+        return next(iter(positions[:1]), None)
+
+    def rebalance(self, key):
+        """Respace the collection to multiples of ORDER_GAP, keeping its order. Returns the number of rows."""
+        rows = sorted(
+            (order_num, index, pk)
+            for index, model in enumerate(self.models)
+            for pk, order_num in model.objects.filter(**{self.field: key}).values_list('pk', 'order_num')
+        )
+        if not rows:
+            return 0
+        # First shift everything above both the current and the final positions, so no step of either update
+        # collides with a row that hasn't moved yet
+        offset = max(rows[-1][0], len(rows) * ORDER_GAP) + 1
+        final = {index: [] for index in range(len(self.models))}
+        for position, (_, index, pk) in enumerate(rows, 1):
+            final[index].append(self.models[index](pk=pk, order_num=position * ORDER_GAP))
+        for index, model in enumerate(self.models):
+            if final[index]:
+                model.objects.filter(**{self.field: key}).update(order_num=F('order_num') + offset)
+                model.objects.bulk_update(final[index], ['order_num'], batch_size=1000)
+        self.reserve(key, len(rows) * ORDER_GAP)
+        self.changed(key)
+        return len(rows)
+
+    def keys(self):
+        keys = set()
+        for model in self.models:
+            keys.update(model.objects.values_list(self.field, flat=True).distinct())
+        return sorted(keys)
+
+    def crowded_keys(self, min_gap=MIN_GAP):
+        """Keys of the collections with two positions closer than `min_gap`."""
+        positions = {}
+        for model in self.models:
+            for key, order_num in model.objects.values_list(self.field, 'order_num').iterator(chunk_size=2000):
+                positions.setdefault(key, []).append(order_num)
+        crowded = []
+        for key, values in positions.items():
+            values.sort()
+            if any(upper - lower < min_gap for lower, upper in zip(values, values[1:])):
+                crowded.append(key)
+        return sorted(crowded)
+
+    def reserve(self, key, order_num):
+        if self.sequence is not None:
+            Sequence.advance_to(self.sequence.format(key=key), order_num)
+
+    def changed(self, key):
+        """Positions are written with update(), which skips the model signals, so drop cached responses here."""
+        raise NotImplementedError
+
+
+class ProductScope(OrderedScope):
+    def __init__(self, models, tag, sequence=None):
+        super().__init__(models, 'product_id', Product, sequence)
+        self.tag = tag
+
+    def changed(self, key):
+        invalidate_etags(self.tag.format(id=key))
+
+
+class ReviewSectionScope(OrderedScope):
+    def changed(self, key):
+        product_id = ReviewSection.objects.filter(pk=key).values_list('product_id', flat=True).first()
+        if product_id is not None:
+            invalidate_etags(REVIEWS.format(id=product_id))
+
+
+PRODUCT_DETAILS = ProductScope([ProductDetail], PRODUCT, ProductDetail.ORDER_SEQUENCE.replace('{product_id}', '{key}'))
+REVIEW_SECTIONS = ProductScope([ReviewSection], REVIEWS, ReviewOrderMixin.ORDER_SEQUENCE.replace('{product_id}', '{key}'))
+REVIEW_ITEMS = ReviewSectionScope(
+    [ReviewText, ReviewPhoto, ReviewVideo], 'review_section_id', ReviewSection,
+    ReviewOrderItemMixin.ITEM_SEQUENCE.replace('{section_id}', '{key}'),
+)
+
+# Every ordered model by the name used in the API, with its collection
+ORDERED_MODELS = {
+    'product_detail': (ProductDetail, PRODUCT_DETAILS),
+    'review_section': (ReviewSection, REVIEW_SECTIONS),
+    'review_text': (ReviewText, REVIEW_ITEMS),
+    'review_photo': (ReviewPhoto, REVIEW_ITEMS),
+    'review_video': (ReviewVideo, REVIEW_ITEMS),
+}
+ORDERED_MODEL_CHOICES = [(name, name) for name in ORDERED_MODELS]
+SCOPES = [PRODUCT_DETAILS, REVIEW_SECTIONS, REVIEW_ITEMS]
+
+
+def scope_for(item):
+    for model, scope in ORDERED_MODELS.values():
+        if isinstance(item, model):
+            return scope
+    raise TypeError(f"{type(item).__name__} is not an ordered catalog model.")
+
+
+def move(item, before=None, after=None):
+    """
+    Move `item` right before or right after another row of the same collection (of any item type for
+    review items) and return its new order_num. Only the moved row is written, unless its new neighbours
+    are adjacent and the collection has to be respaced first.
+    """
+    if (before is None) == (after is None):
+        raise ValueError("Give exactly one of before and after.")
+    target = before if before is not None else after
+    scope = scope_for(item)
+    key = scope.key(item)
+    if scope_for(target) is not scope or scope.key(target) != key:
+        raise ValueError("Both rows must belong to the same collection.")
+    if type(target) is type(item) and target.pk == item.pk:
+        return item.order_num
+
+    with transaction.atomic():
+        scope.lock(key)
+        target_position = type(target).objects.values_list('order_num', flat=True).get(pk=target.pk)
+        for _ in range(2):
+            if before is not None:
+                upper = target_position
+                lower = scope.neighbour(key, upper, below=True, exclude=item) or 0
+            else:
+                lower = target_position
+                upper = scope.neighbour(key, lower, below=False, exclude=item)
+                at_end = upper is None
+                if at_end:
+                    upper = lower + 2 * ORDER_GAP  # Moved to the end
+            if upper - lower > 1:
+                break
+            # No room between the neighbours, respace and look again
+            scope.rebalance(key)
+            target_position = type(target).objects.values_list('order_num', flat=True).get(pk=target.pk)
+
+        order_num = (lower + upper) // 2
+        type(item).objects.filter(pk=item.pk).update(order_num=order_num)
+        if after is not None and at_end:
+            scope.reserve(key, order_num)  # Past the last row, elsewhere the sequence is already ahead of it
+        scope.changed(key)
+    item.order_num = order_num
+    return order_num
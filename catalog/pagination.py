@@ -0,0 +1,153 @@
+import json
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, CursorPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class CreatedAtCursorPagination(CursorPagination):
+    """
+    Keyset pagination over (created_at, id), newest first.
+    Each page is a range scan on a matching index, so page 10,000 costs the same as page 1.
+    Unlike DRF's cursor, which keeps the first ordering field and an offset past the rows sharing its value, the
+    position holds every ordering field: rows tied on the first one are stepped over by the index as well.
+    Orderings end with a unique field.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-created_at', '-id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        offset, reverse, position = self.cursor or (0, False, None)
+
+        if position is not None:
+            queryset = queryset.filter(self.position_filter(position, reverse))
+        ordering = [field[1:] if field.startswith('-') else f'-{field}' for field in self.ordering] if reverse else self.ordering
+        results = list(queryset.order_by(*ordering)[offset:offset + self.page_size + 1])
+        self.page = results[:self.page_size]
+        following = self._get_position_from_instance(results[-1], self.ordering) if len(results) > len(self.page) else None
+
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.next_position = position is not None or offset > 0, position
+            self.has_previous, self.previous_position = following is not None, following
+        else:
+            self.has_next, self.next_position = following is not None, following
+            self.has_previous, self.previous_position = position is not None or offset > 0, position
+        self.display_page_controls = (self.has_previous or self.has_next) and self.template is not None
+        return self.page
+
+    def position_filter(self, position, reverse):
+        """The rows after a position in the ordering (before it for a reversed cursor), compared field by field."""
+        try:
+            values = json.loads(position)
+        except ValueError:
+            values = None
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+
+        fields = [(field.lstrip('-'), field.startswith('-') != reverse, value) for field, value in zip(self.ordering, values)]
+        condition = None
+        for name, descending, value in reversed(fields):
+            after = Q(**{f"{name}__{'lt' if descending else 'gt'}": value})
+            condition = after if condition is None else after | Q(**{name: value}) & condition
+        # The bound on the leading field alone lets the database seek the index instead of filtering the OR
+        name, descending, value = fields[0]
+        return Q(**{f"{name}__{'lte' if descending else 'gte'}": value}) & condition
+
+    def _get_position_from_instance(self, instance, ordering):
+        values = [instance[field.lstrip('-')] if isinstance(instance, dict) else getattr(instance, field.lstrip('-')) for field in ordering]
+        return json.dumps([str(value) for value in values])
+
+
+class ProductCursorPagination(CreatedAtCursorPagination):
+    """
+    Newest first, or by the lowest in-stock SKU price with ?ordering=price / -price. The price is the summary's sort
+    key for the direction (see ProductQuerySet.with_price()), which puts products without a price last either way.
+    """
+    price_orderings = {
+        # Ties follow the product id in the same direction
+        'price': ('price_key', 'id'),
+        '-price': ('-price_key', '-id'),
+    }
+
+    def paginate_queryset(self, queryset, request, view=None):
+        value = request.query_params.get('ordering')
+        if value in self.price_orderings:
+            queryset = queryset.with_price(descending=value.startswith('-'))
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_ordering(self, request, queryset, view):
+        value = request.query_params.get('ordering')
+        if not value:
+            return super().get_ordering(request, queryset, view)
+        if value not in self.price_orderings:
+            raise ValidationError({'ordering': f"Must be one of: {', '.join(self.price_orderings)}."})
+        return self.price_orderings[value]
+
+
+class BrandCursorPagination(CreatedAtCursorPagination):
+    # Brands have no created_at, the unique brand_name is a stable and indexed sort key
+    ordering = ('brand_name',)
+
+
+class IdCursorPagination(CreatedAtCursorPagination):
+    # The default pagination (see REST_FRAMEWORK in settings), newest first on the primary key every table has
+    ordering = ('-id',)
+
+
+class OrderNumCursorPagination(CreatedAtCursorPagination):
+    # The items of one product in their display order, backed by the unique (product, order_num) constraints
+    ordering = ('order_num', 'id')
+
+
+class RankedOffsetPagination(BasePagination):
+    """
+    Offset pagination for results ranked outside the ORM (search relevance, facet filters), which have no keyset.
+    One extra id is fetched to tell whether a next page exists, so no COUNT query is needed.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    offset_query_param = 'offset'
+
+    def get_int_param(self, request, name, default):
+        value = request.query_params.get(name, '')
+        if not value:
+            return default
+        if not value.isdigit():
+            raise ValidationError({name: "Must be a non-negative integer."})
+        return int(value)
+
+    def paginate_ids(self, request, fetch):
+        """Call fetch(offset, limit) for one page of ranked ids and return the ids of the requested page."""
+        self.request = request
+        self.offset = self.get_int_param(request, self.offset_query_param, 0)
+        self.limit = min(self.get_int_param(request, self.page_size_query_param, self.page_size), self.max_page_size) or self.page_size
+        ids = fetch(self.offset, self.limit + 1)
+        self.has_next = len(ids) > self.limit
+        return ids[:self.limit]
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.offset_query_param, self.offset + self.limit)
+
+    def get_previous_link(self):
+        if self.offset <= 0:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.offset_query_param, max(self.offset - self.limit, 0))
+
+    def get_paginated_response(self, data, **extra):
+        return Response({'next': self.get_next_link(), 'previous': self.get_previous_link(), **extra, 'results': data})
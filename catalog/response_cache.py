@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import OrderedDict
+from django.core.cache import cache
+from django.http import HttpResponse
+from rest_framework import status
+from .conditional import ConditionalGetMixin
+
+# Rendered responses are keyed by their ETag, which embeds the versions of every dependency tag,
+# so a bumped tag simply stops matching old entries. The timeout only frees memory.
+RESPONSE_KEY = 'catalog:response:{etag}'
+RESPONSE_TIMEOUT = 60 * 60
+# Only one worker renders a missing entry, the others wait for it instead of hitting the database too
+LOCK_KEY = 'catalog:response:lock:{etag}'
+LOCK_TIMEOUT = 10
+LOCK_WAIT = 2.0
+LOCK_POLL_INTERVAL = 0.05
+# In-process front tier, so hot entries skip the transfer from Redis
+LOCAL_MAX_BYTES = 32 * 1024 * 1024
+
+
+class ResponseCache:
+    """
+    Two tier store of rendered (content, content type) pairs: a per-process LRU bounded in bytes
+    in front of the shared Django cache.
+    """
+
+    def __init__(self, max_bytes=LOCAL_MAX_BYTES):
+        self.lock = threading.Lock()
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.local = OrderedDict()
+
+    def get(self, etag):
+        with self.lock:
+            entry = self.local.get(etag)
+            if entry is not None:
+                self.local.move_to_end(etag)
+                return entry
+        entry = cache.get(RESPONSE_KEY.format(etag=etag))
+        if entry is not None:
+            self._remember(etag, entry)
+        return entry
+
+    def set(self, etag, entry):
+        cache.set(RESPONSE_KEY.format(etag=etag), entry, timeout=RESPONSE_TIMEOUT)
+        self._remember(etag, entry)
+
+    def _remember(self, etag, entry):
+        with self.lock:
+            if etag in self.local:
+                return
+            self.local[etag] = entry
+            self.size += len(entry[0])
+            while self.size > self.max_bytes and self.local:
+                _, (content, _) = self.local.popitem(last=False)
+                self.size -= len(content)
+
+    def clear_local(self):
+        with self.lock:
+            self.local.clear()
+            self.size = 0
+
+    # Stampede protection
+    def acquire(self, etag):
+        """Claim the rendering of an entry, False if another worker is already on it."""
+        return cache.add(LOCK_KEY.format(etag=etag), 1, timeout=LOCK_TIMEOUT)
+
+    def release(self, etag):
+        cache.delete(LOCK_KEY.format(etag=etag))
+
+    def wait(self, etag):
+        """Wait for the worker holding the lock to store the entry, None if it didn't in time."""
+        deadline = time.monotonic() + LOCK_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(LOCK_POLL_INTERVAL)
+            entry = self.get(etag)
+            if entry is not None:
+                return entry
+        return None
+
+
+response_cache = ResponseCache()
+
+
+class CachedResponseMixin(ConditionalGetMixin):
+    """
+    Serve anonymous GETs from the response cache, keyed by the ETag of the request.
+    Authenticated requests and responses other than 200 OK are never cached.
+    """
+
+    def get_full_response(self, etag, request, *args, **kwargs):
+        self.response_cache_etag = None
+        if etag is None or request.user.is_authenticated:
+            return super().get_full_response(etag, request, *args, **kwargs)
+
+        etag = etag.strip('"')
+        entry = response_cache.get(etag)
+        if entry is None:
+            if response_cache.acquire(etag):
+                # Rendered and stored in finalize_response(), once the renderer is negotiated
+                self.response_cache_etag = etag
+            else:
+                # Past the wait the response is rendered here too, but left to the lock holder to store
+                entry = response_cache.wait(etag)
+        if entry is not None:
+            content, content_type = entry
+            return HttpResponse(content, content_type=content_type)
+        return super().get_full_response(etag, request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        etag = getattr(self, 'response_cache_etag', None)
+        if etag is not None:
+            try:
+                if response.status_code == status.HTTP_200_OK:
+                    response.render()
+                    response_cache.set(etag, (response.content, response['Content-Type']))
+            finally:
+                response_cache.release(etag)
+        return response
@@ -0,0 +1,83 @@
+import re
+from django.db import connection
+from django.db.models import Case, IntegerField, Q, Value, When
+from .models import ProductSearchDocument
+
+# Full-text search over ProductSearchDocument. The index itself is created by migration 0015:
+# - PostgreSQL: a generated, weighted tsvector column with a GIN index
+# - SQLite: an FTS5 table of the active documents with prefix indexes, kept in sync by triggers
+# - Other databases: no index, documents are matched with LIKE and ranked by the field that matched
+
+FTS_TABLE = 'catalog_productsearch_fts'
+MAX_TERMS = 10
+# bm25() weights of the FTS5 columns, in the same proportions as the tsvector weights A, B and C
+FTS_WEIGHTS = (10.0, 5.0, 1.0)
+
+
+def search_terms(query):
+    """Split a user query into word terms, anything else (operators, quotes) is dropped."""
+    return re.findall(r'\w+', query.lower())[:MAX_TERMS]
+
+
+def search_product_ids(query, limit, offset=0):
+    """
+    Ids of the active products matching every term of the query, best match first.
+    While the last term is still being typed (no trailing space) it also matches as a prefix.
+    Every match is ranked, words in the name weigh more than in category names, which weigh more than the
+    summary and description.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return []
+    # A one letter prefix would match nearly every product
+    prefix = not query[-1].isspace() and len(terms[-1]) > 1
+    if connection.vendor == 'postgresql':
+        return _search_postgresql(terms, prefix, limit, offset)
+    if connection.vendor == 'sqlite':
+        return _search_sqlite(terms, prefix, limit, offset)
+    return _search_fallback(terms, limit, offset)
+
+
+def _search_postgresql(terms, prefix, limit, offset):
+    tsquery = ' & '.join(terms[:-1] + [f'{terms[-1]}:*' if prefix else terms[-1]])
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT product_id FROM catalog_productsearchdocument, to_tsquery('simple', %s) AS query
+            WHERE is_active AND search_vector @@ query
+            ORDER BY ts_rank(search_vector, query) DESC, product_id DESC
+            LIMIT %s OFFSET %s
+            """,
+            [tsquery, limit, offset],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _search_sqlite(terms, prefix, limit, offset):
+    # Only active products are in the FTS table, so it answers without touching the documents
+    match = '(' + ' '.join(f'"{term}"' for term in terms) + ('*' if prefix else '') + ')'
+    weights = ', '.join(str(weight) for weight in FTS_WEIGHTS)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s
+            ORDER BY bm25({FTS_TABLE}, {weights}), rowid DESC
+            LIMIT %s OFFSET %s
+            """,
+            [match, limit, offset],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _search_fallback(terms, limit, offset):
+    documents = ProductSearchDocument.objects.filter(is_active=True)
+    for term in terms:
+        documents = documents.filter(Q(name__icontains=term) | Q(categories__icontains=term) | Q(body__icontains=term))
+    first = terms[0]
+    documents = documents.annotate(rank=Case(
+        When(name__icontains=first, then=Value(3)),
+        When(categories__icontains=first, then=Value(2)),
+        default=Value(1),
+        output_field=IntegerField(),
+    ))
+    return list(documents.order_by('-rank', '-product_id').values_list('product_id', flat=True)[offset:offset + limit])
@@ -1,11 +1,48 @@
+import heapq
 from rest_framework import serializers
 from drf_spectacular.utils import extend_schema_field
 from drf_spectacular.types import OpenApiTypes
 from django.db import transaction
 from .models import *
+from .cache import PRODUCT
+from .conditional import invalidate_etags
+from .export import EXPORT_FORMATS
+from .importer import DEFAULT_BATCH_SIZE, FORMATS, detect_format
+from .variants import MAX_VARIANTS
+from .uploads import MAX_UPLOAD_SIZE, VIDEO_EXTENSIONS
+from .images import FORMATS as IMAGE_FORMATS, VARIANTS as IMAGE_VARIANTS, variant_name
+from .ordering import ORDERED_MODEL_CHOICES, ORDERED_MODELS, scope_for
+
+@extend_schema_field({
+    'type': 'object', 'nullable': True,
+    'properties': {variant: {'type': 'object', 'properties': {format: {'type': 'string', 'format': 'uri'} for format in IMAGE_FORMATS}} for variant in IMAGE_VARIANTS},
+})
+class ImageVariantsField(serializers.Field):
+    """
+    URLs of the resized variants of an image field, {variant: {format: url}}, see catalog/images.py.
+    Derived from the file name, a variant still being generated answers 404.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        request = self.context.get('request')
+        urls = {}
+        for variant in IMAGE_VARIANTS:
+            urls[variant] = {}
+            for format in IMAGE_FORMATS:
+                url = value.storage.url(variant_name(value.name, variant, format))
+                urls[variant][format] = request.build_absolute_uri(url) if request is not None else url
+        return urls
+
 
     # Brand serializers
 class BrandSerializer(serializers.ModelSerializer):
+    icon_variants = ImageVariantsField(source='icon')
 
     class Meta:
         model = Brand
@@ -19,7 +56,7 @@ class BrandSerializer(serializers.ModelSerializer):
         if request is not None:
             if request.method == 'GET':
                 # For GET requests, include only specific fields
-                allowed_fields = ['id', 'brand_name', 'icon', 'is_active']  # Define allowed fields
+                allowed_fields = ['id', 'brand_name', 'icon', 'icon_variants', 'is_active']  # Define allowed fields
                 self.fields = {field: self.fields[field] for field in allowed_fields}
             else:
                 # For other methods, include all fields (default behavior)
@@ -27,6 +64,7 @@ class BrandSerializer(serializers.ModelSerializer):
 
 
 class BrandPhotoSerializer(serializers.ModelSerializer):
+    photo_variants = ImageVariantsField(source='photo')
 
     class Meta:
         model = BrandPhoto
@@ -59,10 +97,11 @@ class BrandVideoSerializer(serializers.ModelSerializer):
 class BrandDetailSerializer(serializers.ModelSerializer):
     photos = BrandPhotoSerializer(many=True, read_only=True)  # Nested photos
     videos = BrandVideoSerializer(many=True, read_only=True)  # Nested videos
+    icon_variants = ImageVariantsField(source='icon')
 
     class Meta:
         model = Brand
-        fields = ['id', 'brand_name', 'description', 'website', 'instagram', 'facebook', 'icon', 'is_active', 'photos', 'videos']
+        fields = ['id', 'brand_name', 'description', 'website', 'instagram', 'facebook', 'icon', 'icon_variants', 'is_active', 'photos', 'videos']
 
 
     # Attribute serializers
@@ -114,23 +153,33 @@ class AdminCategorySerializer(serializers.ModelSerializer):
     all_attribute_groups = AttributeGroupSerializer(many=True, read_only=True)  # For combined parent and category groups
     created_at = serializers.DateTimeField(read_only=True)  # Make it read-only
     level = serializers.IntegerField(read_only=True)  # Make level read-only
+    photo_variants = ImageVariantsField(source='photo')
 
     class Meta:
         model = Category
-        fields = ['id', 'name', 'parent', 'attribute_groups', 'all_attribute_groups', 'photo', 'description', 'level', 'created_at', 'is_active']
+        fields = ['id', 'name', 'parent', 'attribute_groups', 'all_attribute_groups', 'photo', 'photo_variants', 'description', 'level', 'created_at', 'is_active']
 
     def to_representation(self, instance):
         """Override to include parent attribute groups combined with the category's own."""
         representation = super().to_representation(instance)
         representation['all_attribute_groups'] = AttributeGroupSerializer(instance.get_all_attribute_groups(), many=True).data
         return representation
+
+    def validate_parent(self, value):
+        """Prevent moving a category under itself or one of its subcategories."""
+        if value is not None and self.instance is not None and \
+                self.instance.get_descendants(include_self=True).filter(pk=value.pk).exists():
+            raise serializers.ValidationError("A category can't be moved under itself or one of its subcategories.")
+        return value
     
     
 # Serializer for listing categories for users
 class UserCategoryListSerializer(serializers.ModelSerializer):
+    photo_variants = ImageVariantsField(source='photo')
+
     class Meta:
         model = Category
-        fields = ['id', 'name', 'photo', 'level', 'is_active']
+        fields = ['id', 'name', 'photo', 'photo_variants', 'level', 'is_active']
         
         
 # # Serializer for category detail view for users
@@ -138,12 +187,14 @@ class UserCategoryDetailSerializer(serializers.ModelSerializer):
     all_attribute_groups = AttributeGroupSerializer(many=True, read_only=True)
     subcategories = serializers.SerializerMethodField()
     parent_category = serializers.SerializerMethodField()
+    breadcrumbs = serializers.SerializerMethodField()
+    photo_variants = ImageVariantsField(source='photo')
 
     class Meta:
         model = Category
         fields = [
-            'id', 'name', 'parent', 'photo', 'description', 'level', 
-            'is_active', 'all_attribute_groups', 'subcategories', 'parent_category'
+            'id', 'name', 'parent', 'photo', 'photo_variants', 'description', 'level', 
+            'is_active', 'all_attribute_groups', 'subcategories', 'parent_category', 'breadcrumbs'
         ]
 
     def get_subcategories(self, instance) -> list[dict]:
@@ -158,6 +209,10 @@ class UserCategoryDetailSerializer(serializers.ModelSerializer):
             return UserCategoryListSerializer(instance.parent).data
         return None
 
+    def get_breadcrumbs(self, instance) -> list[dict]:
+        """Get the path from the root category down to this one."""
+        return instance.get_breadcrumbs()
+
 
 # Serializer for nested categories (parent-child)
 class CategoryTreeSerializer(serializers.ModelSerializer):
@@ -175,51 +230,95 @@ class CategoryTreeSerializer(serializers.ModelSerializer):
         return CategoryTreeSerializer(active_subcategories, many=True).data
 
 
-# Serializer for list all products
-class ProductListSerializer(serializers.ModelSerializer):
-    attribute_groups = serializers.SerializerMethodField()  # Get attribute groups
-    price_range = serializers.SerializerMethodField()  # Get price range
-    is_available = serializers.SerializerMethodField()  # Check if product is available
-
-    class Meta:
-        model = Product
-        fields = ['id', 'name', 'cover', 'category', 'attribute_groups', 'price_range', 'is_available', 'created_at', 'is_active']
+# Shared getters for product serializers, reading the denormalized `ProductSummary` row when it exists
+class ProductSummaryFieldsMixin:
 
     def get_attribute_groups(self, obj) -> list[dict]:
+        # Use the groups resolved in one pass by the list serializer if available
+        groups_map = self.context.get('category_attribute_groups')
+        if groups_map is not None and obj.category_id in groups_map:
+            return groups_map[obj.category_id]
         return [{'id': group.id, 'name': group.name} for group in obj.category.get_all_attribute_groups()]
 
     def get_price_range(self, obj) -> dict:
+        summary = getattr(obj, 'sku_summary', None)
+        if summary is not None:
+            return {'min_price': summary.min_price or 0, 'max_price': summary.max_price or 0}  # 0 without SKUs
         prices = obj.skus.values_list('price', flat=True)
         if prices:
             return {'min_price': min(prices), 'max_price': max(prices)}
         return {'min_price': 0, 'max_price': 0}
 
     def get_is_available(self, obj) -> bool:
+        summary = getattr(obj, 'sku_summary', None)
+        if summary is not None:
+            return summary.is_available
         # Check if any SKU of the product has quantity > 0
         return obj.skus.filter(quantity__gt=0).exists()
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductListSerializerList(serializers.ListSerializer):
+    """Resolve the attribute groups of all listed products' categories in one batch before rendering rows."""
+
+    def to_representation(self, data):
+        products = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        self.context['category_attribute_groups'] = Category.get_attribute_groups_map(
+            {product.category_id for product in products}
+        )
+        return super().to_representation(products)
+
+
+# Serializer for list all products
+class ProductListSerializer(ProductSummaryFieldsMixin, serializers.ModelSerializer):
     attribute_groups = serializers.SerializerMethodField()  # Get attribute groups
     price_range = serializers.SerializerMethodField()  # Get price range
     is_available = serializers.SerializerMethodField()  # Check if product is available
+    cover_variants = ImageVariantsField(source='cover')
 
     class Meta:
         model = Product
-        fields = ['id', 'name', 'description', 'summary', 'cover', 'category', 'attribute_groups', 'price_range', 'is_available', 'created_at', 'is_active']
+        fields = ['id', 'name', 'cover', 'cover_variants', 'category', 'attribute_groups', 'price_range', 'is_available', 'created_at', 'is_active']
+        list_serializer_class = ProductListSerializerList
 
-    def get_attribute_groups(self, obj) -> list[dict]:
-        return [{'id': group.id, 'name': group.name} for group in obj.category.get_all_attribute_groups()]
 
-    def get_price_range(self, obj) -> dict:
-        prices = obj.skus.values_list('price', flat=True)
-        if prices:
-            return {'min_price': min(prices), 'max_price': max(prices)}
-        return {'min_price': 0, 'max_price': 0}
+# Serializers describing the facet search response of a category
+class FacetValueSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    value = serializers.JSONField()
+    count = serializers.IntegerField()  # Matching products if this value is added to the selection
+    selected = serializers.BooleanField()
+
+
+class FacetSerializer(serializers.Serializer):
+    id = serializers.IntegerField()  # Attribute type id
+    name = serializers.CharField()
+    values = FacetValueSerializer(many=True)
 
-    def get_is_available(self, obj) -> bool:
-        # Check if any SKU of the product has quantity > 0
-        return obj.skus.filter(quantity__gt=0).exists()
+
+class CategoryFacetSearchSerializer(serializers.Serializer):
+    next = serializers.URLField(allow_null=True)
+    previous = serializers.URLField(allow_null=True)
+    count = serializers.IntegerField()
+    facets = FacetSerializer(many=True)
+    results = ProductListSerializer(many=True)
+
+
+# Serializer describing the product search response
+class ProductSearchResultsSerializer(serializers.Serializer):
+    next = serializers.URLField(allow_null=True)
+    previous = serializers.URLField(allow_null=True)
+    results = ProductListSerializer(many=True)
+
+
+class ProductSerializer(ProductSummaryFieldsMixin, serializers.ModelSerializer):
+    attribute_groups = serializers.SerializerMethodField()  # Get attribute groups
+    price_range = serializers.SerializerMethodField()  # Get price range
+    is_available = serializers.SerializerMethodField()  # Check if product is available
+    cover_variants = ImageVariantsField(source='cover')
+
+    class Meta:
+        model = Product
+        fields = ['id', 'name', 'description', 'summary', 'cover', 'cover_variants', 'category', 'attribute_groups', 'price_range', 'is_available', 'created_at', 'is_active']
 
 
 class ProductDetailSerializer(serializers.ModelSerializer):
@@ -228,14 +327,19 @@ class ProductDetailSerializer(serializers.ModelSerializer):
         fields = ['id', 'product', 'title', 'value', 'order_num']
         extra_kwargs = {
             'product': {'required': True},
-            'order_num': {'required': True}
+            'order_num': {'required': False}  # Numbered after the product's other details when left out
         }
+        validators = []  # The unique order number is checked in validate(), only when one is given
     
     def validate(self, data):
-        product = data.get('product')
+        product = data.get('product', getattr(self.instance, 'product', None))
         order_num = data.get('order_num')
-        if ProductDetail.objects.filter(product=product, order_num=order_num).exists():
-            raise serializers.ValidationError("Order number must be unique per product.")
+        if order_num is not None:
+            others = ProductDetail.objects.filter(product=product, order_num=order_num)
+            if self.instance is not None:
+                others = others.exclude(pk=self.instance.pk)
+            if others.exists():
+                raise serializers.ValidationError("Order number must be unique per product.")
         return data
 
 
@@ -247,13 +351,19 @@ class ProductDetailOrderUpdateSerializer(serializers.ModelSerializer):
 
 class ProductDetailUpdateSerializer(serializers.Serializer):
     id = serializers.IntegerField()
-    order_num = serializers.IntegerField()
+    order_num = serializers.IntegerField(min_value=0)
 
 
 class ProductDetailBatchUpdateSerializer(serializers.Serializer):
     product_id = serializers.IntegerField()
     updates = ProductDetailUpdateSerializer(many=True)
 
+    def validate_updates(self, value):
+        order_nums = [item['order_num'] for item in value]
+        if len(set(order_nums)) != len(order_nums):
+            raise serializers.ValidationError("Order numbers must be unique.")
+        return value
+
     def update(self, instance, validated_data):
         product_id = validated_data.get('product_id')
         update_data = validated_data.get('updates', [])
@@ -273,31 +383,21 @@ class ProductDetailBatchUpdateSerializer(serializers.Serializer):
             # Step 1: Delete any ProductDetail records that are not in the update list
             ProductDetail.objects.filter(product_id=product_id).exclude(id__in=update_ids).delete()
 
-            # Step 2: Update order_num for the remaining ProductDetail instances using temporary values
-            # Assign temporary order values to avoid unique constraint issues
-            temp_order_num = max(
-                ProductDetail.objects.filter(product_id=product_id).values_list('order_num', flat=True)
-            ) + 1
+            # Step 2: Set the new order_num values in one statement
+            ProductDetail.reorder(product_id, {item['id']: item['order_num'] for item in update_data})
 
-            # Temporarily set all order numbers to a value outside the current range
-            for update_item in update_data:
-                detail_id = update_item['id']
-                temp_order_num += 1
-                ProductDetail.objects.filter(id=detail_id).update(order_num=temp_order_num)
-
-            # Step 3: Set the final order_num values
-            for update_item in update_data:
-                detail_id = update_item['id']
-                order_num = update_item['order_num']
-                ProductDetail.objects.filter(id=detail_id).update(order_num=order_num)
+            # The reorder skips the model signals, drop the cached responses of the product here
+            invalidate_etags(PRODUCT.format(id=product_id))
 
         return instance
     
     
 class ProductPhotoSerializer(serializers.ModelSerializer):
+    photo_variants = ImageVariantsField(source='photo')
+
     class Meta:
         model = ProductPhoto
-        fields = ['id', 'product', 'alt', 'photo', 'uploaded_at']
+        fields = ['id', 'product', 'alt', 'photo', 'photo_variants', 'uploaded_at']
         extra_kwargs = {
             'photo': {'required': True},
             'alt': {'required': True}
@@ -368,10 +468,11 @@ class ReviewTextSerializer(serializers.ModelSerializer):
 class ReviewPhotoSerializer(serializers.ModelSerializer):
     review_section = serializers.PrimaryKeyRelatedField(queryset=ReviewSection.objects.all())  # Allows linking to a ReviewSection
     position = serializers.ChoiceField(choices=ReviewPhoto.POSITION_CHOICES)  # Allows selection from predefined choices
+    image_variants = ImageVariantsField(source='image')
 
     class Meta:
         model = ReviewPhoto
-        fields = ['id', 'review_section', 'image', 'position', 'order_num']  # Includes foreign key review_section, image, position, and order number
+        fields = ['id', 'review_section', 'image', 'image_variants', 'position', 'order_num']  # Includes foreign key review_section, image, position, and order number
         read_only_fields = ['order_num']  # Ensures order_num is read-only
         
         
@@ -405,29 +506,33 @@ class ReviewSectionDetailSerializer(serializers.ModelSerializer):
         # read_only_fields = ['order_num']
         
     def get_items(self, obj) -> list[dict]:
-        # Retrieve all related texts, photos, and videos
-        texts = obj.texts.all()
-        photos = obj.photos.all()
-        videos = obj.videos.all()
-
-        # Serialize each related item
-        texts_serialized = ReviewTextSerializer(texts, many=True).data
-        photos_serialized = ReviewPhotoSerializer(photos, many=True).data
-        videos_serialized = ReviewVideoSerializer(videos, many=True).data
-
-        # Add an identifier to each serialized item type
-        for item in texts_serialized:
-            item['type'] = 'text'
-        for item in photos_serialized:
-            item['type'] = 'photo'
-        for item in videos_serialized:
-            item['type'] = 'video'
-
-        # Combine all serialized items into a single list
-        combined_items = texts_serialized + photos_serialized + videos_serialized
-
-        # Sort by 'order_num' and return the list
-        return sorted(combined_items, key=lambda x: x['order_num'])
+        # Texts, photos and videos each come ordered by order_num (from the prefetch cache when the view prefetched them)
+        streams = []
+        for serializer_class, items, item_type in (
+            (ReviewTextSerializer, obj.texts.all(), 'text'),
+            (ReviewPhotoSerializer, obj.photos.all(), 'photo'),
+            (ReviewVideoSerializer, obj.videos.all(), 'video'),
+        ):
+            serialized = serializer_class(items, many=True).data
+            # Add an identifier to each serialized item type
+            for item in serialized:
+                item['type'] = item_type
+            streams.append(serialized)
+
+        # Merge the three ordered lists instead of sorting their concatenation
+        return list(heapq.merge(*streams, key=lambda item: item['order_num']))
+
+
+# Everything shown on the product page, in one response
+class ProductPageSerializer(ProductSerializer):
+    details = ProductDetailSerializer(many=True, read_only=True)
+    photos = ProductPhotoSerializer(many=True, read_only=True)
+    videos = ProductVideoSerializer(many=True, read_only=True)
+    skus = ProductSKUSerializer(many=True, read_only=True)
+    review_sections = ReviewSectionDetailSerializer(source='review', many=True, read_only=True)
+
+    class Meta(ProductSerializer.Meta):
+        fields = ProductSerializer.Meta.fields + ['details', 'photos', 'videos', 'skus', 'review_sections']
 
 
 class SwapOrderNumSerializer(serializers.Serializer):
@@ -470,3 +575,108 @@ class SwapOrderNumItemsSerializer(serializers.Serializer):
             ReviewPhoto.objects.filter(review_section_id=review_section_id, order_num=order_num).exists() or
             ReviewVideo.objects.filter(review_section_id=review_section_id, order_num=order_num).exists()
         )
+
+
+class OrderingMoveSerializer(serializers.Serializer):
+    model = serializers.ChoiceField(choices=ORDERED_MODEL_CHOICES)
+    id = serializers.IntegerField()
+    before = serializers.IntegerField(required=False)  # ID of the row to move in front of
+    after = serializers.IntegerField(required=False)  # ID of the row to move behind
+    target_model = serializers.ChoiceField(choices=ORDERED_MODEL_CHOICES, required=False)  # Defaults to model
+
+    def validate(self, data):
+        if ('before' in data) == ('after' in data):
+            raise serializers.ValidationError("Give exactly one of before and after.")
+
+        data['item'] = self._get(data['model'], data['id'])
+        target_model = data.get('target_model', data['model'])
+        data['target'] = self._get(target_model, data['before'] if 'before' in data else data['after'])
+
+        # Review items can be moved next to an item of another type, everything else only within its own model
+        scope = scope_for(data['item'])
+        if scope_for(data['target']) is not scope or scope.key(data['target']) != scope.key(data['item']):
+            raise serializers.ValidationError("Both rows must belong to the same product or review section.")
+        return data
+
+    def _get(self, name, pk):
+        model = ORDERED_MODELS[name][0]
+        try:
+            return model.objects.get(pk=pk)
+        except model.DoesNotExist:
+            raise serializers.ValidationError(f"{model.__name__} {pk} not found.")
+
+
+class CatalogImportSerializer(serializers.Serializer):
+    file = serializers.FileField()
+    format = serializers.ChoiceField(choices=FORMATS, required=False)  # Defaults to the file extension
+    batch_size = serializers.IntegerField(min_value=1, max_value=10000, default=DEFAULT_BATCH_SIZE)
+
+    def validate(self, data):
+        data['format'] = data.get('format') or detect_format(data['file'].name)
+        if data['format'] is None:
+            raise serializers.ValidationError("Unknown file format, pass format.")
+        return data
+
+
+class ExportSerializer(serializers.Serializer):
+    # Not `format`, which DRF reserves for choosing the renderer
+    file_format = serializers.ChoiceField(choices=EXPORT_FORMATS, default='csv')
+    gzip = serializers.BooleanField(default=False)
+
+
+class SKUMatrixSerializer(serializers.Serializer):
+    # Values of one or more attribute types, a SKU is created for every combination of one value per type
+    attribute_values = serializers.ListField(child=serializers.IntegerField(), min_length=1)
+    price = serializers.IntegerField(default=0)
+    quantity = serializers.IntegerField(min_value=0, default=0)
+    is_active = serializers.BooleanField(default=True)
+
+    def validate_attribute_values(self, value):
+        value_ids = list(dict.fromkeys(value))
+        types = dict(ProductAttributeValue.objects.filter(id__in=value_ids).values_list('id', 'type_id'))
+        missing = [value_id for value_id in value_ids if value_id not in types]
+        if missing:
+            raise serializers.ValidationError(f"Attribute values not found: {missing}.")
+
+        values_by_type = {}
+        for value_id in value_ids:
+            values_by_type.setdefault(types[value_id], []).append(value_id)
+        count = 1
+        for type_values in values_by_type.values():
+            count *= len(type_values)
+        if count > MAX_VARIANTS:
+            raise serializers.ValidationError(f"The matrix has {count} variants, at most {MAX_VARIANTS} can be created at once.")
+        return values_by_type
+
+
+class ChunkedUploadSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = ChunkedUpload
+        fields = ['id', 'target', 'filename', 'size', 'offset', 'created_at', 'updated_at']
+        read_only_fields = ['offset']
+        extra_kwargs = {'size': {'min_value': 1, 'max_value': MAX_UPLOAD_SIZE}}
+
+    # Targets any signed-in user may upload to, like the review video endpoint; the others are for admins
+    PUBLIC_TARGETS = ('review_video',)
+
+    def validate_target(self, value):
+        user = self.context['request'].user
+        if value not in self.PUBLIC_TARGETS and not (user.is_staff or user.is_superuser):
+            raise serializers.ValidationError("Only admins can upload this kind of video.")
+        return value
+
+    def validate_filename(self, value):
+        # Checked up front, so a file the video models would reject isn't transferred first
+        value = value.replace('\\', '/').rsplit('/', 1)[-1]
+        if '.' not in value or value.rsplit('.', 1)[1].lower() not in VIDEO_EXTENSIONS:
+            raise serializers.ValidationError(f"Allowed extensions are: {', '.join(VIDEO_EXTENSIONS)}.")
+        return value
+
+
+# Serializers creating the row a finished chunked upload is attached to, the file fills their `video` field
+CHUNKED_UPLOAD_TARGETS = {
+    'product_video': ProductVideoSerializer,
+    'brand_video': BrandVideoSerializer,
+    'review_video': ReviewVideoSerializer,
+}
@@ -0,0 +1,210 @@
+from django.apps import apps
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from .models import (
+    AttributeGroup, AttributeType, Brand, BrandPhoto, BrandVideo, Category, CategoryClosure, Product,
+    ProductAttributeValue, ProductDetail, ProductPhoto, ProductSKU, ProductSKUAttribute, ProductSummary,
+    ProductSearchDocument, ProductVideo, ReviewPhoto, ReviewSection, ReviewText, ReviewVideo,
+)
+from .cache import (
+    ATTRIBUTE_GROUPS, ATTRIBUTES, BRAND, BRANDS, CATEGORIES, CATEGORY, CATEGORY_TREE, PRODUCT, PRODUCTS, REVIEWS, bump_version,
+)
+from .conditional import invalidate_etags
+from .facets import invalidate_facets, products_changed
+from .images import IMAGE_FIELDS, register as register_image_field
+from .media import MEDIA_FIELDS, track_references
+
+
+@receiver(post_save, sender=Product)
+def create_product_summary(sender, instance, created, raw=False, **kwargs):
+    # Every product gets a summary row, so listings can always read it with a join
+    if created and not raw:
+        ProductSummary.objects.get_or_create(product=instance)
+
+
+@receiver(post_save, sender=ProductSKU)
+def refresh_summary_on_sku_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        ProductSummary.refresh_for_products([instance.product_id])
+
+
+@receiver(post_delete, sender=ProductSKU)
+def refresh_summary_on_sku_delete(sender, instance, origin=None, **kwargs):
+    # SKUs removed by a cascade from their product (or category) don't need a refresh, the summary goes with it
+    if isinstance(origin, ProductSKU) or (isinstance(origin, QuerySet) and origin.model is ProductSKU):
+        ProductSummary.refresh_for_products([instance.product_id])
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_tree(sender, raw=False, **kwargs):
+    # Any category write may change the tree, cached copies are dropped by moving to a new version. Only once the
+    # write is committed: a request reading the new version before that would cache the old tree under it
+    if not raw:
+        transaction.on_commit(lambda: bump_version(CATEGORY_TREE))
+
+
+@receiver(m2m_changed, sender=Category.attribute_groups.through)
+def propagate_changed_attribute_groups(sender, instance, action, reverse, pk_set, **kwargs):
+    # Serializers assign many-to-many fields after save(), so propagate again once the groups are in place
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        instance.propagate_attribute_groups()
+    elif pk_set:
+        # Changed from the group side, shallower categories first so deeper ones keep the last word like on save
+        for category in Category.objects.filter(pk__in=pk_set).order_by('level'):
+            category.propagate_attribute_groups()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductSKU)
+@receiver(post_delete, sender=ProductSKU)
+def reindex_product_facets(sender, instance, raw=False, **kwargs):
+    if not raw:
+        products_changed([instance.pk if sender is Product else instance.product_id])
+
+
+@receiver(post_save, sender=ProductSKUAttribute)
+@receiver(post_delete, sender=ProductSKUAttribute)
+def reindex_sku_attribute_facets(sender, instance, raw=False, origin=None, **kwargs):
+    # Attributes removed by a cascade from their SKU are covered by the SKU's own signal
+    if raw or (origin is not None and not isinstance(origin, ProductSKUAttribute)
+               and not (isinstance(origin, QuerySet) and origin.model is ProductSKUAttribute)):
+        return
+    product_id = ProductSKU.objects.filter(pk=instance.sku_id).values_list('product_id', flat=True).first()
+    if product_id is not None:
+        products_changed([product_id])
+        invalidate_etags(PRODUCT.format(id=product_id))  # The product page shows SKU attributes
+
+
+@receiver(post_save, sender=AttributeType)
+@receiver(post_delete, sender=AttributeType)
+@receiver(post_save, sender=ProductAttributeValue)
+@receiver(post_delete, sender=ProductAttributeValue)
+def rebuild_facets(sender, raw=False, **kwargs):
+    if not raw:
+        invalidate_facets()
+        invalidate_etags(ATTRIBUTES)
+
+
+@receiver(post_save, sender=Product)
+def refresh_product_search_document(sender, instance, raw=False, **kwargs):
+    if not raw:
+        ProductSearchDocument.refresh_for_products([instance.pk])
+
+
+@receiver(post_save, sender=Category)
+def refresh_category_search_documents(sender, instance, created, raw=False, **kwargs):
+    # Products carry the names of their category path, refresh them when a name or the path changes.
+    # The closure table of a moved category is updated after this signal, so wait for the commit.
+    if raw or created:
+        return
+    renamed = instance.name != getattr(instance, '_loaded_name', instance.name)
+    moved = instance.parent_id != getattr(instance, '_loaded_parent_id', instance.parent_id)
+    if renamed or moved:
+        transaction.on_commit(lambda: ProductSearchDocument.refresh_for_categories([instance.pk]))
+
+
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+@receiver(post_save, sender=BrandPhoto)
+@receiver(post_delete, sender=BrandPhoto)
+@receiver(post_save, sender=BrandVideo)
+@receiver(post_delete, sender=BrandVideo)
+def invalidate_brand_etags(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidate_etags(BRANDS, BRAND.format(id=instance.pk if sender is Brand else instance.brand_id))
+
+
+def category_detail_tags(category_ids):
+    """Tags of the category details showing the given categories: their own, their parents' and their subtrees'."""
+    category_ids = set(category_ids)
+    affected = set(CategoryClosure.objects.filter(ancestor_id__in=category_ids).values_list('descendant_id', flat=True))
+    affected |= set(Category.objects.filter(id__in=category_ids, parent__isnull=False).values_list('parent_id', flat=True))
+    return [CATEGORY.format(id=category_id) for category_id in affected | category_ids]
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_etags(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    # A move also changes the children of the previous parent
+    previous_parent_id = getattr(instance, '_loaded_parent_id', None)
+    tags = category_detail_tags([instance.pk])
+    if instance.parent_id is not None:
+        tags.append(CATEGORY.format(id=instance.parent_id))
+    if previous_parent_id is not None:
+        tags.append(CATEGORY.format(id=previous_parent_id))
+    invalidate_etags(CATEGORIES, *tags)
+
+
+@receiver(m2m_changed, sender=Category.attribute_groups.through)
+def invalidate_category_group_etags(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    # Attribute groups are shown on the category and inherited by its subcategories
+    category_ids = (pk_set or ()) if reverse else [instance.pk]
+    invalidate_etags(CATEGORIES, *category_detail_tags(category_ids))
+
+
+@receiver(post_save, sender=AttributeGroup)
+@receiver(post_delete, sender=AttributeGroup)
+def invalidate_attribute_group_etags(sender, raw=False, **kwargs):
+    if not raw:
+        invalidate_etags(CATEGORIES, ATTRIBUTE_GROUPS)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductSKU)
+@receiver(post_delete, sender=ProductSKU)
+@receiver(post_save, sender=ProductDetail)
+@receiver(post_delete, sender=ProductDetail)
+@receiver(post_save, sender=ProductPhoto)
+@receiver(post_delete, sender=ProductPhoto)
+@receiver(post_save, sender=ProductVideo)
+@receiver(post_delete, sender=ProductVideo)
+def invalidate_product_etags(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    tags = [PRODUCT.format(id=instance.pk if sender is Product else instance.product_id)]
+    if sender in (Product, ProductSKU):
+        tags.append(PRODUCTS)  # Listed with their price range and availability
+    invalidate_etags(*tags)
+
+
+@receiver(post_save, sender=ReviewSection)
+@receiver(post_delete, sender=ReviewSection)
+@receiver(post_save, sender=ReviewText)
+@receiver(post_delete, sender=ReviewText)
+@receiver(post_save, sender=ReviewPhoto)
+@receiver(post_delete, sender=ReviewPhoto)
+@receiver(post_save, sender=ReviewVideo)
+@receiver(post_delete, sender=ReviewVideo)
+def invalidate_review_etags(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    if sender is ReviewSection:
+        product_id = instance.product_id
+    elif sender.review_section.is_cached(instance):
+        product_id = instance.review_section.product_id
+    else:
+        # Items removed by a cascade from their section are covered by the section's own signal
+        product_id = ReviewSection.objects.filter(pk=instance.review_section_id).values_list('product_id', flat=True).first()
+    if product_id is not None:
+        invalidate_etags(REVIEWS.format(id=product_id))
+
+
+# Resized variants of new images are generated once their upload is committed
+for label, field_name in IMAGE_FIELDS:
+    register_image_field(apps.get_model(label), field_name)
+
+
+# Stored files are shared between rows, count who references them
+for label, field_name in MEDIA_FIELDS:
+    track_references(apps.get_model(label), field_name)
@@ -0,0 +1,22 @@
+import os
+from django.core.files.storage import default_storage
+from tasks.base import task
+from .images import paths, resize
+from .models import Category
+
+
+@task(max_retries=2, retry_backoff=30)
+def generate_image_variants(name):
+    """Write the resized variants of the stored image `name`, unless another row's upload of it already did."""
+    source, targets = paths(default_storage, name)
+    if all(os.path.exists(path) for path in targets.values()):
+        return
+    resize(source, targets)
+
+
+@task(max_retries=3)
+def propagate_attribute_groups(category_id, batch_size=1000):
+    """Propagate a category's attribute groups to a large subtree, one transaction per batch of subcategories."""
+    category = Category.objects.filter(pk=category_id).first()
+    if category is not None:
+        category.propagate_attribute_groups_to_subcategories(batch_size=batch_size)
@@ -1,3 +1,1547 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework import status
+from django.urls import reverse
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from rest_framework.exceptions import ValidationError as DRFValidationError
+from accounts.models import User
+from PIL import Image
+from catalog import search
+from catalog.cache import CATEGORY_TREE, get_version
+from catalog.checks import check_media_accel
+from catalog.models import (
+    AttributeGroup, AttributeType, Brand, BrandVideo, Category, ChunkedUpload, MediaBlob, CategoryClosure, Product, ProductAttributeValue, ProductDetail,
+    ProductPhoto, ProductSKU, ProductSKUAttribute, ProductSummary, ProductVideo, ReviewPhoto, ReviewSection, ReviewText, ReviewVideo,
+)
+from catalog.images import variant_name
+from catalog.tasks import generate_image_variants
+from catalog.importer import CatalogImporter, read_rows
+from catalog.mixins import ORDER_GAP
+from catalog.ordering import REVIEW_ITEMS, move
+from catalog.response_cache import RESPONSE_KEY, response_cache
+from tasks.models import Task
 
-# Create your tests here.
+
+class PublicProductListQueryTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+        # Category tree with attribute groups on both levels
+        self.root_group = AttributeGroup.objects.create(name='Clothing')
+        self.child_group = AttributeGroup.objects.create(name='Shoes')
+        self.root = Category.objects.create(name='Clothes')
+        self.root.attribute_groups.set([self.root_group])
+        self.child = Category.objects.create(name='Sneakers', parent=self.root)
+        self.child.attribute_groups.set([self.child_group])
+
+        # URLs
+        self.product_list_url = reverse('public-product-list')
+
+    def create_products(self, count):
+        for i in range(count):
+            product = Product.objects.create(
+                name=f'Product {i}', description='desc', summary='summary', category=self.child
+            )
+            ProductSKU.objects.create(product=product, price=100 + i, quantity=0)
+            ProductSKU.objects.create(product=product, price=300 + i, quantity=i % 2)
+
+    def count_list_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.product_list_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(context.captured_queries)
+
+    # Test the number of queries doesn't grow with the number of products
+    def test_product_list_query_count_is_constant(self):
+        self.create_products(2)
+        small_page_queries = self.count_list_queries()
+
+        self.create_products(8)
+        large_page_queries = self.count_list_queries()
+
+        self.assertEqual(small_page_queries, large_page_queries)
+
+    # Test annotated values match the SKUs of each product
+    def test_product_list_price_range_and_availability(self):
+        self.create_products(2)
+        response = self.client.get(self.product_list_url)
+        products = {product['name']: product for product in response.data['results']}
+
+        self.assertEqual(products['Product 0']['price_range'], {'min_price': 100, 'max_price': 300})
+        self.assertFalse(products['Product 0']['is_available'])
+        self.assertEqual(products['Product 1']['price_range'], {'min_price': 101, 'max_price': 301})
+        self.assertTrue(products['Product 1']['is_available'])
+        self.assertEqual(
+            products['Product 1']['attribute_groups'],
+            [{'id': self.root_group.id, 'name': 'Clothing'}, {'id': self.child_group.id, 'name': 'Shoes'}],
+        )
+
+    # Test the cursor pagination walks all products exactly once, newest first
+    def test_product_list_cursor_pagination(self):
+        self.create_products(5)
+        names, url = [], f'{self.product_list_url}?page_size=2'
+        while url:
+            response = self.client.get(url)
+            self.assertLessEqual(len(response.data['results']), 2)
+            names += [product['name'] for product in response.data['results']]
+            url = response.data['next']
+
+        self.assertEqual(names, [f'Product {i}' for i in reversed(range(5))])
+
+
+class ProductPriceQueryTest(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Shoes')
+        # (in-stock price, out-of-stock price) per product
+        for name, prices in [('Budget', (100, 50)), ('Middle', (300, 900)), ('Premium', (700, 200)), ('Sold out', (None, 400))]:
+            product = Product.objects.create(name=name, description='desc', summary='summary', category=self.category)
+            in_stock, sold_out = prices
+            if in_stock is not None:
+                ProductSKU.objects.create(product=product, price=in_stock, quantity=2)
+            ProductSKU.objects.create(product=product, price=sold_out, quantity=0)
+        self.product_list_url = reverse('public-product-list')
+
+    def names(self, **params):
+        names, url, params = [], self.product_list_url, {**params, 'page_size': 2}
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            names += [product['name'] for product in response.data['results']]
+            url, params = response.data['next'], {}
+        return names
+
+    # Test the price range only considers in-stock SKUs
+    def test_filter_by_price_range(self):
+        self.assertEqual(self.names(min_price=250, max_price=800), ['Premium', 'Middle'])
+        self.assertEqual(self.names(max_price=150), ['Budget'])
+
+    # Test sorting by the lowest in-stock SKU price, the price the filter matches, across cursor pages
+    def test_order_by_price(self):
+        self.assertEqual(self.names(ordering='price'), ['Budget', 'Middle', 'Premium', 'Sold out'])
+        self.assertEqual(self.names(ordering='-price', min_price=1), ['Premium', 'Middle', 'Budget'])
+        self.assertEqual(self.names(ordering='price', min_price=250, max_price=800), ['Middle', 'Premium'])
+
+    # Test products without an in-stock SKU sort last in both directions, and products missing a summary are still listed
+    def test_products_without_price(self):
+        Product.objects.create(name='Coming soon', description='desc', summary='summary', category=self.category)
+        missing = Product.objects.create(name='Unsummarized', description='desc', summary='summary', category=self.category)
+        ProductSummary.objects.filter(product=missing).delete()
+        cache.clear()  # Deleted behind the cached responses' back
+
+        self.assertEqual(self.names(ordering='price'), ['Budget', 'Middle', 'Premium', 'Sold out', 'Coming soon'])
+        self.assertEqual(self.names(ordering='-price'), ['Premium', 'Middle', 'Budget', 'Coming soon', 'Sold out'])
+        self.assertIn('Unsummarized', self.names())  # Price sorts need the summary, rebuild_product_summaries restores it
+
+    # Test products sharing a price are paged through with the id in the cursor, not an offset
+    def test_price_ties_paged_by_keyset(self):
+        for index in range(5):
+            product = Product.objects.create(name=f'Tie {index}', description='desc', summary='summary', category=self.category)
+            ProductSKU.objects.create(product=product, price=500, quantity=1)
+        names = self.names(ordering='price', min_price=500, max_price=500)
+        self.assertEqual(names, [f'Tie {index}' for index in range(5)])
+
+        response = self.client.get(self.product_list_url, {'ordering': 'price', 'min_price': 500, 'max_price': 500, 'page_size': 3})
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(response.data['next'])
+        self.assertEqual([product['name'] for product in response.data['results']], ['Tie 3', 'Tie 4'])
+        self.assertFalse([query for query in context.captured_queries if 'OFFSET' in query['sql']])
+        previous = self.client.get(response.data['previous']).data['results']
+        self.assertEqual([product['name'] for product in previous], ['Tie 0', 'Tie 1', 'Tie 2'])
+
+    # Test invalid parameters are rejected
+    def test_invalid_price_parameters(self):
+        for params in [{'ordering': 'name'}, {'min_price': 'cheap'}]:
+            response = self.client.get(self.product_list_url, params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ProductSummaryTest(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Shoes')
+        self.product = Product.objects.create(
+            name='Runner', description='desc', summary='summary', category=self.category
+        )
+
+    def get_summary(self):
+        return ProductSummary.objects.get(product=self.product)
+
+    # Test a new product starts with an empty summary
+    def test_summary_created_with_product(self):
+        summary = self.get_summary()
+        self.assertEqual((summary.min_price, summary.max_price, summary.total_stock), (None, None, 0))
+        self.assertFalse(summary.is_available)
+
+    # Test SKU create, update and delete keep the summary in sync
+    def test_summary_follows_sku_writes(self):
+        cheap = ProductSKU.objects.create(product=self.product, price=100, quantity=0)
+        expensive = ProductSKU.objects.create(product=self.product, price=500, quantity=3, is_active=False)
+        summary = self.get_summary()
+        self.assertEqual((summary.min_price, summary.max_price), (100, 500))
+        self.assertEqual((summary.total_stock, summary.active_sku_count), (3, 1))
+        self.assertTrue(summary.is_available)
+        # Neither SKU is both active and in stock, so the product sorts last by price
+        self.assertEqual((summary.price_sort_key, summary.price_sort_key_desc), (2 ** 31 - 1, -2 ** 31))
+
+        # Stock decrement, as done when a payment is verified
+        expensive.quantity -= 3
+        expensive.save()
+        self.assertFalse(self.get_summary().is_available)
+
+        cheap.delete()
+        summary = self.get_summary()
+        self.assertEqual((summary.min_price, summary.max_price, summary.active_sku_count), (500, 500, 0))
+
+        # Deleting the product cascades to its SKUs without recreating the summary
+        self.product.delete()
+        self.assertFalse(ProductSummary.objects.exists())
+
+    # Test the rebuild command restores stale summaries
+    def test_rebuild_product_summaries_command(self):
+        ProductSKU.objects.create(product=self.product, price=250, quantity=2)
+        ProductSummary.objects.filter(product=self.product).update(min_price=0, max_price=0, is_available=False)
+
+        call_command('rebuild_product_summaries', stdout=StringIO())
+
+        summary = self.get_summary()
+        self.assertEqual((summary.min_price, summary.max_price, summary.total_stock), (250, 250, 2))
+        self.assertTrue(summary.is_available)
+
+
+class CategoryClosureTest(TestCase):
+    def setUp(self):
+        # Electronics > Computers > Laptops > Gaming, and Electronics > Phones
+        self.electronics = Category.objects.create(name='Electronics')
+        self.computers = Category.objects.create(name='Computers', parent=self.electronics)
+        self.laptops = Category.objects.create(name='Laptops', parent=self.computers)
+        self.gaming = Category.objects.create(name='Gaming', parent=self.laptops)
+        self.phones = Category.objects.create(name='Phones', parent=self.electronics)
+
+    def names(self, queryset):
+        return sorted(queryset.values_list('name', flat=True))
+
+    # Test ancestors, descendants and breadcrumbs are read from the closure table
+    def test_ancestors_descendants_and_breadcrumbs(self):
+        with self.assertNumQueries(1):
+            breadcrumbs = self.gaming.get_breadcrumbs()
+        self.assertEqual([crumb['name'] for crumb in breadcrumbs], ['Electronics', 'Computers', 'Laptops', 'Gaming'])
+        self.assertEqual(self.names(self.computers.get_descendants()), ['Gaming', 'Laptops'])
+        self.assertEqual(self.gaming.level, 3)
+
+    # Test moving a category re-links and re-levels its whole subtree
+    def test_move_updates_subtree(self):
+        self.computers.parent = self.phones
+        self.computers.save()
+
+        self.assertEqual(self.names(self.phones.get_descendants()), ['Computers', 'Gaming', 'Laptops'])
+        self.assertEqual(
+            [crumb['name'] for crumb in self.gaming.get_breadcrumbs()],
+            ['Electronics', 'Phones', 'Computers', 'Laptops', 'Gaming'],
+        )
+        self.assertEqual(Category.objects.get(pk=self.gaming.pk).level, 4)
+
+        # Moving back to the root level removes every link to the old ancestors
+        self.computers.parent = None
+        self.computers.save()
+        self.assertEqual(Category.objects.get(pk=self.gaming.pk).level, 2)
+        self.assertFalse(CategoryClosure.objects.filter(ancestor=self.electronics, descendant=self.gaming).exists())
+
+    # Test a category can't be moved into its own subtree
+    def test_move_under_own_subtree_is_rejected(self):
+        self.computers.parent = self.gaming
+        with self.assertRaises(ValidationError):
+            self.computers.save()
+
+    # Test products of a category and all of its subcategories are listed together
+    def test_products_in_category_subtree(self):
+        for name, category in [('Laptop', self.laptops), ('Rig', self.gaming), ('Phone', self.phones)]:
+            Product.objects.create(name=name, description='desc', summary='summary', category=category)
+
+        self.assertEqual(self.names(Product.objects.in_category(self.computers.pk)), ['Laptop', 'Rig'])
+
+        response = APIClient().get(f"{reverse('public-product-list')}?category={self.computers.pk}")
+        self.assertEqual(sorted(product['name'] for product in response.data['results']), ['Laptop', 'Rig'])
+
+    # Test deleting a category removes its closure links with the subtree
+    def test_delete_cascades_closure(self):
+        self.computers.delete()
+        self.assertEqual(CategoryClosure.objects.count(), 3)  # Electronics, Phones and their link
+
+
+class CategoryTreeTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.root = Category.objects.create(name='Clothes')
+        self.child = Category.objects.create(name='Shirts', parent=self.root)
+        self.hidden = Category.objects.create(name='Hidden', parent=self.root, is_active=False)
+        Category.objects.create(name='Under hidden', parent=self.hidden)
+        self.tree_url = reverse('category-tree')
+
+    # Test the tree is built from one query, then served from the cache
+    def test_category_tree_is_cached(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(self.tree_url)
+        self.assertEqual(response.json(), [
+            {'id': self.root.id, 'name': 'Clothes', 'subcategories': [
+                {'id': self.child.id, 'name': 'Shirts', 'subcategories': []},
+            ]},
+        ])
+
+        with self.assertNumQueries(0):
+            self.client.get(self.tree_url)
+
+    # Test a category write invalidates the cached tree
+    def test_category_tree_invalidated_on_write(self):
+        self.client.get(self.tree_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.hidden.is_active = True
+            self.hidden.save()
+
+        names = [node['name'] for node in self.client.get(self.tree_url).json()[0]['subcategories']]
+        self.assertEqual(names, ['Shirts', 'Hidden'])
+
+    # Test the cached tree is only invalidated once the write is committed
+    def test_category_tree_invalidated_after_commit(self):
+        self.client.get(self.tree_url)
+        version = get_version(CATEGORY_TREE)
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.hidden.is_active = True
+                self.hidden.save()
+                self.assertEqual(get_version(CATEGORY_TREE), version)
+            self.assertEqual(get_version(CATEGORY_TREE), version)  # The test's transaction is still open
+        self.assertNotEqual(get_version(CATEGORY_TREE), version)
+
+
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Shoes')
+        self.product = Product.objects.create(name='Boot', description='', summary='', category=self.category)
+        self.other = Product.objects.create(name='Sandal', description='', summary='', category=self.category)
+        self.product_url = reverse('product-detail', args=[self.product.id])
+        self.tree_url = reverse('category-tree')
+
+    # Test a matching If-None-Match is answered with 304 without touching the database
+    def test_not_modified_without_queries(self):
+        response = self.client.get(self.product_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.product_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+
+    # Test the ETag changes with the product's own SKUs only
+    def test_etag_follows_product_writes(self):
+        etag = self.client.get(self.product_url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductSKU.objects.create(sku='OTHER-1', product=self.other, price=10, quantity=1)
+        self.assertEqual(self.client.get(self.product_url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductSKU.objects.create(sku='BOOT-1', product=self.product, price=10, quantity=1)
+        response = self.client.get(self.product_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertTrue(response.data['is_available'])
+
+    # Test category writes change the tree and product ETags
+    def test_etag_follows_category_writes(self):
+        tree_etag = self.client.get(self.tree_url)['ETag']
+        product_etag = self.client.get(self.product_url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='Boots', parent=self.category)
+
+        self.assertEqual(self.client.get(self.tree_url, HTTP_IF_NONE_MATCH=tree_etag).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(self.product_url, HTTP_IF_NONE_MATCH=product_etag).status_code, status.HTTP_200_OK)
+
+
+class ResponseCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        response_cache.clear_local()
+        self.category = Category.objects.create(name='Shoes')
+        self.product = Product.objects.create(name='Boot', description='', summary='', category=self.category)
+        self.product_url = reverse('product-detail', args=[self.product.id])
+
+    # Test anonymous reads are served from the front tier, then from the shared cache, without queries
+    def test_anonymous_responses_are_cached(self):
+        body = self.client.get(self.product_url).content
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.product_url).content, body)
+
+        response_cache.clear_local()  # Another worker
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.product_url).content, body)
+
+    # Test only the written product's entries are dropped
+    def test_writes_purge_their_tags(self):
+        other = Product.objects.create(name='Sandal', description='', summary='', category=self.category)
+        other_url = reverse('product-detail', args=[other.id])
+        self.client.get(self.product_url)
+        self.client.get(other_url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = 'Winter boot'
+            self.product.save()
+        self.assertEqual(self.client.get(self.product_url).json()['name'], 'Winter boot')
+        with self.assertNumQueries(0):
+            self.client.get(other_url)
+
+    # Test a subcategory's detail follows its parent's rename through the breadcrumbs
+    def test_category_detail_follows_ancestors(self):
+        child = Category.objects.create(name='Boots', parent=self.category)
+        url = reverse('user-category-detail', args=[child.id])
+        self.client.get(url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.name = 'Footwear'
+            self.category.save()
+        self.assertEqual([crumb['name'] for crumb in self.client.get(url).json()['breadcrumbs']], ['Footwear', 'Boots'])
+
+    # Test authenticated requests bypass the cache
+    def test_authenticated_requests_not_cached(self):
+        user = User.objects.create_user(
+            username='buyer', email='buyer@example.com', phone_number='1234567890',
+            first_name='Buyer', last_name='User', password='TestPassword123!',
+        )
+        client = APIClient()
+        client.force_authenticate(user)
+        client.get(self.product_url)
+        with CaptureQueriesContext(connection) as queries:
+            client.get(self.product_url)
+        self.assertGreater(len(queries), 0)
+
+    # Test a worker waits for the one already rendering the entry instead of querying too
+    @mock.patch('catalog.response_cache.LOCK_WAIT', 0.2)
+    def test_waits_for_the_rendering_worker(self):
+        etag = self.client.get(self.product_url)['ETag'].strip('"')
+        response_cache.clear_local()
+        cache.delete(RESPONSE_KEY.format(etag=etag))
+        response_cache.acquire(etag)  # Held by another worker that never finishes
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(self.product_url).status_code, status.HTTP_200_OK)
+        self.assertGreater(len(queries), 0)  # Rendered after the wait, but not stored
+        self.assertIsNone(cache.get(RESPONSE_KEY.format(etag=etag)))
+
+        cache.set(RESPONSE_KEY.format(etag=etag), (b'{"cached": true}', 'application/json'))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.product_url).json(), {'cached': True})
+
+
+class ProductPageTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Shoes')
+        self.product = Product.objects.create(name='Boot', description='', summary='', category=self.category)
+        self.size = AttributeType.objects.create(name='Size')
+        self.url = reverse('product-page', args=[self.product.id])
+
+    def add_content(self, index):
+        ProductDetail.objects.create(product=self.product, title=f'Detail {index}', value='', order_num=10 - index)
+        ProductPhoto.objects.create(product=self.product, alt=f'Photo {index}', photo=f'product/product_photos/{index}.jpg')
+        sku = ProductSKU.objects.create(sku=f'BOOT-{index}', product=self.product, price=100 + index, quantity=1)
+        value = ProductAttributeValue.objects.create(type=self.size, value=str(40 + index))
+        ProductSKUAttribute.objects.create(sku=sku, attribute_value=value)
+        section = ReviewSection.objects.create(product=self.product, title=f'Section {index}')
+        ReviewText.objects.create(review_section=section, text='Text')
+        ReviewPhoto.objects.create(review_section=section, image='review_photos/1.jpg', position=ReviewPhoto.CENTER_LARGE)
+
+    # Test the page is built from the same number of queries whatever the product has
+    def test_page_uses_fixed_queries(self):
+        self.add_content(1)
+        with self.assertNumQueries(11):
+            self.client.get(self.url)
+
+        for index in range(2, 5):
+            self.add_content(index)
+        cache.clear()
+        with self.assertNumQueries(11):
+            data = self.client.get(self.url).json()
+
+        self.assertEqual([detail['title'] for detail in data['details']], ['Detail 4', 'Detail 3', 'Detail 2', 'Detail 1'])
+        self.assertEqual(len(data['photos']), 4)
+        self.assertEqual([sku['sku_attributes'][0]['show_attribute_values']['value'] for sku in data['skus']], ['41', '42', '43', '44'])
+        self.assertEqual([section['title'] for section in data['review_sections']], ['Section 1', 'Section 2', 'Section 3', 'Section 4'])
+        self.assertEqual([item['type'] for item in data['review_sections'][0]['items']], ['text', 'photo'])
+
+    # Test the cached page follows writes to any of its parts
+    def test_page_follows_writes(self):
+        self.add_content(1)
+        self.client.get(self.url)
+        section = ReviewSection.objects.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            ReviewText.objects.create(review_section=section, text='Later')
+        self.assertEqual(len(self.client.get(self.url).json()['review_sections'][0]['items']), 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductAttributeValue.objects.filter(value='41').get().save()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url)
+        self.assertGreater(len(queries), 0)
+
+
+class ReviewSectionListTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Shoes')
+        self.product = Product.objects.create(name='Boot', description='', summary='', category=category)
+        self.url = reverse('review-section-list-by-product', args=[self.product.id])
+
+    def add_section(self, index):
+        section = ReviewSection.objects.create(product=self.product, title=f'Section {index}')
+        ReviewPhoto.objects.create(review_section=section, image='review_photos/1.jpg', position=ReviewPhoto.LEFT_SMALL, order_num=2)
+        ReviewText.objects.create(review_section=section, text='First', order_num=1)
+        ReviewText.objects.create(review_section=section, text='Last', order_num=3)
+
+    # Test every section's items are loaded in one query per item type and merged in order
+    def test_sections_use_fixed_queries(self):
+        self.add_section(1)
+        with self.assertNumQueries(4):
+            self.client.get(self.url)
+
+        for index in range(2, 6):
+            self.add_section(index)
+        cache.clear()
+        with self.assertNumQueries(4):
+            sections = self.client.get(self.url).json()['results']
+        self.assertEqual(len(sections), 5)
+        self.assertEqual([(item['type'], item['order_num']) for item in sections[0]['items']], [('text', 1), ('photo', 2), ('text', 3)])
+
+    # Test sections are paged by keyset in their display order, not by when they were added
+    def test_paged_in_order(self):
+        for index in range(1, 4):
+            self.add_section(index)
+        first = ReviewSection.objects.get(title='Section 1')
+        first.order_num = 10 ** 6
+        first.save()
+
+        with CaptureQueriesContext(connection) as context:
+            page = self.client.get(self.url, {'page_size': 2}).json()
+        self.assertFalse([query for query in context.captured_queries if 'OFFSET' in query['sql']])
+        following = self.client.get(page['next']).json()
+        self.assertEqual([section['title'] for section in page['results'] + following['results']], ['Section 2', 'Section 3', 'Section 1'])
+        self.assertIsNone(following['next'])
+
+
+class ReviewItemOrderTest(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Shoes')
+        product = Product.objects.create(name='Boot', description='', summary='', category=category)
+        self.section = ReviewSection.objects.create(product=product, title='Fit')
+        self.other_section = ReviewSection.objects.create(product=product, title='Comfort')
+
+    # Test order numbers come from one sequence shared by all item types, in one statement
+    def test_order_numbers_are_shared_across_types(self):
+        ReviewText.objects.create(review_section=self.section, text='First')
+        with self.assertNumQueries(2):  # Allocate, insert
+            photo = ReviewPhoto.objects.create(review_section=self.section, image='review_photos/1.jpg', position=ReviewPhoto.LEFT_SMALL)
+        video = ReviewVideo.objects.create(review_section=self.section, video='review_videos/1.mp4')
+        other = ReviewText.objects.create(review_section=self.other_section, text='Other')
+        self.assertEqual((photo.order_num, video.order_num, other.order_num), (2048, 3072, 1024))
+
+    # Test numbers set by hand are unique across types and skipped by the sequence
+    def test_explicit_order_numbers(self):
+        ReviewText.objects.create(review_section=self.section, text='Pinned', order_num=10)
+        with self.assertRaises(DRFValidationError):
+            ReviewPhoto.objects.create(review_section=self.section, image='review_photos/1.jpg', position=ReviewPhoto.LEFT_SMALL, order_num=10)
+        self.assertEqual(ReviewText.objects.create(review_section=self.section, text='Next').order_num, 10 + ORDER_GAP)
+
+    # Test bulk inserts number every section's items after its existing ones, one statement per section
+    def test_bulk_create_ordered(self):
+        ReviewText.objects.create(review_section=self.section, text='Existing')
+        items = [ReviewText(review_section=self.section, text=str(i)) for i in range(3)]
+        items.append(ReviewText(review_section=self.other_section, text='Other'))
+        with self.assertNumQueries(3):  # Two allocations, one insert
+            ReviewText.bulk_create_ordered(items)
+        self.assertEqual([item.order_num for item in items], [2048, 3072, 4096, 1024])
+
+
+class ReviewSectionOrderTest(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Shoes')
+        self.boot = Product.objects.create(name='Boot', description='', summary='', category=category)
+        self.sandal = Product.objects.create(name='Sandal', description='', summary='', category=category)
+
+    # Test sections are numbered per product, in one statement whatever the table holds
+    def test_sections_numbered_per_product(self):
+        ReviewSection.objects.create(product=self.boot, title='Fit')
+        ReviewSection.objects.create(product=self.boot, title='Comfort')
+        with self.assertNumQueries(2):  # Allocate, insert
+            first = ReviewSection.objects.create(product=self.sandal, title='Fit')
+        self.assertEqual(first.order_num, 1024)
+        self.assertEqual(list(self.boot.review.values_list('order_num', flat=True)), [1024, 2048])
+
+    # Test numbers set by hand are skipped by the sequence
+    def test_explicit_order_numbers(self):
+        ReviewSection.objects.create(product=self.boot, title='Pinned', order_num=5)
+        self.assertEqual(ReviewSection.objects.create(product=self.boot, title='Next').order_num, 5 + ORDER_GAP)
+
+
+class ProductDetailBatchUpdateTest(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Shoes')
+        self.product = Product.objects.create(name='Boot', description='', summary='', category=category)
+        self.details = [
+            ProductDetail.objects.create(product=self.product, title=f'Detail {i}', value='', order_num=i)
+            for i in range(1, 6)
+        ]
+        admin = User.objects.create_superuser(
+            username='admin', phone_number='1234567890', first_name='Admin', last_name='User', password='TestPassword123!',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(admin)
+        self.url = reverse('product-detail-batch-update')
+
+    # Test an arbitrary permutation is written in at most two statements, whatever the number of details
+    def test_permutation_in_bulk(self):
+        kept = self.details[:4]
+        updates = [{'id': detail.pk, 'order_num': order_num} for detail, order_num in zip(kept, [2, 4, 1, 3])]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.put(self.url, {'product_id': self.product.pk, 'updates': updates}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        updates_sql = [query['sql'] for query in queries if query['sql'].startswith('UPDATE')]
+        self.assertLessEqual(len(updates_sql), 2)
+        titles = list(self.product.details.order_by('order_num').values_list('title', flat=True))
+        self.assertEqual(titles, ['Detail 3', 'Detail 1', 'Detail 4', 'Detail 2'])
+
+    # Test the database enforces unique order numbers per product, with or without deferrable constraints
+    def test_order_number_unique_in_database(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ProductDetail.objects.filter(pk=self.details[1].pk).update(order_num=self.details[0].order_num)
+
+    # Test duplicate order numbers are rejected before anything is written
+    def test_duplicate_order_numbers(self):
+        updates = [{'id': self.details[0].pk, 'order_num': 1}, {'id': self.details[1].pk, 'order_num': 1}]
+        response = self.client.put(self.url, {'product_id': self.product.pk, 'updates': updates}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.product.details.count(), 5)
+
+
+class CatalogImportTest(TestCase):
+    def setUp(self):
+        self.shoes = Category.objects.create(name='Shoes')
+        size = AttributeType.objects.create(name='Size')
+        color = AttributeType.objects.create(name='Color')
+        self.size_42 = ProductAttributeValue.objects.create(type=size, value=42)
+        self.black = ProductAttributeValue.objects.create(type=color, value='black')
+        ProductSKU.objects.create(sku='TAKEN-1', product=Product.objects.create(name='Old', description='', summary='', category=self.shoes), quantity=1)
+
+    def run_import(self, lines, format='csv', batch_size=2):
+        return CatalogImporter(batch_size=batch_size).run(read_rows(StringIO('\n'.join(lines) + '\n'), format))
+
+    # Test rows are grouped into products with their details, SKUs and attribute values, across chunks
+    def test_import_csv(self):
+        result = self.run_import([
+            'product,name,category,description,summary,sku,price,quantity,attributes,details',
+            'p1,Runner,Shoes,Light,Fast,R-42,120,5,Size=42;Color=black,Material=Mesh',
+            'p1,,,,,,130,0,Size=42,Sole=Rubber',
+            'p2,Walker,Shoes,,,,90,2,,',
+            'p1,,,,,R-43,140,1,Color=black,',
+        ])
+        self.assertEqual((result.rows, result.products, result.details, result.skus, result.errors), (4, 2, 2, 4, []))
+
+        runner = Product.objects.get(name='Runner')
+        self.assertEqual(list(runner.details.order_by('order_num').values_list('title', flat=True)), ['Material', 'Sole'])
+        self.assertEqual(runner.skus.count(), 3)
+        self.assertEqual(
+            sorted(ProductSKUAttribute.objects.filter(sku__sku='R-42').values_list('attribute_value_id', flat=True)),
+            sorted([self.size_42.pk, self.black.pk]),
+        )
+        # What the model signals would have maintained
+        summary = ProductSummary.objects.get(product=runner)
+        self.assertEqual((summary.min_price, summary.max_price, summary.total_stock), (120, 140, 6))
+        self.assertEqual(runner.search_document.name, 'Runner')
+
+    # Test invalid rows are reported with their line and skipped, the others are still imported
+    def test_errors_per_row(self):
+        result = self.run_import([
+            'product,name,category,sku,price,quantity,attributes',
+            'p1,Runner,Boots,,1,1,',
+            'p2,Walker,Shoes,TAKEN-1,1,1,',
+            'p3,Hiker,Shoes,,x,1,',
+            'p4,Racer,Shoes,,1,1,Size=44',
+            'p5,Trail,Shoes,T-1,1,1,',
+            'p5,,,T-1,1,1,',
+        ])
+        self.assertEqual([line for line, _ in result.errors], [2, 3, 4, 5, 7])
+        self.assertIn("Unknown category 'Boots'", result.errors[0][1])
+        self.assertEqual((result.products, result.skus), (1, 1))
+
+    # Test the SKU codes of a chunk that failed to be written can still be used by later rows
+    def test_failed_chunk_releases_codes(self):
+        write = CatalogImporter.write
+
+        def fail_first(importer, rows):
+            if not importer.result.errors:
+                raise IntegrityError("SKU code taken concurrently")
+            return write(importer, rows)
+
+        with mock.patch.object(CatalogImporter, 'write', autospec=True, side_effect=fail_first):
+            result = self.run_import([
+                'product,name,category,sku,price,quantity',
+                'p1,Runner,Shoes,R-1,1,1',
+                'p2,Walker,Shoes,R-1,1,1',
+            ], batch_size=1)
+        self.assertEqual([line for line, _ in result.errors], [2])
+        self.assertEqual(ProductSKU.objects.get(sku='R-1').product.name, 'Walker')
+
+    # Test a chunk is written with a fixed number of statements, whatever its number of rows
+    def test_chunk_is_bulk_written(self):
+        header = 'product,name,category,price,quantity,attributes,details'
+        with CaptureQueriesContext(connection) as small:
+            self.run_import([header] + [f'p{i},Shoe {i},Shoes,10,1,Size=42,Sole=Rubber' for i in range(5)], batch_size=100)
+        with CaptureQueriesContext(connection) as large:
+            self.run_import([header] + [f'q{i},Shoe {i},Shoes,10,1,Size=42,Sole=Rubber' for i in range(50)], batch_size=100)
+        self.assertEqual(len(small), len(large))
+
+    # Test the command imports a file and the endpoint an upload, both as JSONL
+    def test_command_and_endpoint(self):
+        rows = [
+            {'product': 'p1', 'name': 'Runner', 'category': 'Shoes', 'price': 10, 'quantity': 1, 'attributes': {'Size': 42}},
+            {'product': 'p2', 'name': 'Walker', 'category': 'Shoes', 'details': {'Sole': 'Rubber'}},
+        ]
+        content = '\n'.join(json.dumps(row) for row in rows) + '\nnot json\n'
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as file:
+            file.write(content)
+        self.addCleanup(os.remove, file.name)
+        stdout, stderr = StringIO(), StringIO()
+        call_command('import_catalog', file.name, stdout=stdout, stderr=stderr)
+        self.assertIn('Imported 2 products', stdout.getvalue())
+        self.assertIn('Line 3', stderr.getvalue())
+
+        admin = User.objects.create_superuser(
+            username='admin', phone_number='1234567890', first_name='Admin', last_name='User', password='TestPassword123!',
+        )
+        client = APIClient()
+        client.force_authenticate(admin)
+        upload = SimpleUploadedFile('catalog.jsonl', content.replace('p1', 'p3').encode())
+        response = client.post(reverse('catalog-import'), {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['products'], response.data['skus'], response.data['error_count']), (2, 1, 1))
+
+    # Test a file that can't be read to the end is rejected with its line before anything is imported
+    def test_unreadable_file(self):
+        admin = User.objects.create_superuser(
+            username='admin', phone_number='1234567890', first_name='Admin', last_name='User', password='TestPassword123!',
+        )
+        client = APIClient()
+        client.force_authenticate(admin)
+        rows = b''.join(b'p%d,Shoe %d,Shoes,10,1\n' % (i, i) for i in range(4))
+        files = {
+            5: b'\xef\xbb\xbfproduct,name,category,price,quantity\n' + rows[:-1] + b'\xe9\n',  # Latin-1, not UTF-8
+            6: b'product,name,category,price,quantity\n' + rows + b'p9,"' + b'x' * 200000 + b'",Shoes,1,1\n',  # Over the field limit
+        }
+        for line_num, content in files.items():
+            upload = SimpleUploadedFile('catalog.csv', content)
+            response = client.post(reverse('catalog-import'), {'file': upload, 'batch_size': 1}, format='multipart')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(response.data['errors'][0]['line'], line_num)
+        self.assertFalse(Product.objects.filter(name__startswith='Shoe').exists())
+
+        with tempfile.NamedTemporaryFile('wb', suffix='.csv', delete=False) as file:
+            file.write(files[5])
+        self.addCleanup(os.remove, file.name)
+        with self.assertRaisesMessage(CommandError, 'Line 5'):
+            call_command('import_catalog', file.name, stdout=StringIO())
+
+        # NUL characters fail their row only
+        upload = SimpleUploadedFile('catalog.csv', b'product,name,category,price,quantity\np1,Ru\x00nner,Shoes,1,1\np2,Walker,Shoes,1,1\n')
+        response = client.post(reverse('catalog-import'), {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['products'], response.data['errors'][0]['line']), (1, 2))
+
+
+class CatalogExportTest(TestCase):
+    def setUp(self):
+        self.shoes = Category.objects.create(name='Shoes')
+        size = AttributeType.objects.create(name='Size')
+        self.size_42 = ProductAttributeValue.objects.create(type=size, value=42)
+        self.runner = Product.objects.create(name='Runner', description='Light', summary='Fast', category=self.shoes)
+        ProductDetail.objects.create(product=self.runner, title='Sole', value='Rubber', order_num=1)
+        for code in ['R-1', 'R-2']:
+            sku = ProductSKU.objects.create(sku=code, product=self.runner, price=100, quantity=2)
+            ProductSKUAttribute.objects.create(sku=sku, attribute_value=self.size_42)
+        Product.objects.create(name='Walker', description='', summary='', category=self.shoes)
+
+        admin = User.objects.create_superuser(
+            username='admin', phone_number='1234567890', first_name='Admin', last_name='User', password='TestPassword123!',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(admin)
+        self.url = reverse('catalog-export')
+
+    # Test the catalog is streamed one row per SKU, products without SKUs on a row of their own
+    def test_export_csv(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'product,name,category,description,summary,is_active,sku,price,quantity,attributes,details')
+        self.assertEqual(lines[1], f'{self.runner.pk},Runner,Shoes,Light,Fast,True,R-1,100,2,Size=42,Sole=Rubber')
+        self.assertEqual(lines[2], f'{self.runner.pk},,,,,,R-2,100,2,Size=42,')
+        self.assertEqual(len(lines), 4)
+
+    # Test gzipped JSONL exports can be imported back
+    def test_export_gzip_jsonl_round_trip(self):
+        response = self.client.get(self.url, {'file_format': 'jsonl', 'gzip': 'true'})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        content = gzip.decompress(b''.join(response.streaming_content)).decode()
+
+        ProductSKU.objects.all().delete()
+        result = CatalogImporter().run(read_rows(StringIO(content), 'jsonl'))
+        self.assertEqual((result.products, result.skus, result.details, result.errors), (2, 2, 1, []))
+        self.assertEqual(ProductSKUAttribute.objects.filter(sku__sku='R-2', attribute_value=self.size_42).count(), 1)
+
+    # Test CSV exports keep separators inside details and inactive products when imported back
+    def test_export_csv_round_trip(self):
+        ProductDetail.objects.create(product=self.runner, title='Fabric', value='Cotton; Polyester = 2:1 \\ blend')
+        Product.objects.filter(name='Walker').update(is_active=False)
+        content = b''.join(self.client.get(self.url).streaming_content).decode()
+
+        Product.objects.all().delete()
+        result = CatalogImporter().run(read_rows(StringIO(content), 'csv'))
+        self.assertEqual((result.products, result.details, result.errors), (2, 2, []))
+        runner = Product.objects.get(name='Runner')
+        details = list(runner.details.order_by('order_num').values_list('title', 'value'))
+        self.assertEqual(details, [('Sole', 'Rubber'), ('Fabric', 'Cotton; Polyester = 2:1 \\ blend')])
+        self.assertEqual((runner.is_active, Product.objects.get(name='Walker').is_active), (True, False))
+
+    # Test products are read in chunks with a fixed number of queries per chunk
+    def test_export_reads_in_chunks(self):
+        for i in range(8):
+            Product.objects.create(name=f'Extra {i}', description='', summary='', category=self.shoes)
+        path = os.path.join(tempfile.mkdtemp(), 'catalog.csv')
+        with CaptureQueriesContext(connection) as queries:
+            call_command('export_catalog', path, '--chunk-size', '5')
+        self.assertLessEqual(len(queries), 2 * 4)  # Per chunk at most products, details, SKUs and SKU attributes
+        with open(path) as file:
+            self.assertEqual(len(file.readlines()), 12)
+
+
+class SKUMatrixTest(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name='Runner', description='', summary='', category=Category.objects.create(name='Shoes'))
+        size = AttributeType.objects.create(name='Size')
+        color = AttributeType.objects.create(name='Color')
+        self.sizes = [ProductAttributeValue.objects.create(type=size, value=42 + i) for i in range(3)]
+        self.colors = [ProductAttributeValue.objects.create(type=color, value=name) for name in ['black', 'white']]
+        admin = User.objects.create_superuser(
+            username='admin', phone_number='1234567890', first_name='Admin', last_name='User', password='TestPassword123!',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(admin)
+        self.url = reverse('product-sku-matrix', args=[self.product.pk])
+
+    def post(self, values, **data):
+        return self.client.post(self.url, {'attribute_values': [value.pk for value in values], **data}, format='json')
+
+    # Test a SKU is created for every combination, with collision-free sequential codes
+    def test_matrix_created(self):
+        response = self.post(self.sizes + self.colors, price=120, quantity=3)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual((response.data['created'], response.data['skipped']), (6, 0))
+
+        combinations = {
+            frozenset(sku.sku_attributes.values_list('attribute_value_id', flat=True)) for sku in self.product.skus.all()
+        }
+        self.assertEqual(combinations, {frozenset([size.pk, color.pk]) for size in self.sizes for color in self.colors})
+        codes = sorted(self.product.skus.values_list('sku', flat=True))
+        self.assertEqual(len(set(codes)), 6)
+        self.assertRegex(codes[0], r'^SKU-\d{10}$')
+        self.assertEqual(ProductSummary.objects.get(product=self.product).total_stock, 18)
+
+    # Test combinations an existing SKU has are skipped
+    def test_existing_combinations_skipped(self):
+        self.post(self.sizes[:1] + self.colors)
+        response = self.post(self.sizes[:2] + self.colors)
+        self.assertEqual((response.data['created'], response.data['skipped']), (2, 2))
+        self.assertEqual(self.product.skus.count(), 4)
+
+    # Test the matrix is written with a fixed number of statements, whatever its size
+    def test_statements_independent_of_size(self):
+        many = self.sizes + [ProductAttributeValue.objects.create(type=self.sizes[0].type, value=50 + i) for i in range(20)]
+        with CaptureQueriesContext(connection) as small:
+            self.post(self.sizes[:1] + self.colors[:1])
+        other = Product.objects.create(name='Walker', description='', summary='', category=self.product.category)
+        self.url = reverse('product-sku-matrix', args=[other.pk])
+        with CaptureQueriesContext(connection) as large:
+            self.post(many + self.colors)
+        self.assertEqual(len(small), len(large))
+
+    # Test codes given by hand in the generated format are never generated again
+    def test_manual_codes_reserved(self):
+        first = ProductSKU.allocate_codes(1)[0]
+        number = int(first[4:])
+        CatalogImporter().run(read_rows(StringIO(f'product,name,category,sku,price,quantity\np1,Walker,Shoes,SKU-{number + 2:010d},1,1\n'), 'csv'))
+        ProductSKU.objects.create(sku=f'SKU-{number + 4:010d}', product=self.product, quantity=1)
+        response = self.post(self.sizes + self.colors)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(all(int(sku['sku'][4:]) > number + 4 for sku in response.data['skus']))
+
+        # A code stored around the sequence is reported instead of failing the request
+        next_code = f'SKU-{int(response.data["skus"][-1]["sku"][4:]) + 1:010d}'
+        ProductSKU.objects.bulk_create([ProductSKU(sku=next_code, product=self.product, quantity=1)])
+        other = Product.objects.create(name='Hiker', description='', summary='', category=self.product.category)
+        self.url = reverse('product-sku-matrix', args=[other.pk])
+        self.assertEqual(self.post(self.sizes[:1]).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(other.skus.exists())
+
+    # Test unknown values are rejected
+    def test_unknown_values(self):
+        response = self.client.post(self.url, {'attribute_values': [self.sizes[0].pk, 999999]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.product.skus.count(), 0)
+
+
+class ImageVariantsTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings = override_settings(MEDIA_ROOT=self.media_root, TASKS_EAGER=True)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.product = Product.objects.create(name='Runner', description='', summary='', category=Category.objects.create(name='Shoes'))
+        admin = User.objects.create_superuser(
+            username='admin', phone_number='1234567890', first_name='Admin', last_name='User', password='TestPassword123!',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(admin)
+
+    def image(self, name='shoe.png', size=(2000, 1000), mode='RGBA'):
+        content = BytesIO()
+        Image.new(mode, size, 'red').save(content, 'PNG')
+        return SimpleUploadedFile(name, content.getvalue(), content_type='image/png')
+
+    def variant_path(self, name, variant, format):
+        return os.path.join(self.media_root, variant_name(name, variant, format))
+
+    def upload(self):
+        return self.client.post(
+            reverse('admin-product-photo-create'), {'product': self.product.pk, 'alt': 'Shoe', 'photo': self.image()}, format='multipart',
+        )
+
+    # Test every variant is written once the upload is committed, resized and listed in the response
+    def test_variants_generated(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.upload()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        name = ProductPhoto.objects.get().photo.name
+
+        with Image.open(self.variant_path(name, 'thumb', 'webp')) as image:
+            self.assertEqual((image.format, image.size), ('WEBP', (160, 80)))
+        with Image.open(self.variant_path(name, 'large', 'jpeg')) as image:
+            self.assertEqual((image.format, image.size, image.mode), ('JPEG', (1280, 640), 'RGB'))
+        self.assertIn(variant_name(name, 'small', 'webp'), response.data['photo_variants']['small']['webp'])
+
+    # Test variant URLs of a blob are built without touching the disk and don't change once the variant is written
+    def test_variant_urls_immutable(self):
+        with override_settings(TASKS_EAGER=False, TASK_BROKER='database'):
+            photo = ProductPhoto.objects.create(product=self.product, alt='Shoe', photo=self.image())
+        url = reverse('public-product-photo-list', args=[self.product.pk])
+        with mock.patch('catalog.media.MediaStorage.path', side_effect=AssertionError('variant file looked up')):
+            pending = self.client.get(url).data['results'][0]['photo_variants']
+        self.assertNotIn('?v=', pending['thumb']['webp'])
+
+        generate_image_variants(photo.photo.name)
+        cache.clear()
+        self.assertEqual(self.client.get(url).data['results'][0]['photo_variants'], pending)
+        with override_settings(MEDIA_ACCEL='', DEBUG=True):
+            self.assertIn('immutable', self.client.get(pending['thumb']['webp'])['Cache-Control'])
+
+    # Test the upload only queues the resizing for the task workers
+    @override_settings(TASKS_EAGER=False, TASK_BROKER='database')
+    def test_upload_does_not_wait(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.upload()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        name = ProductPhoto.objects.get().photo.name
+        self.assertEqual(Task.objects.get().name, 'catalog.tasks.generate_image_variants')
+        self.assertEqual(Task.objects.get().args, [name])
+        self.assertFalse(os.path.exists(self.variant_path(name, 'thumb', 'webp')))
+
+    # Test saving a row without a new file doesn't generate the variants again
+    def test_unchanged_file_skipped(self):
+        photo = ProductPhoto.objects.create(product=self.product, alt='Shoe', photo=self.image())
+        photo = ProductPhoto.objects.get(pk=photo.pk)
+        with mock.patch('catalog.images.schedule') as schedule, self.captureOnCommitCallbacks(execute=True):
+            photo.alt = 'Side'
+            photo.save()
+        schedule.assert_not_called()
+
+    # Test the backfill command generates missing variants
+    def test_backfill_command(self):
+        with override_settings(TASKS_EAGER=False, TASK_BROKER='database'):
+            photo = ProductPhoto.objects.create(product=self.product, alt='Shoe', photo=self.image(mode='P'))  # Never run
+        self.assertFalse(os.path.exists(self.variant_path(photo.photo.name, 'small', 'jpeg')))
+        out = StringIO()
+        call_command('generate_image_variants', stdout=out)
+        self.assertIn('variants of 1 images, 0 failed', out.getvalue())
+        self.assertTrue(os.path.exists(self.variant_path(photo.photo.name, 'small', 'jpeg')))
+
+
+class ChunkedUploadTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings = override_settings(MEDIA_ROOT=self.media_root, CHUNKED_UPLOAD_ROOT=os.path.join(self.media_root, 'chunked'))
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.product = Product.objects.create(name='Runner', description='', summary='', category=Category.objects.create(name='Shoes'))
+        admin = User.objects.create_superuser(
+            username='admin', phone_number='1234567890', first_name='Admin', last_name='User', password='TestPassword123!',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(admin)
+        self.content = os.urandom(1000)
+
+    def start(self, target='product_video', filename='clip.mp4'):
+        response = self.client.post(
+            reverse('chunked-upload-create'), {'target': target, 'filename': filename, 'size': len(self.content)}, format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data['id']
+
+    def put(self, upload_id, offset, data):
+        return self.client.put(
+            reverse('chunked-upload-detail', args=[upload_id]) + f'?offset={offset}', data, content_type='application/octet-stream',
+        )
+
+    def complete(self, upload_id, data):
+        return self.client.post(reverse('chunked-upload-complete', args=[upload_id]), data, format='json')
+
+    # Test chunks are written at their offsets, and the finished file becomes a product video
+    def test_upload_product_video(self):
+        upload_id = self.start()
+        self.assertEqual(self.put(upload_id, 0, self.content[:400]).data['offset'], 400)
+        self.assertEqual(self.put(upload_id, 400, self.content[400:]).data['offset'], 1000)
+
+        staging = ChunkedUpload.objects.get().path
+        response = self.complete(upload_id, {'product': self.product.pk, 'alt': 'Side view'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        video = ProductVideo.objects.get(product=self.product)
+        with video.video.open('rb') as file:
+            self.assertEqual(file.read(), self.content)
+        self.assertFalse(os.path.exists(staging))  # Moved, not copied
+        self.assertFalse(ChunkedUpload.objects.exists())
+
+    # Test an interrupted upload resumes from the received bytes, and chunks can't skip ahead
+    def test_resume(self):
+        upload_id = self.start(target='brand_video')
+        self.put(upload_id, 0, self.content[:300])
+        response = self.put(upload_id, 500, self.content[500:])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        offset = self.client.get(reverse('chunked-upload-detail', args=[upload_id])).data['offset']
+        self.assertEqual(offset, 300)
+        self.put(upload_id, 200, self.content[200:600])  # Overlapping resend
+        self.put(upload_id, 600, self.content[600:])
+
+        brand = Brand.objects.create(brand_name='Acme')
+        response = self.complete(upload_id, {'brand': brand.pk, 'alt': 'Ad'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        with BrandVideo.objects.get().video.open('rb') as file:
+            self.assertEqual(file.read(), self.content)
+
+    # Test no row is locked while a chunk is read, and a chunk finishing behind a concurrent one keeps its offset
+    def test_concurrent_chunks(self):
+        upload = ChunkedUpload.objects.get(pk=self.start())
+        content = self.content
+
+        class Stream(BytesIO):
+            def read(self, size=-1):
+                if not self.tell():
+                    # Another request sends the next chunks while this one is still arriving
+                    ChunkedUpload.objects.get(pk=upload.pk).write(0, BytesIO(content[:800]), 800)
+                return super().read(size)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(upload.write(0, Stream(content[:400]), 400), 400)
+        self.assertFalse([query for query in queries if 'FOR UPDATE' in query['sql']])
+        self.assertEqual(upload.offset, 800)
+        self.assertEqual(self.put(upload.pk, 800, content[800:]).data['offset'], 1000)
+
+    # Test incomplete uploads, chunks past the size and other file types are rejected
+    def test_rejected(self):
+        self.assertEqual(self.client.post(
+            reverse('chunked-upload-create'), {'target': 'product_video', 'filename': 'notes.txt', 'size': 10}, format='json',
+        ).status_code, status.HTTP_400_BAD_REQUEST)
+        upload_id = self.start()
+        self.put(upload_id, 0, self.content[:10])
+        self.assertEqual(self.complete(upload_id, {'product': self.product.pk, 'alt': 'x'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.put(upload_id, 10, self.content + b'x').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(ProductVideo.objects.exists())
+
+    # Test a regular user can upload a review video, but not product videos or another user's upload
+    def test_review_video_by_user(self):
+        admin_upload = self.start()
+        user = User.objects.create_user(
+            username='reviewer', phone_number='0987654321', first_name='Review', last_name='User', password='TestPassword123!',
+        )
+        self.client.force_authenticate(user)
+        self.assertEqual(self.client.post(
+            reverse('chunked-upload-create'), {'target': 'product_video', 'filename': 'clip.mp4', 'size': 10}, format='json',
+        ).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.put(admin_upload, 0, self.content).status_code, status.HTTP_404_NOT_FOUND)
+
+        upload_id = self.start(target='review_video')
+        self.put(upload_id, 0, self.content)
+        section = ReviewSection.objects.create(product=self.product, title='Fit')
+        response = self.complete(upload_id, {'review_section': section.pk})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        with ReviewVideo.objects.get(review_section=section).video.open('rb') as file:
+            self.assertEqual(file.read(), self.content)
+
+    # Test abandoned uploads are purged with their staging files
+    def test_purge_stale(self):
+        self.start()
+        upload = ChunkedUpload.objects.get()
+        ChunkedUpload.objects.update(updated_at=upload.updated_at - timedelta(days=2))
+        call_command('purge_chunked_uploads', stdout=StringIO())
+        self.assertFalse(ChunkedUpload.objects.exists())
+        self.assertFalse(os.path.exists(upload.path))
+
+
+class MediaServingTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings = override_settings(
+            MEDIA_ROOT=self.media_root, CHUNKED_UPLOAD_ROOT=os.path.join(self.media_root, 'chunked'), MEDIA_ACCEL='',
+            DEBUG=True,  # Django only sends files itself in development
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.content = os.urandom(1000)
+        self.name = default_storage.save('product/product_videos/clip.mp4', ContentFile(self.content))
+        self.url = default_storage.url(self.name)
+
+    # Test blob URLs and fingerprinted URLs of other files are served with far-future cache headers
+    def test_immutable_url(self):
+        self.assertRegex(self.name, r'^blobs/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.mp4$')
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual((response['Content-Type'], response['Accept-Ranges']), ('video/mp4', 'bytes'))
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # A file stored before blobs, replaced in place
+        os.makedirs(os.path.join(self.media_root, 'product/product_videos'))
+        with open(os.path.join(self.media_root, 'product/product_videos/old.mp4'), 'wb') as file:
+            file.write(self.content)
+        url = default_storage.url('product/product_videos/old.mp4')
+        self.assertIn('?v=', url)
+        self.assertIn('immutable', self.client.get(url)['Cache-Control'])
+        self.assertNotIn('immutable', self.client.get(url.split('?')[0])['Cache-Control'])
+        with open(os.path.join(self.media_root, 'product/product_videos/old.mp4'), 'ab') as file:
+            file.write(b'more')
+        self.assertNotEqual(default_storage.url('product/product_videos/old.mp4'), url)
+
+    # Test byte ranges for seeking
+    def test_range(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b''.join(response.streaming_content), self.content[100:200])
+        self.assertEqual((response['Content-Range'], response['Content-Length']), ('bytes 100-199/1000', '100'))
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-10')
+        self.assertEqual(b''.join(response.streaming_content), self.content[-10:])
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=5000-').status_code, 416)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)  # Changed since, the whole file is sent
+
+    # Test the front proxy sends the file when acceleration is on
+    @override_settings(MEDIA_ACCEL='nginx', MEDIA_ACCEL_PREFIX='/protected-media/')
+    def test_accel_redirect(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.name}')
+        self.assertEqual(response.content, b'')
+
+    # Test production refuses to stream media from the workers without a front proxy
+    @override_settings(DEBUG=False)
+    def test_accel_required_in_production(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.client.get(self.url)
+        self.assertEqual([error.id for error in check_media_accel(None)], ['catalog.E001'])
+        with self.settings(MEDIA_ACCEL='sendfile'):
+            self.assertEqual(self.client.get(self.url).status_code, status.HTTP_200_OK)
+            self.assertEqual(check_media_accel(None), [])
+
+    # Test paths outside the media root and chunked upload staging files aren't served
+    def test_hidden_paths(self):
+        self.assertEqual(self.client.get('/media/../manage.py').status_code, status.HTTP_404_NOT_FOUND)
+        os.makedirs(os.path.join(self.media_root, 'chunked'))
+        open(os.path.join(self.media_root, 'chunked', 'upload.part'), 'wb').close()
+        self.assertEqual(self.client.get('/media/chunked/upload.part').status_code, status.HTTP_404_NOT_FOUND)
+
+
+class MediaBlobTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings = override_settings(MEDIA_ROOT=self.media_root, TASKS_EAGER=True)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        category = Category.objects.create(name='Shoes')
+        self.products = [Product.objects.create(name=f'Runner {i}', description='', summary='', category=category) for i in range(2)]
+        content = BytesIO()
+        Image.new('RGB', (400, 300), 'red').save(content, 'PNG')
+        self.image = content.getvalue()
+
+    def add_photo(self, product, name='shoe.png'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return ProductPhoto.objects.create(product=product, alt='Shoe', photo=SimpleUploadedFile(name, self.image))
+
+    def collect(self):
+        call_command('collect_media_garbage', '--all', '--grace-hours', '0', stdout=StringIO())
+
+    # Test the same content is stored once, under a sharded hash path, and counted per reference
+    def test_deduplicated(self):
+        first = self.add_photo(self.products[0])
+        second = self.add_photo(self.products[1], name='copy.PNG')
+        self.assertEqual(first.photo.name, second.photo.name)
+        self.assertRegex(first.photo.name, r'^blobs/([0-9a-f]{2})/([0-9a-f]{2})/\1\2[0-9a-f]{60}\.png$')
+        self.assertEqual(os.listdir(os.path.dirname(first.photo.path)).count(os.path.basename(first.photo.name)), 1)
+        self.assertEqual(MediaBlob.objects.get(name=first.photo.name).refcount, 2)
+
+        first.delete()
+        self.assertEqual(MediaBlob.objects.get(name=second.photo.name).refcount, 1)
+
+    # Test blobs and their variants are deleted once nothing references them
+    def test_garbage_collected(self):
+        photos = [self.add_photo(product) for product in self.products]
+        path = photos[0].photo.path
+        variant = os.path.join(self.media_root, variant_name(photos[0].photo.name, 'thumb', 'webp'))
+        self.assertTrue(os.path.exists(variant))
+
+        photos[0].delete()
+        self.collect()
+        self.assertTrue(os.path.exists(path))
+        photos[1].delete()
+        self.collect()
+        self.assertFalse(os.path.exists(path) or os.path.exists(variant))
+        self.assertFalse(MediaBlob.objects.exists())
+
+    # Test a referenced blob whose count drifted is kept and its count repaired
+    def test_drifted_count_repaired(self):
+        photo = self.add_photo(self.products[0])
+        MediaBlob.objects.update(refcount=0)
+        self.collect()
+        self.assertTrue(os.path.exists(photo.photo.path))
+        self.assertEqual(MediaBlob.objects.get().refcount, 1)
+
+    # Test each run walks the next shards
+    def test_incremental(self):
+        out = StringIO()
+        call_command('collect_media_garbage', '--shards', '16', stdout=out)
+        call_command('collect_media_garbage', '--shards', '16', stdout=out)
+        self.assertIn('shards 00 to 0f', out.getvalue())
+        self.assertIn('shards 10 to 1f', out.getvalue())
+
+
+class OrderingMoveTest(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Shoes')
+        self.product = Product.objects.create(name='Boot', description='', summary='', category=category)
+        self.details = [
+            ProductDetail.objects.create(product=self.product, title=f'Detail {i}', value='', order_num=i * ORDER_GAP)
+            for i in range(1, 4)
+        ]
+        self.section = ReviewSection.objects.create(product=self.product, title='Fit')
+        self.text = ReviewText.objects.create(review_section=self.section, text='First')
+        self.photo = ReviewPhoto.objects.create(review_section=self.section, image='review_photos/1.jpg', position=ReviewPhoto.LEFT_SMALL)
+        self.video = ReviewVideo.objects.create(review_section=self.section, video='review_videos/1.mp4')
+
+    def detail_titles(self):
+        return list(self.product.details.order_by('order_num').values_list('title', flat=True))
+
+    # Test a move writes only the moved row
+    def test_move_is_single_row_write(self):
+        first, second, third = self.details
+        with CaptureQueriesContext(connection) as queries:
+            move(third, before=first)
+        writes = [query['sql'] for query in queries if query['sql'].startswith(('UPDATE', 'INSERT'))]
+        self.assertEqual(len(writes), 1)
+        self.assertEqual(self.detail_titles(), ['Detail 3', 'Detail 1', 'Detail 2'])
+        self.assertEqual(third.order_num, ORDER_GAP // 2)
+
+        move(third, after=second)
+        self.assertEqual(self.detail_titles(), ['Detail 1', 'Detail 2', 'Detail 3'])
+
+    # Test the collection is respaced once two neighbours are adjacent, keeping its order
+    def test_rebalance_when_gap_runs_out(self):
+        first, second, third = self.details
+        for position, detail in enumerate(self.details, 1):
+            ProductDetail.objects.filter(pk=detail.pk).update(order_num=position)
+
+        move(third, before=second)
+        self.assertEqual(self.detail_titles(), ['Detail 1', 'Detail 3', 'Detail 2'])
+        positions = list(self.product.details.order_by('order_num').values_list('order_num', flat=True))
+        self.assertEqual(positions, [ORDER_GAP, ORDER_GAP + ORDER_GAP // 2, 2 * ORDER_GAP])
+
+    # Test review items move among the items of other types, and new items still go last
+    def test_move_review_items_across_types(self):
+        move(self.video, before=self.text)
+        move(self.text, after=self.photo)
+        self.assertEqual(self.video.order_num, ORDER_GAP // 2)
+        added = ReviewText.objects.create(review_section=self.section, text='Last')
+        self.assertGreater(added.order_num, self.text.order_num)
+
+        merged = sorted([*self.section.texts.all(), *self.section.photos.all(), *self.section.videos.all()], key=lambda item: item.order_num)
+        self.assertEqual(merged, [self.video, self.photo, self.text, added])
+
+    # Test the admin endpoint moves rows and rejects rows of another collection
+    def test_move_endpoint(self):
+        admin = User.objects.create_superuser(
+            username='admin', phone_number='1234567890',
+            first_name='Admin', last_name='User', password='TestPassword123!',
+        )
+        client = APIClient()
+        client.force_authenticate(admin)
+        url = reverse('ordering-move')
+
+        response = client.post(url, {'model': 'review_photo', 'id': self.photo.pk, 'before': self.text.pk, 'target_model': 'review_text'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertLess(response.data['order_num'], ReviewText.objects.get(pk=self.text.pk).order_num)
+
+        response = client.post(url, {'model': 'product_detail', 'id': self.details[0].pk, 'after': self.text.pk, 'target_model': 'review_text'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(APIClient().post(url, {}).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    # Test new details are numbered ORDER_GAP apart after the existing ones, so moves stay single-row writes
+    def test_details_numbered_from_sequence(self):
+        added = ProductDetail.objects.create(product=self.product, title='Detail 4', value='')
+        self.assertEqual(added.order_num, 4 * ORDER_GAP)
+
+        admin = User.objects.create_superuser(
+            username='admin', phone_number='1234567890',
+            first_name='Admin', last_name='User', password='TestPassword123!',
+        )
+        client = APIClient()
+        client.force_authenticate(admin)
+        response = client.post(reverse('admin-product-detail-list-create'), {'product': self.product.pk, 'title': 'Detail 5', 'value': 'Leather'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['order_num'], 5 * ORDER_GAP)
+
+        # Swapped in one statement, without touching the sequence's numbers
+        first, second = self.details[:2]
+        with CaptureQueriesContext(connection) as queries:
+            response = client.post(reverse('product-detail-swap-order'), {'first_detail_id': first.pk, 'second_detail_id': second.pk})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['first_detail']['order_num'], 2 * ORDER_GAP)
+        self.assertLessEqual(len([query for query in queries if query['sql'].startswith('UPDATE')]), 2)
+        self.assertEqual(self.detail_titles(), ['Detail 2', 'Detail 1', 'Detail 3', 'Detail 4', 'Detail 5'])
+
+    # Test the background command respaces only crowded collections
+    def test_rebalance_ordering_command(self):
+        ReviewPhoto.objects.filter(pk=self.photo.pk).update(order_num=self.text.order_num + 1)
+        self.assertEqual(REVIEW_ITEMS.crowded_keys(), [self.section.pk])
+
+        call_command('rebalance_ordering', stdout=StringIO())
+
+        self.assertEqual(REVIEW_ITEMS.crowded_keys(), [])
+        self.assertEqual(ReviewPhoto.objects.get(pk=self.photo.pk).order_num, 2 * ORDER_GAP)
+
+
+class AttributeGroupPropagationTest(TestCase):
+    def setUp(self):
+        self.sizes = AttributeGroup.objects.create(name='Sizes')
+        self.colors = AttributeGroup.objects.create(name='Colors')
+        self.root = Category.objects.create(name='Clothes')
+        self.child = Category.objects.create(name='Shirts', parent=self.root)
+        self.grandchild = Category.objects.create(name='T-Shirts', parent=self.child)
+        self.grandchild.attribute_groups.set([self.colors])
+
+    def group_names(self, category):
+        return sorted(category.attribute_groups.values_list('name', flat=True))
+
+    # Test changing a category's groups replaces the groups of its whole subtree
+    def test_groups_propagate_to_subtree(self):
+        self.root.attribute_groups.set([self.sizes])
+
+        self.assertEqual(self.group_names(self.child), ['Sizes'])
+        self.assertEqual(self.group_names(self.grandchild), ['Sizes'])
+
+    # Test propagation runs a constant number of statements regardless of the tree depth
+    def test_propagation_is_set_based(self):
+        self.root.attribute_groups.add(self.sizes)
+        parent = self.grandchild
+        for i in range(10):
+            parent = Category.objects.create(name=f'Nested {i}', parent=parent)
+
+        with self.assertNumQueries(6):  # groups, subtree ids, delete, insert and the savepoint pair
+            self.root.propagate_attribute_groups_to_subcategories()
+        self.assertEqual(self.group_names(parent), ['Sizes'])
+
+    # Test the background command propagates in batches
+    def test_propagate_attribute_groups_command(self):
+        Category.attribute_groups.through.objects.create(category=self.root, attributegroup=self.sizes)
+
+        call_command('propagate_attribute_groups', str(self.root.pk), '--batch-size', '1', stdout=StringIO())
+
+        self.assertEqual(self.group_names(self.grandchild), ['Sizes'])
+
+    # Test a subtree larger than the inline limit is propagated by a background task
+    @override_settings(TASKS_EAGER=False, TASK_BROKER='database')
+    def test_large_subtree_propagated_in_background(self):
+        with mock.patch.object(Category, 'PROPAGATE_INLINE_LIMIT', 1):
+            self.root.attribute_groups.set([self.sizes])
+        self.assertEqual(self.group_names(self.grandchild), ['Colors'])
+        self.assertEqual(Task.objects.get().name, 'catalog.tasks.propagate_attribute_groups')
+
+        call_command('task_worker', '--burst', '--processes', '0', stdout=StringIO())
+
+        self.assertEqual(self.group_names(self.grandchild), ['Sizes'])
+
+
+class CategoryFacetSearchTest(TestCase):
+    def setUp(self):
+        cache.clear()  # Start every test from a fresh facet version, so the index is rebuilt
+        self.shoes = Category.objects.create(name='Shoes')
+        self.sneakers = Category.objects.create(name='Sneakers', parent=self.shoes)
+        other = Category.objects.create(name='Bags')
+
+        size = AttributeType.objects.create(name='Size')
+        color = AttributeType.objects.create(name='Color')
+        self.size_42 = ProductAttributeValue.objects.create(type=size, value=42)
+        self.size_43 = ProductAttributeValue.objects.create(type=size, value=43)
+        self.black = ProductAttributeValue.objects.create(type=color, value='black')
+        self.white = ProductAttributeValue.objects.create(type=color, value='white')
+
+        # Runner has 42 in black and 43 in white, Walker only 42 in white
+        self.runner = self.create_product('Runner', self.sneakers, [(1, self.size_42, self.black), (1, self.size_43, self.white)])
+        self.walker = self.create_product('Walker', self.shoes, [(1, self.size_42, self.white)])
+        self.create_product('Sold out', self.shoes, [(0, self.size_42, self.black)])
+        self.create_product('Other', other, [(1, self.size_42, self.black)])
+
+    def create_product(self, name, category, skus):
+        product = Product.objects.create(name=name, description='desc', summary='summary', category=category)
+        for quantity, *values in skus:
+            sku = ProductSKU.objects.create(product=product, price=100, quantity=quantity)
+            for value in values:
+                ProductSKUAttribute.objects.create(sku=sku, attribute_value=value)
+        return product
+
+    def search(self, *values):
+        url = reverse('category-facets', args=[self.shoes.pk])
+        response = self.client.get(url, {'values': ','.join(str(value.pk) for value in values)})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        counts = {
+            value['id']: value['count'] for facet in response.data['facets'] for value in facet['values']
+        }
+        return response.data['count'], [product['name'] for product in response.data['results']], counts
+
+    # Test in-stock products of the category subtree are counted per attribute value
+    def test_facet_counts_without_filter(self):
+        count, names, counts = self.search()
+        self.assertEqual((count, names), (2, ['Walker', 'Runner']))
+        self.assertEqual(counts, {self.size_42.pk: 2, self.size_43.pk: 1, self.black.pk: 1, self.white.pk: 2})
+
+    # Test filters must match a single SKU across attribute types
+    def test_filter_matches_single_sku(self):
+        count, names, counts = self.search(self.size_42, self.black)
+        self.assertEqual((count, names), (1, ['Runner']))
+        # Each facet is counted with the other types' selection only
+        self.assertEqual(counts, {self.size_42.pk: 1, self.black.pk: 1, self.white.pk: 1})
+
+        self.assertEqual(self.search(self.size_43, self.black)[0], 0)
+        # Values of one type are combined with OR
+        self.assertEqual(self.search(self.size_42, self.size_43)[0], 2)
+
+    # Test SKU and attribute writes update the index once committed
+    def test_index_follows_writes(self):
+        self.search()  # Build the index
+        with self.captureOnCommitCallbacks(execute=True):
+            sku = self.walker.skus.get()
+            sku.quantity = 0
+            sku.save()
+        self.assertEqual(self.search(self.size_42)[:2], (1, ['Runner']))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_product('Boot', self.sneakers, [(3, self.size_43, self.black)])
+        self.assertEqual(self.search(self.size_43, self.black)[:2], (1, ['Boot']))
+
+
+class ProductSearchTest(TestCase):
+    def setUp(self):
+        self.shoes = Category.objects.create(name='Shoes')
+        self.running = Category.objects.create(name='Running', parent=self.shoes)
+        self.create_product('Trail runner', self.running, 'Light shoe for mountain trails')
+        self.create_product('Leather boot', self.shoes, 'Waterproof boot, also good for running errands')
+        self.create_product('Hidden runner', self.running, 'Inactive', is_active=False)
+        self.search_url = reverse('product-search')
+
+    def create_product(self, name, category, description, is_active=True):
+        return Product.objects.create(
+            name=name, description=description, summary='summary', category=category, is_active=is_active
+        )
+
+    def search(self, query, **params):
+        response = self.client.get(self.search_url, {'q': query, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [product['name'] for product in response.data['results']], response.data['next']
+
+    # Test results are ranked by the field that matched and inactive products are left out
+    def test_search_ranks_name_matches_first(self):
+        self.assertEqual(self.search('running')[0], ['Trail runner', 'Leather boot'])  # Category, then description
+        self.assertEqual(self.search('boot')[0], ['Leather boot'])
+        self.assertEqual(self.search('trail mount')[0], ['Trail runner'])  # Last word as a prefix
+
+    # Test relevance is computed over every match, not just the newest ones
+    def test_search_ranks_all_matches(self):
+        for index in range(30):
+            self.create_product(f'Sandal {index}', self.shoes, 'Lighter than a boot')
+        names, next_url = self.search('boot', page_size=10)
+        self.assertEqual(names[0], 'Leather boot')
+        self.assertEqual(len(names), 10)
+        self.assertIsNotNone(next_url)
+
+    # Test documents follow product and category writes
+    def test_search_follows_writes(self):
+        product = Product.objects.get(name='Leather boot')
+        product.name = 'Leather loafer'
+        product.save()
+        self.assertEqual(self.search('loafer')[0], ['Leather loafer'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.running.name = 'Jogging'
+            self.running.save()
+        self.assertEqual(self.search('jogging')[0], ['Trail runner'])
+
+    # Test results are paginated with offset links
+    def test_search_pagination(self):
+        names, next_url = self.search('shoes', page_size=1)
+        self.assertEqual(len(names), 1)
+        self.assertIsNotNone(next_url)
+        self.assertEqual(len(self.client.get(next_url).data['results']), 1)
+
+    # Test the LIKE based search used on databases without a full-text index
+    def test_fallback_search(self):
+        ranked = Product.objects.in_bulk(search._search_fallback(['running'], limit=10, offset=0))
+        self.assertEqual([product.name for product in ranked.values()], ['Trail runner', 'Leather boot'])
+
+    # Test an empty query is rejected
+    def test_search_requires_query(self):
+        response = self.client.get(self.search_url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
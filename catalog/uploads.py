@@ -0,0 +1,25 @@
+from django.core.files import File
+from rest_framework.parsers import BaseParser
+
+# Videos can be sent in chunks (see ChunkedUpload) rather than in one multipart request: each chunk is a PUT of raw
+# bytes copied to the staging file as they arrive, so nothing is buffered whole and a dropped connection only costs
+# the chunk in flight.
+
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+MAX_UPLOAD_SIZE = 10 * 1024 * 1024 * 1024
+VIDEO_EXTENSIONS = ['mp4', 'mov', 'avi', 'mkv']
+
+
+class ChunkParser(BaseParser):
+    """Chunks are raw bytes, the view reads them from the request stream itself."""
+    media_type = 'application/octet-stream'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        return stream
+
+
+class StagedFile(File):
+    """A finished upload's staging file. Storages move files with a temporary_file_path() instead of copying them."""
+
+    def temporary_file_path(self):
+        return self.file.name
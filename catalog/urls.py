@@ -64,6 +64,9 @@ urlpatterns = [
     # User: Retrieve details of a specific category by ID (GET)
     path('category/<int:pk>/', UserCategoryDetailView.as_view(), name='user-category-detail'),
 
+    # User: Filter the products of a category and its subcategories by attribute values, with facet counts (GET)
+    path('category/<int:pk>/facets/', CategoryFacetSearchView.as_view(), name='category-facets'),
+
     # User: Retrieve a hierarchical structure of all categories, including subcategories (GET)
     path('categories/tree/', CategoryTreeView.as_view(), name='category-tree'),
 
@@ -71,12 +74,24 @@ urlpatterns = [
     # User: Retrieve a list of all public products (GET)
     path('products-list/', PublicProductListView.as_view(), name='public-product-list'),
 
+    # User: Full-text search over all public products, ranked (GET)
+    path('products/search/', ProductSearchView.as_view(), name='product-search'),
+
+    # Admin: Bulk import products, details and SKUs from a CSV or JSONL file (POST)
+    path('admin/products/import/', CatalogImportView.as_view(), name='catalog-import'),
+
+    # Admin: Download the catalog as CSV or JSONL, streamed (GET)
+    path('admin/products/export/', CatalogExportView.as_view(), name='catalog-export'),
+
     # Admin: Retrieve a list of all products for management purposes (GET)
     path('admin/products-list/', AdminProductListManageView.as_view(), name='admin-product-manage'),
 
     # User: Retrieve details of a specific product by ID (GET)
     path('product/product-detail/<int:pk>/', UserProductView.as_view(), name='product-detail'),
 
+    # User: Retrieve a product with its details, media, SKUs and review sections in one response (GET)
+    path('product/<int:pk>/page/', ProductPageView.as_view(), name='product-page'),
+
     # Admin: Create a new product (POST)
     path('admin/products/', AdminProductCreateView.as_view(), name='admin-product-create'),
 
@@ -127,6 +142,9 @@ urlpatterns = [
     # Public: Retrieve a list of SKUs for a specific product by product ID (GET)
     path('products/<int:product_id>/skus/', ListProductSKUView.as_view(), name='create-product-skus'),
 
+    # Admin: Create a SKU for every combination of the given attribute values of a product (POST)
+    path('admin/products/<int:pk>/sku-matrix/', ProductSKUMatrixView.as_view(), name='product-sku-matrix'),
+
     # List all SKU attributes (admin can also create)
     path('sku-attributes/', ProductSKUAttributeListCreateView.as_view(), name='sku-attribute-list-create'),
 
@@ -149,6 +167,15 @@ urlpatterns = [
     # Admin: Swap order numbers between items (text, photo, video) within a review section (POST)
     path('review-section/items/swap-order-num/', SwapOrderNumItemView.as_view(), name='swap_order_num'),
 
+    # Admin: Move a product detail, review section or review item before or after another one (POST)
+    path('admin/ordering/move/', OrderingMoveView.as_view(), name='ordering-move'),
+
+    # Admin: Upload a product, brand or review video in chunks: start (POST), check, send a chunk or cancel
+    # (GET, PUT, DELETE), then create the video from it (POST)
+    path('admin/uploads/', ChunkedUploadCreateView.as_view(), name='chunked-upload-create'),
+    path('admin/uploads/<uuid:pk>/', ChunkedUploadDetailView.as_view(), name='chunked-upload-detail'),
+    path('admin/uploads/<uuid:pk>/complete/', ChunkedUploadCompleteView.as_view(), name='chunked-upload-complete'),
+
 
     # ReviewSection Text URLs
     # Public: List and create text entries for product reviews (GET, POST)
@@ -0,0 +1,48 @@
+import itertools
+from django.db import transaction
+from .cache import PRODUCT, PRODUCTS
+from .conditional import invalidate_etags
+from .facets import products_changed
+from .models import ProductSKU, ProductSKUAttribute, ProductSummary
+
+# Largest matrix created in one request
+MAX_VARIANTS = 5000
+
+
+def combinations(values_by_type):
+    """Every combination of one value id per attribute type, as tuples."""
+    return list(itertools.product(*values_by_type.values()))
+
+
+def create_sku_matrix(product_id, values_by_type, price=0, quantity=0, is_active=True):
+    """
+    Create a SKU of the product for every combination of one value per attribute type ({type id: [value ids]}),
+    skipping combinations an existing SKU already has. Returns the created SKUs and the number of skipped ones.
+    The whole matrix takes a fixed number of statements, whatever its size.
+    """
+    existing = {}
+    for sku_id, value_id in ProductSKUAttribute.objects.filter(sku__product_id=product_id).values_list('sku_id', 'attribute_value_id'):
+        existing.setdefault(sku_id, set()).add(value_id)
+    existing = {frozenset(values) for values in existing.values()}
+
+    matrix = combinations(values_by_type)
+    variants = [combination for combination in matrix if frozenset(combination) not in existing]
+    skipped = len(matrix) - len(variants)
+    if not variants:
+        return [], skipped
+
+    with transaction.atomic():
+        skus = ProductSKU.objects.bulk_create([
+            ProductSKU(product_id=product_id, sku=code, price=price, quantity=quantity, is_active=is_active)
+            for code in ProductSKU.allocate_codes(len(variants))
+        ])
+        ProductSKUAttribute.objects.bulk_create([
+            ProductSKUAttribute(sku_id=sku.pk, attribute_value_id=value_id)
+            for sku, combination in zip(skus, variants) for value_id in combination
+        ], batch_size=2000)
+
+        # bulk_create() skips the model signals, refresh what they would have
+        ProductSummary.refresh_for_products([product_id])
+        products_changed([product_id])
+        invalidate_etags(PRODUCT.format(id=product_id), PRODUCTS)
+    return skus, skipped
@@ -2,7 +2,8 @@ from rest_framework import generics
 from rest_framework.response import Response
 from rest_framework.permissions import IsAdminUser, IsAuthenticated, AllowAny
 from rest_framework.exceptions import ValidationError  # Import ValidationError
-from django.db import transaction  # Import transaction
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import IntegrityError, transaction  # Import transaction
 from accounts.manager import IsSuperUser  # custom permission
 from rest_framework.parsers import MultiPartParser, FormParser  # for parsing file
 from drf_spectacular.utils import extend_schema, extend_schema_field, OpenApiParameter
@@ -10,6 +11,20 @@ from rest_framework import status
 from drf_spectacular.types import OpenApiTypes
 from .models import *
 from .serializers import *
+from .pagination import (
+    CreatedAtCursorPagination, BrandCursorPagination, IdCursorPagination, OrderNumCursorPagination, ProductCursorPagination,
+    RankedOffsetPagination,
+)
+from .cache import ATTRIBUTE_GROUPS, ATTRIBUTES, BRAND, BRANDS, CATEGORIES, CATEGORY, PRODUCT, PRODUCTS, REVIEWS, get_category_tree
+from .conditional import ConditionalGetMixin, invalidate_etags
+from .response_cache import CachedResponseMixin
+from .facets import facet_index
+from .search import search_product_ids
+from .ordering import move
+from .importer import CatalogImporter, ImportFileError, check_file, decode_lines, read_rows
+from .export import CATALOG_FIELDS, catalog_rows, export_response
+from .variants import create_sku_matrix
+from .uploads import MAX_CHUNK_SIZE, ChunkParser, StagedFile
 
 # # Brand Views
 @extend_schema(
@@ -18,8 +33,10 @@ from .serializers import *
     description="Retrieve a list of all active brands for users.",
     tags=["Brands"]
 )
-class BrandListView(generics.ListAPIView):
+class BrandListView(ConditionalGetMixin, generics.ListAPIView):
     serializer_class = BrandSerializer
+    etag_namespaces = [BRANDS]
+    pagination_class = BrandCursorPagination
 
     def get_queryset(self):
         # Filter the queryset to only include active brands for user
@@ -51,10 +68,13 @@ class BrandListCreateView(generics.ListCreateAPIView):
     description="Retrieve details of a specific brand, including associated photos and videos, for users.",
     tags=["Brands"]
 )
-class BrandShowDetailView(generics.RetrieveAPIView):
+class BrandShowDetailView(CachedResponseMixin, generics.RetrieveAPIView):
     queryset = Brand.objects.all()
     serializer_class = BrandDetailSerializer  # Using BrandDetailSerializer to include photos and videos
 
+    def get_etag_namespaces(self):
+        return [BRAND.format(id=self.kwargs['pk'])]
+
 
 @extend_schema(
     methods=['GET'],
@@ -388,10 +408,12 @@ class CategoryListCreateView(generics.ListCreateAPIView):
     description="Retrieve a list of categories available to users.",
     tags=["Categories"]
 )
-class UserCategoryListView(generics.ListAPIView):
+class UserCategoryListView(ConditionalGetMixin, generics.ListAPIView):
     queryset = Category.objects.filter(is_active=True)
     serializer_class = UserCategoryListSerializer
     permission_classes = [AllowAny]
+    pagination_class = CreatedAtCursorPagination
+    etag_namespaces = [CATEGORIES]
 
 
 @extend_schema(
@@ -400,23 +422,80 @@ class UserCategoryListView(generics.ListAPIView):
     description="Retrieve the details of a specific category.",
     tags=["Categories"]
 )
-class UserCategoryDetailView(generics.RetrieveAPIView):
+class UserCategoryDetailView(CachedResponseMixin, generics.RetrieveAPIView):
     queryset = Category.objects.filter(is_active=True)
     serializer_class = UserCategoryDetailSerializer
     permission_classes = [AllowAny]
+
+    def get_etag_namespaces(self):
+        return [CATEGORY.format(id=self.kwargs['pk']), ATTRIBUTE_GROUPS]
     
     
+# Faceted filtering of the products of a category
+@extend_schema(
+    methods=['GET'],
+    summary="User Filter Category Products by Attributes",
+    description="Filter the in-stock products of a category and its subcategories by attribute value ids, "
+                "with the number of matching products for every attribute value. Values of the same attribute "
+                "type are combined with OR, different types with AND, and a single SKU must match all types.",
+    parameters=[
+        OpenApiParameter(name='values', type=str, required=False, description="Comma separated attribute value ids, e.g. 12,15"),
+        OpenApiParameter(name='offset', type=int, required=False, description="Number of products to skip"),
+        OpenApiParameter(name='page_size', type=int, required=False, description="Number of products to return (max 100)"),
+    ],
+    responses=CategoryFacetSearchSerializer,
+    tags=["Categories"]
+)
+class CategoryFacetSearchView(generics.GenericAPIView):
+    queryset = Category.objects.filter(is_active=True)
+    permission_classes = [AllowAny]
+    pagination_class = RankedOffsetPagination
+
+    def get(self, request, *args, **kwargs):
+        category = self.get_object()
+        raw_values = [value for value in request.query_params.get('values', '').split(',') if value]
+        if not all(value.isdigit() for value in raw_values):
+            raise serializers.ValidationError({'values': "Must be comma separated attribute value ids."})
+
+        result = {}
+
+        def fetch(offset, limit):
+            result.update(facet_index.search(
+                category_ids=category.get_descendants(include_self=True).values_list('id', flat=True),
+                value_ids=[int(value) for value in raw_values],
+                offset=offset,
+                limit=limit,
+            ))
+            return result['product_ids']
+
+        product_ids = self.paginator.paginate_ids(request, fetch)
+        page = Product.objects.with_listing_data().in_bulk(product_ids)
+        products = [page[product_id] for product_id in product_ids if product_id in page]
+        return self.paginator.get_paginated_response(
+            ProductListSerializer(products, many=True, context=self.get_serializer_context()).data,
+            count=result['count'],
+            facets=result['facets'],
+        )
+
+
 # View for nested categories (hierarchical list)
 @extend_schema(
     methods=['GET'],
     summary="User List Categories in Hierarchical Structure",
     description="Retrieve categories in a hierarchical structure (parent-child).",
+    responses=CategoryTreeSerializer(many=True),
     tags=["Categories"]
 )
-class CategoryTreeView(generics.ListAPIView):
+class CategoryTreeView(ConditionalGetMixin, generics.ListAPIView):
     queryset = Category.objects.filter(parent=None, is_active=True)
     serializer_class = CategoryTreeSerializer
     permission_classes = [AllowAny]
+    pagination_class = None  # The whole tree in one response
+    etag_namespaces = [CATEGORIES]
+
+    def list(self, request, *args, **kwargs):
+        # The tree is built from one query and cached until the next category write
+        return Response(get_category_tree())
     
     
 # # Product Views
@@ -424,13 +503,76 @@ class CategoryTreeView(generics.ListAPIView):
 @extend_schema(
     methods=["GET"],
     summary="List all active products",
-    description="Retrieve a list of all active products that are available for the public.",
+    description="Retrieve a list of all active products that are available for the public. "
+                "Use ?category=<id> to list the products of a category and all of its subcategories, "
+                "?min_price= / ?max_price= to keep products with an in-stock SKU in that price range, "
+                "and ?ordering=price or -price to sort by the lowest in-stock SKU price.",
+    parameters=[
+        OpenApiParameter(name='category', type=int, required=False, description="Category id, includes subcategories"),
+        OpenApiParameter(name='min_price', type=int, required=False, description="Lowest accepted SKU price"),
+        OpenApiParameter(name='max_price', type=int, required=False, description="Highest accepted SKU price"),
+        OpenApiParameter(name='ordering', type=str, required=False, enum=['price', '-price'], description="Sort by price"),
+    ],
     tags=["Public Products"],
 )
-class PublicProductListView(generics.ListAPIView):
-    queryset = Product.objects.filter(is_active=True)  # Filter for active products
+class PublicProductListView(CachedResponseMixin, generics.ListAPIView):
+    queryset = Product.objects.filter(is_active=True).with_listing_data()  # Filter for active products
     serializer_class = ProductListSerializer
     permission_classes = [AllowAny]  # Allow all users
+    pagination_class = ProductCursorPagination
+    etag_namespaces = [PRODUCTS, CATEGORIES]
+
+    def get_int_param(self, name):
+        value = self.request.query_params.get(name)
+        if not value:
+            return None
+        if not value.isdigit():
+            raise serializers.ValidationError({name: "Must be a non-negative integer."})
+        return int(value)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        category_id = self.request.query_params.get('category')
+        if category_id:
+            if not category_id.isdigit():
+                raise serializers.ValidationError({'category': "Category id must be an integer."})
+            queryset = queryset.in_category(int(category_id))
+
+        min_price, max_price = self.get_int_param('min_price'), self.get_int_param('max_price')
+        if min_price is not None or max_price is not None:
+            queryset = queryset.priced_between(min_price, max_price)
+        return queryset
+
+
+# Public full-text search over active products
+@extend_schema(
+    methods=["GET"],
+    summary="Search products",
+    description="Full-text search over product names, category names, summaries and descriptions. "
+                "Every word must match, the last one also as a prefix unless the query ends with a space. "
+                "Every match is ranked by relevance, words in the name weigh the most.",
+    parameters=[
+        OpenApiParameter(name='q', type=str, required=True, description="Search query"),
+        OpenApiParameter(name='offset', type=int, required=False, description="Number of results to skip"),
+        OpenApiParameter(name='page_size', type=int, required=False, description="Number of results to return (max 100)"),
+    ],
+    responses=ProductSearchResultsSerializer,
+    tags=["Public Products"],
+)
+class ProductSearchView(generics.GenericAPIView):
+    serializer_class = ProductListSerializer
+    permission_classes = [AllowAny]
+    pagination_class = RankedOffsetPagination
+
+    def get(self, request, *args, **kwargs):
+        query = request.query_params.get('q', '')
+        if not query.strip():
+            raise serializers.ValidationError({'q': "This query parameter is required."})
+
+        product_ids = self.paginator.paginate_ids(request, lambda offset, limit: search_product_ids(query, limit, offset))
+        page = Product.objects.with_listing_data().in_bulk(product_ids)
+        products = [page[product_id] for product_id in product_ids if product_id in page]
+        return self.paginator.get_paginated_response(self.get_serializer(products, many=True).data)
 
 
 # Admin view to list all products and manage the active status
@@ -448,7 +590,7 @@ class PublicProductListView(generics.ListAPIView):
     tags=["Admin Products"],
 )
 class AdminProductListManageView(generics.GenericAPIView):
-    queryset = Product.objects.all()  # Show all products without filtering
+    queryset = Product.objects.with_listing_data()  # Show all products without filtering
     serializer_class = ProductListSerializer
     permission_classes = [IsAuthenticated, IsAdminUser | IsSuperUser]  # Only accessible to authenticated admins
 
@@ -478,11 +620,33 @@ class AdminProductListManageView(generics.GenericAPIView):
     description="Get the details of a specific active product by its ID.",
     tags=["Public Products"],
 )
-class UserProductView(generics.RetrieveAPIView):
-    queryset = Product.objects.filter(is_active=True)  # Only active products
+class UserProductView(CachedResponseMixin, generics.RetrieveAPIView):
+    queryset = Product.objects.filter(is_active=True).with_listing_data()  # Only active products
     serializer_class = ProductSerializer
     permission_classes = [AllowAny]
 
+    def get_etag_namespaces(self):
+        # The attribute groups come from the product's category chain
+        return [PRODUCT.format(id=self.kwargs['pk']), CATEGORIES]
+
+
+# Public view returning everything a product page shows in one response
+@extend_schema(
+    methods=["GET"],
+    summary="Get a product page",
+    description="Get an active product with its ordered details, photos, videos, active SKUs with their attribute values "
+                "and ordered review sections with their items, in one response.",
+    tags=["Public Products"],
+)
+class ProductPageView(CachedResponseMixin, generics.RetrieveAPIView):
+    queryset = Product.objects.filter(is_active=True).with_page_data()
+    serializer_class = ProductPageSerializer
+    permission_classes = [AllowAny]
+
+    def get_etag_namespaces(self):
+        product_id = self.kwargs['pk']
+        return [PRODUCT.format(id=product_id), REVIEWS.format(id=product_id), CATEGORIES, ATTRIBUTES]
+
 
 # Admin view for retrieving, updating, or deleting a specific product
 @extend_schema(
@@ -565,11 +729,12 @@ class PublicProductDetailView(generics.ListAPIView):
     # queryset = ProductDetail.objects.all()
     serializer_class = ProductDetailSerializer
     permission_classes = [AllowAny]
+    pagination_class = OrderNumCursorPagination
     
     def get_queryset(self):
         # Get product_id from the request and filter ProductDetail instances by it
         product_id = self.kwargs.get('product_id')
-        return ProductDetail.objects.filter(product_id=product_id).order_by('order_num')
+        return ProductDetail.objects.filter(product_id=product_id)
     
 
 # Admin view to list, create, or update product details
@@ -662,26 +827,14 @@ class ProductDetailSwapOrderView(generics.GenericAPIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        # Swap the order_num values using a temporary placeholder
-        with transaction.atomic():
-            temp_order_num = max(   # biggest order_num + 1
-                ProductDetail.objects.filter(product_id=first_detail.product_id)
-                .values_list('order_num', flat=True)
-            ) + 1
-
-            # Step 1: Set first_detail's order_num to the temporary value
-            first_detail_order_num = first_detail.order_num
-            first_detail.order_num = temp_order_num
-            first_detail.save()
-
-            # Step 2: Set second_detail's order_num to original first_detail's order_num
-            second_detail_order_num = second_detail.order_num
-            second_detail.order_num = first_detail_order_num
-            second_detail.save()
-
-            # Step 3: Set first_detail's order_num to original second_detail's order_num
-            first_detail.order_num = second_detail_order_num
-            first_detail.save()
+        # Swap the order_num values in one statement, see ProductDetail.reorder()
+        ProductDetail.reorder(first_detail.product_id, {
+            first_detail.pk: second_detail.order_num,
+            second_detail.pk: first_detail.order_num,
+        })
+        first_detail.order_num, second_detail.order_num = second_detail.order_num, first_detail.order_num
+        # The reorder skips the model signals, drop the cached responses of the product here
+        invalidate_etags(PRODUCT.format(id=first_detail.product_id))
 
         # Serialize the updated ProductDetail instances
         first_serializer = self.get_serializer(first_detail)
@@ -727,10 +880,13 @@ class ProductDetailBatchUpdateView(generics.UpdateAPIView):
     description="Retrieve all photos associated with a specific product.",
     tags=["Product Media"],
 )
-class PublicProductPhotoListView(generics.ListAPIView):
+class PublicProductPhotoListView(ConditionalGetMixin, generics.ListAPIView):
     serializer_class = ProductPhotoSerializer
     permission_classes = [AllowAny]
 
+    def get_etag_namespaces(self):
+        return [PRODUCT.format(id=self.kwargs['product_id'])]
+
     def get_queryset(self):
         product_id = self.kwargs.get("product_id")
         return ProductPhoto.objects.filter(product_id=product_id)
@@ -804,10 +960,13 @@ class AdminProductPhotoDetailView(generics.RetrieveUpdateDestroyAPIView):
     description="Retrieve all videos associated with a specific product.",
     tags=["Product Media"],
 )
-class PublicProductVideoListView(generics.ListAPIView):
+class PublicProductVideoListView(ConditionalGetMixin, generics.ListAPIView):
     serializer_class = ProductVideoSerializer
     permission_classes = [AllowAny]
 
+    def get_etag_namespaces(self):
+        return [PRODUCT.format(id=self.kwargs['product_id'])]
+
     def get_queryset(self):
         product_id = self.kwargs.get("product_id")
         return ProductVideo.objects.filter(product_id=product_id)
@@ -888,8 +1047,9 @@ class AdminProductVideoDetailView(generics.RetrieveUpdateDestroyAPIView):
     tags=["Product SKU Management"]
 )
 class ProductSKUListView(generics.ListCreateAPIView):
-    queryset = ProductSKU.objects.all()
+    queryset = ProductSKU.objects.prefetch_related('sku_attributes__attribute_value__type')
     serializer_class = ProductSKUSerializer
+    pagination_class = CreatedAtCursorPagination
     # permission_classes = [IsAuthenticated, IsAdminUser | IsSuperUser]
 
     def perform_create(self, serializer):
@@ -978,8 +1138,9 @@ class ProductSKUAttributeListCreateView(generics.ListCreateAPIView):
     Admin: Retrieve all SKU attributes (GET) or create a new SKU attribute (POST).
     User: Retrieve all SKU attributes (GET).
     """
-    queryset = ProductSKUAttribute.objects.all()
+    queryset = ProductSKUAttribute.objects.select_related('attribute_value__type')
     serializer_class = ProductSKUAttributeSerializer
+    pagination_class = IdCursorPagination
     # permission_classes = [IsAuthenticated, IsAdminUser | IsSuperUser]
     
     def get_permissions(self):
@@ -1046,7 +1207,7 @@ class ReviewSectionListCreateView(generics.ListCreateAPIView):
     """
     API view to list and create ReviewSection instances.
     """
-    queryset = ReviewSection.objects.all()
+    queryset = ReviewSection.objects.prefetch_related('texts', 'photos', 'videos')  # One query per item type for the whole page
     serializer_class = ReviewSectionSerializer
     permission_classes = [IsAuthenticated, IsAdminUser | IsSuperUser]
     
@@ -1103,13 +1264,18 @@ class ReviewSectionDetailView(generics.RetrieveUpdateDestroyAPIView):
     ],
     tags=["Review Section Management"]
 )
-class ReviewSectionListByProductView(generics.ListAPIView):
+class ReviewSectionListByProductView(CachedResponseMixin, generics.ListAPIView):
     serializer_class = ReviewSectionDetailSerializer
+    pagination_class = OrderNumCursorPagination
+
+    def get_etag_namespaces(self):
+        return [REVIEWS.format(id=self.kwargs['product_id'])]
 
     def get_queryset(self):
         # Retrieve the product ID from the URL and filter ReviewSection by product
         product_id = self.kwargs.get('product_id')
-        return ReviewSection.objects.filter(product_id=product_id).order_by('order_num')
+        # Items of every section are loaded in one query per type, already ordered by order_num
+        return ReviewSection.objects.filter(product_id=product_id).prefetch_related('texts', 'photos', 'videos')
 
 
 # Admin: List all review texts or create a new review text. Requires authentication and admin/superuser permissions.
@@ -1328,10 +1494,8 @@ class SwapOrderNumView(generics.GenericAPIView):
 
             # Swap the order_num values using a temporary placeholder to avoid conflict
             with transaction.atomic():
-                temp_order_num = max(
-                    ReviewSection.objects.filter(product_id=obj1.product_id)
-                    .values_list('order_num', flat=True)
-                ) + 1
+                # Taken from the product's sequence, no existing or concurrently added section has it
+                temp_order_num = Sequence.allocate(ReviewSection.ORDER_SEQUENCE.format(product_id=obj1.product_id))
 
                 # Step 1: Set obj1's order_num to the temporary value
                 obj1_order_num = obj1.order_num
@@ -1382,26 +1546,19 @@ class SwapOrderNumItemView(generics.GenericAPIView):
         order_num_2 = serializer.validated_data['order_num_2']
 
         with transaction.atomic():
-            # Use a temporary value larger than any existing order_num
-            max_order_num = self._get_max_order_num(review_section_id)
-            temp_order_num = max_order_num + 1
+            # Use a temporary value from the section's sequence, no existing or concurrently added item has it
+            temp_order_num = Sequence.allocate(ReviewText.item_sequence(review_section_id))
 
             # Swap order_num for each model
             self._swap_order(ReviewText, review_section_id, order_num_1, order_num_2, temp_order_num)
             self._swap_order(ReviewPhoto, review_section_id, order_num_1, order_num_2, temp_order_num)
             self._swap_order(ReviewVideo, review_section_id, order_num_1, order_num_2, temp_order_num)
 
-        return Response({"message": "Order numbers swapped successfully."}, status=status.HTTP_200_OK)
+            # Bulk updates skip the model signals, drop the cached review sections of the product here
+            product_id = ReviewSection.objects.filter(pk=review_section_id).values_list('product_id', flat=True).first()
+            invalidate_etags(REVIEWS.format(id=product_id))
 
-    def _get_max_order_num(self, review_section_id):
-        """
-        Get the maximum order_num across all models for the given ReviewSection.
-        """
-        max_text = ReviewText.objects.filter(review_section_id=review_section_id).aggregate(models.Max('order_num'))['order_num__max'] or 0
-        max_photo = ReviewPhoto.objects.filter(review_section_id=review_section_id).aggregate(models.Max('order_num'))['order_num__max'] or 0
-        max_video = ReviewVideo.objects.filter(review_section_id=review_section_id).aggregate(models.Max('order_num'))['order_num__max'] or 0
-
-        return max(max_text, max_photo, max_video)
+        return Response({"message": "Order numbers swapped successfully."}, status=status.HTTP_200_OK)
 
     def _swap_order(self, model, review_section_id, order_num_1, order_num_2, temp_order_num):
         """
@@ -1417,3 +1574,239 @@ class SwapOrderNumItemView(generics.GenericAPIView):
         model.objects.filter(review_section_id=review_section_id, order_num=temp_order_num).update(order_num=order_num_2)
 
 
+# Admin: Move any ordered row (product detail, review section or review item) before or after another one
+@extend_schema(
+    methods=["POST"],
+    summary="Move an ordered item",
+    description=(
+        "Move a product detail, review section or review item right before or right after another row of the same "
+        "product or review section. Review items can be placed next to items of another type. "
+        "Only the moved row is renumbered."
+    ),
+    request=OrderingMoveSerializer,
+    tags=["Ordering"],
+)
+class OrderingMoveView(generics.GenericAPIView):
+    permission_classes = [IsAuthenticated, IsAdminUser | IsSuperUser]
+    serializer_class = OrderingMoveSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        if 'before' in data:
+            order_num = move(data['item'], before=data['target'])
+        else:
+            order_num = move(data['item'], after=data['target'])
+        return Response({"model": data['model'], "id": data['item'].pk, "order_num": order_num}, status=status.HTTP_200_OK)
+
+
+# Admin: Bulk import products, details, SKUs and SKU attribute values from a CSV or JSONL file
+@extend_schema(
+    methods=["POST"],
+    summary="Import catalog file",
+    description=(
+        "Import a CSV or JSONL file with one SKU per row, grouped into products by their `product` reference "
+        "(see catalog/importer.py for the columns). Rows are validated and written in chunks, "
+        "invalid rows are skipped and reported with their line number. A file that isn't UTF-8 or valid CSV "
+        "is rejected with the line it failed at, before anything is imported."
+    ),
+    request={'multipart/form-data': CatalogImportSerializer},
+    tags=["Admin Products"],
+)
+class CatalogImportView(generics.GenericAPIView):
+    permission_classes = [IsAuthenticated, IsAdminUser | IsSuperUser]
+    serializer_class = CatalogImportSerializer
+    parser_classes = (MultiPartParser, FormParser)
+
+    # Errors listed in the response, the count covers all of them
+    max_reported_errors = 1000
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        # Read from the uploaded file as it is parsed, without loading it into memory
+        importer = CatalogImporter(batch_size=data['batch_size'])
+        try:
+            check_file(data['file'], data['format'])
+        except ImportFileError as e:
+            importer.result.errors.append((e.line_num, str(e)))
+            return Response(importer.result.as_dict(), status=status.HTTP_400_BAD_REQUEST)
+        result = importer.run(read_rows(decode_lines(data['file']), data['format']))
+        return Response(result.as_dict(max_errors=self.max_reported_errors), status=status.HTTP_200_OK)
+
+
+# Admin: Download the whole catalog, one row per SKU, in the import format
+@extend_schema(
+    methods=["GET"],
+    summary="Export catalog",
+    description=(
+        "Stream every product with its details, SKUs and SKU attribute values as CSV or JSONL, one row per SKU, "
+        "in the format accepted by the catalog import. Optionally gzipped."
+    ),
+    parameters=[ExportSerializer],
+    responses={(200, 'application/octet-stream'): OpenApiTypes.BINARY},
+    tags=["Admin Products"],
+)
+class CatalogExportView(generics.GenericAPIView):
+    permission_classes = [IsAuthenticated, IsAdminUser | IsSuperUser]
+    serializer_class = ExportSerializer
+
+    def get(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        file_format, compress = serializer.validated_data['file_format'], serializer.validated_data['gzip']
+        return export_response(catalog_rows(file_format), CATALOG_FIELDS, file_format, 'catalog', compress)
+
+
+# Admin: Create a SKU for every combination of the given attribute values
+@extend_schema(
+    methods=["POST"],
+    summary="Generate SKU matrix",
+    description=(
+        "Create a SKU of the product for every combination of one value per attribute type (e.g. sizes x colors), "
+        "with the given price, quantity and status. Combinations an existing SKU already has are skipped."
+    ),
+    request=SKUMatrixSerializer,
+    responses={201: ProductSKUSerializer(many=True)},
+    tags=["Product SKU Management"],
+)
+class ProductSKUMatrixView(generics.GenericAPIView):
+    queryset = Product.objects.all()
+    serializer_class = SKUMatrixSerializer
+    permission_classes = [IsAuthenticated, IsAdminUser | IsSuperUser]
+
+    def post(self, request, *args, **kwargs):
+        product = self.get_object()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        try:
+            skus, skipped = create_sku_matrix(
+                product.pk, data['attribute_values'], price=data['price'], quantity=data['quantity'], is_active=data['is_active'],
+            )
+        except IntegrityError:
+            # A code stored without going through ProductSKU.reserve_codes()
+            raise serializers.ValidationError("A generated SKU code is already taken by an existing SKU.")
+        created = ProductSKU.objects.filter(pk__in=[sku.pk for sku in skus]).order_by('id').prefetch_related('sku_attributes__attribute_value__type')
+        return Response(
+            {'created': len(skus), 'skipped': skipped, 'skus': ProductSKUSerializer(created, many=True).data},
+            status=status.HTTP_201_CREATED,
+        )
+
+
+# Start a chunked video upload, review videos for any signed-in user and the others for admins
+@extend_schema(
+    methods=["POST"],
+    summary="Start chunked upload",
+    description=(
+        "Start uploading a product, brand or review video in chunks. Send the chunks to the returned upload with "
+        "PUT, then complete it to create the video. Any signed-in user can upload a review video, product and brand "
+        "videos are for admins."
+    ),
+    request=ChunkedUploadSerializer,
+    responses={201: ChunkedUploadSerializer},
+    tags=["Chunked Uploads"],
+)
+class ChunkedUploadCreateView(generics.CreateAPIView):
+    serializer_class = ChunkedUploadSerializer
+    permission_classes = [IsAuthenticated]
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user).create_file()
+
+
+# Check, fill or abandon one of the user's chunked uploads
+@extend_schema(
+    methods=["GET"],
+    summary="Chunked upload status",
+    description="Bytes received so far, the offset to resume an interrupted upload from.",
+    tags=["Chunked Uploads"],
+)
+@extend_schema(
+    methods=["PUT"],
+    summary="Upload chunk",
+    description=(
+        f"Write the raw request body (application/octet-stream, at most {MAX_CHUNK_SIZE // (1024 * 1024)} MB) at "
+        "`offset`. A chunk can be sent again, but can't start past the bytes received so far."
+    ),
+    parameters=[OpenApiParameter('offset', OpenApiTypes.INT, OpenApiParameter.QUERY, required=True, description="Byte the chunk starts at.")],
+    request={'application/octet-stream': OpenApiTypes.BINARY},
+    responses={200: ChunkedUploadSerializer},
+    tags=["Chunked Uploads"],
+)
+@extend_schema(
+    methods=["DELETE"],
+    summary="Cancel chunked upload",
+    description="Delete the upload and the bytes received.",
+    tags=["Chunked Uploads"],
+)
+class ChunkedUploadDetailView(generics.GenericAPIView):
+    serializer_class = ChunkedUploadSerializer
+    permission_classes = [IsAuthenticated]
+    parser_classes = [ChunkParser]
+
+    def get_queryset(self):
+        return ChunkedUpload.objects.filter(user=self.request.user)
+
+    def get(self, request, *args, **kwargs):
+        return Response(self.get_serializer(self.get_object()).data)
+
+    def put(self, request, *args, **kwargs):
+        upload = self.get_object()
+        try:
+            offset = int(request.query_params['offset'])
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except (KeyError, ValueError):
+            raise serializers.ValidationError({'offset': "A byte offset is required."})
+        if offset < 0 or not 0 < length <= MAX_CHUNK_SIZE:
+            raise serializers.ValidationError(f"Chunks must start at a byte offset and hold 1 byte to {MAX_CHUNK_SIZE} bytes.")
+        try:
+            upload.write(offset, request.stream, length)
+        except DjangoValidationError as e:
+            raise serializers.ValidationError(e.messages)
+        return Response(self.get_serializer(upload).data)
+
+    def delete(self, request, *args, **kwargs):
+        self.get_object().discard()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+# Attach a finished chunked upload to a new product, brand or review video
+@extend_schema(
+    methods=["POST"],
+    summary="Complete chunked upload",
+    description=(
+        "Create the video the upload was started for from the received file, with the other fields of that video "
+        "(`product` and `alt` for a product video, `brand` and `alt` for a brand video, `review_section` for a review video). "
+        "The file is moved into place, not copied."
+    ),
+    request=OpenApiTypes.OBJECT,
+    responses={201: OpenApiTypes.OBJECT},
+    tags=["Chunked Uploads"],
+)
+class ChunkedUploadCompleteView(generics.GenericAPIView):
+    serializer_class = ChunkedUploadSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return ChunkedUpload.objects.filter(user=self.request.user)
+
+    def post(self, request, *args, **kwargs):
+        upload = self.get_object()
+        if not upload.is_complete:
+            raise serializers.ValidationError(f"Only {upload.offset} of {upload.size} bytes were received.")
+
+        data = request.data.copy()
+        with open(upload.path, 'rb') as file:
+            data['video'] = StagedFile(file, name=upload.filename)
+            serializer = CHUNKED_UPLOAD_TARGETS[upload.target](data=data, context=self.get_serializer_context())
+            serializer.is_valid(raise_exception=True)
+            with transaction.atomic():
+                serializer.save()
+                upload.delete()
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
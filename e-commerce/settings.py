@@ -45,6 +45,7 @@ INSTALLED_APPS = [
     'catalog.apps.CatalogConfig',
     'orders.apps.OrdersConfig',
     'payments.apps.PaymentsConfig',
+    'tasks.apps.TasksConfig',
     # third party apps
     'drf_spectacular',
     'rest_framework',
@@ -66,6 +67,7 @@ ZARINPAL_REQUEST_URL = os.getenv('ZARINPAL_REQUEST_URL')
 ZARINPAL_STARTPAY_URL = os.getenv('ZARINPAL_STARTPAY_URL')
 ZARINPAL_CALLBACK_URL = os.getenv('ZARINPAL_CALLBACK_URL')
 ZARINPAL_VERIFY_URL = os.getenv('ZARINPAL_VERIFY_URL')
+ZARINPAL_TIMEOUT = int(os.getenv('ZARINPAL_TIMEOUT', 10))  # Seconds before a gateway call is given up
 
 # Iranian Cities Set
 IRANIAN_CITIES_ADMIN_ADD_READONLY_ENABLED = True
@@ -91,6 +93,8 @@ REST_FRAMEWORK = {
         'rest_framework.parsers.MultiPartParser', 
         'rest_framework.parsers.FormParser'
     ],
+    # Lists are paginated by keyset unless a view sets its own pagination_class (None for a whole response)
+    'DEFAULT_PAGINATION_CLASS': 'catalog.pagination.IdCursorPagination',
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
     'EXCEPTION_HANDLER': 'rest_framework.views.exception_handler',
     'NON_FIELD_ERRORS_KEY': 'error',
@@ -102,10 +106,12 @@ SPECTACULAR_SETTINGS = {
     'DESCRIPTION': 'This is the API for my ecommerce platform.',
     'VERSION': '1.0.0',
     'SERVE_INCLUDE_SCHEMA': False,
-    # 'ENUM_NAME_OVERRIDES': {
-    #     'orders.models.OrderDetails.status': 'OrderStatus',
-    #     'payments.models.PaymentDetails.status': 'PaymentStatus',
-    # },
+    'ENUM_NAME_OVERRIDES': {
+        # 'orders.models.OrderDetails.status': 'OrderStatus',
+        # 'payments.models.PaymentDetails.status': 'PaymentStatus',
+        'OrderedModelEnum': 'catalog.ordering.ORDERED_MODEL_CHOICES',
+        'TaskStatusEnum': 'tasks.models.Task.STATUS_CHOICES',
+    },
     # 'COMPONENT_SPLIT_REQUEST': True,
     # 'COMPONENT_SPLIT_PATCH': True,
 }
@@ -164,7 +170,6 @@ DATABASES = {
     }
 }
 
-
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -213,6 +218,21 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # media saved here
 MEDIA_URL = os.getenv('MEDIA_URL')
 MEDIA_ROOT = os.path.join(BASE_DIR, os.getenv('MEDIA_ROOT'))
+# Media URLs carry a fingerprint of the file and are served by catalog.media.serve_media (see catalog/media.py)
+STORAGES = {
+    'default': {'BACKEND': 'catalog.media.MediaStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+# 'nginx' hands media files to the front proxy with X-Accel-Redirect to MEDIA_ACCEL_PREFIX (an internal location),
+# 'sendfile' with X-Sendfile. Required when DEBUG is off; empty sends them from Django, in development only
+MEDIA_ACCEL = os.getenv('MEDIA_ACCEL', '')
+MEDIA_ACCEL_PREFIX = os.getenv('MEDIA_ACCEL_PREFIX', '/protected-media/')
+# Caching of media requested without the current fingerprint, versioned URLs are cached for a year
+MEDIA_CACHE_MAX_AGE = int(os.getenv('MEDIA_CACHE_MAX_AGE', 3600))
+# Chunked uploads are staged here, on the media file system so finished files are moved into place rather than copied
+CHUNKED_UPLOAD_ROOT = os.path.join(MEDIA_ROOT, os.getenv('CHUNKED_UPLOAD_DIR', 'chunked_uploads'))
+# Processes resizing images in generate_image_variants (catalog/images.py), 0 resizes them in the command's process
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))
 
 # Email Settings
 EMAIL_BACKEND = os.getenv('EMAIL_BACKEND')
@@ -227,5 +247,26 @@ REDIS_HOST = os.getenv('REDIS_HOST', 'localhost')
 REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
 REDIS_DB = int(os.getenv('REDIS_DB', 0))
 
+# Background tasks (tasks app), run by `manage.py task_worker`. 'redis' wakes workers up through the Redis above,
+# 'database' has them poll the task table only
+TASK_BROKER = os.getenv('TASK_BROKER', 'redis')
+TASK_WORKERS = int(os.getenv('TASK_WORKERS', 2))
+TASK_HEARTBEAT_TIMEOUT = int(os.getenv('TASK_HEARTBEAT_TIMEOUT', 300))  # Seconds without a heartbeat after which a running task's worker is considered dead
+TASKS_EAGER = os.getenv('TASKS_EAGER', 'False') == 'True'  # Run tasks when queued, without workers
+
+# Cache Settings, backed by the Redis instance above (set CACHE_BACKEND to use another Django cache backend)
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django_redis.cache.RedisCache'),
+        'LOCATION': f'redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}',
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            'SOCKET_CONNECT_TIMEOUT': 2,
+            'SOCKET_TIMEOUT': 2,
+            'IGNORE_EXCEPTIONS': True,  # A cache outage falls back to the database instead of failing requests
+        },
+    }
+}
+
 # CORS Settings
 CORS_ALLOWED_ORIGINS = os.getenv('CORS_ALLOWED_ORIGINS', '').split(',')
@@ -18,8 +18,9 @@ from django.contrib import admin
 from django.urls import path, include, re_path
 from rest_framework import permissions
 from drf_spectacular.views import SpectacularAPIView, SpectacularRedocView, SpectacularSwaggerView
+import re
 from django.conf import settings
-from django.conf.urls.static import static
+from catalog.media import serve_media
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -35,7 +36,11 @@ urlpatterns = [
     path('api/catalog/', include('catalog.urls')),
     path('api/orders/', include('orders.urls')),
     path('api/payments/', include('payments.urls')),
+    path('api/tasks/', include('tasks.urls')),
 ]
 
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+# Uploaded media, in production too: Django checks the request and the front proxy (MEDIA_ACCEL) sends the file
+if settings.MEDIA_URL.startswith('/'):
+    urlpatterns += [
+        re_path(r'^%s(?P<path>.+)$' % re.escape(settings.MEDIA_URL.lstrip('/')), serve_media, name='media'),
+    ]
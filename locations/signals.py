@@ -0,0 +1,16 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from iranian_cities.models import Ostan, Shahrestan
+from catalog.conditional import invalidate_etags
+
+# ETag namespace of the provinces with cities response
+PROVINCES = 'provinces'
+
+
+@receiver(post_save, sender=Ostan)
+@receiver(post_delete, sender=Ostan)
+@receiver(post_save, sender=Shahrestan)
+@receiver(post_delete, sender=Shahrestan)
+def invalidate_province_etags(sender, raw=False, **kwargs):
+    if not raw:
+        invalidate_etags(PROVINCES)
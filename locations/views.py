@@ -9,11 +9,15 @@ from accounts.models import User
 from iranian_cities.models import Ostan, Shahrestan
 from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from accounts.manager import IsSuperUser, IsRegularUser
+from catalog.conditional import ConditionalGetMixin
+from .signals import PROVINCES
 # IsAdminUser => isStaff
 
-class ProvinceWithCitiesView(ListAPIView):
+class ProvinceWithCitiesView(ConditionalGetMixin, ListAPIView):
     queryset = Ostan.objects.all()
     serializer_class = ProvinceWithCitiesSerializer
+    pagination_class = None  # A short reference list, read whole for address forms
+    etag_namespaces = [PROVINCES]
 
 
 class AddressListCreateView(ListCreateAPIView):
@@ -0,0 +1,18 @@
+from catalog.export import CHUNK_SIZE
+from .models import OrderDetails
+
+# One row per order item, orders without items get a single row with empty item columns
+ORDER_FIELDS = [
+    'order', 'created_at', 'status', 'user', 'total', 'payment_status', 'payment_ref_id',
+    'product', 'product_name', 'sku', 'quantity', 'price',
+]
+
+
+def order_rows(chunk_size=CHUNK_SIZE):
+    """The order history as flat rows, read with one joined query in chunks of `chunk_size` rows."""
+    rows = OrderDetails.objects.order_by('id', 'items__id').values_list(
+        'id', 'created_at', 'status', 'user__username', 'total', 'payment__status', 'payment__ref_id',
+        'items__product_id', 'items__product__name', 'items__product_sku__sku', 'items__quantity', 'items__price',
+    )
+    for values in rows.iterator(chunk_size=chunk_size):
+        yield {field: value for field, value in zip(ORDER_FIELDS, values) if value is not None}
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from catalog.export import CHUNK_SIZE, EXPORT_FORMATS, export_stream, write_export
+from orders.export import ORDER_FIELDS, order_rows
+
+
+class Command(BaseCommand):
+    help = "Export the order history, one row per order item, for accounting."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help="File to write, standard output by default.")
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv', help="File format.")
+        parser.add_argument('--gzip', action='store_true', help="Compress the output.")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="Rows read from the database at a time.")
+
+    def handle(self, *args, **options):
+        rows = order_rows(chunk_size=options['chunk_size'])
+        write_export(export_stream(rows, ORDER_FIELDS, options['format'], options['gzip']), options['path'])
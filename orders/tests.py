@@ -1,3 +1,42 @@
 from django.test import TestCase
+from django.urls import reverse
+from iranian_cities.models import Ostan, Shahrestan
+from rest_framework import status
+from rest_framework.test import APIClient
+from accounts.models import User
+from catalog.models import Category, Product, ProductSKU
+from locations.models import Address
+from .models import OrderDetails, OrderItem
 
-# Create your tests here.
+
+class AdminOrderExportTest(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(
+            username='admin', phone_number='1234567890', first_name='Admin', last_name='User', password='TestPassword123!',
+        )
+        province = Ostan.objects.create(name='Tehran', amar_code=1)
+        city = Shahrestan.objects.create(ostan=province, name='Tehran', amar_code=1)
+        address = Address.objects.create(user=self.admin, province=province, city=city)
+        product = Product.objects.create(name='Runner', description='', summary='', category=Category.objects.create(name='Shoes'))
+        sku = ProductSKU.objects.create(sku='R-1', product=product, price=100, quantity=5)
+
+        self.order = OrderDetails.objects.create(user=self.admin, address=address, total=300)
+        OrderItem.objects.create(order=self.order, product=product, product_sku=sku, quantity=3, price=100)
+        self.empty_order = OrderDetails.objects.create(user=self.admin, address=address)
+
+    # Test orders are streamed one row per item, orders without items on a row of their own
+    def test_export_csv(self):
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        response = client.get(reverse('admin-order-export'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+
+        self.assertEqual(len(lines), 3)
+        order = lines[1].split(',')
+        self.assertEqual([order[0], order[2], order[3], order[9], order[10], order[11]], [str(self.order.pk), 'pending', 'admin', 'R-1', '3', '100'])
+        self.assertEqual(lines[2].split(',')[0], str(self.empty_order.pk))
+
+    # Test only admins can export
+    def test_export_requires_admin(self):
+        self.assertEqual(APIClient().get(reverse('admin-order-export')).status_code, status.HTTP_401_UNAUTHORIZED)
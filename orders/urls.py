@@ -27,6 +27,9 @@ urlpatterns = [
     # Admin: Retrieve a list of all orders (GET)
     path('admin/orders/', AdminOrderListView.as_view(), name='admin-order-list'),
 
+    # Admin: Download all orders as CSV or JSONL, streamed (GET)
+    path('admin/orders/export/', AdminOrderExportView.as_view(), name='admin-order-export'),
+
     # Admin: Retrieve (GET), update (PUT, PATCH), or delete (DELETE) a specific order by ID
     path('admin/orders/<int:pk>/', AdminOrderDetailView.as_view(), name='admin-order-detail'),
 
@@ -1,10 +1,22 @@
 from rest_framework import generics
+from django.db.models import Prefetch
 from rest_framework.response import Response
 from rest_framework.exceptions import PermissionDenied, ValidationError
 from rest_framework.permissions import IsAdminUser, IsAuthenticated, AllowAny
 from drf_spectacular.utils import extend_schema, extend_schema_field, OpenApiParameter
 from .serializers import *
 from accounts.manager import IsSuperUser  # custom permission
+from drf_spectacular.types import OpenApiTypes
+from catalog.export import export_response
+from catalog.serializers import ExportSerializer
+from .export import ORDER_FIELDS, order_rows
+
+# Products are rendered with their category and denormalized SKU summary, join both instead of querying per row
+WISHLIST_RELATED = ('user', 'product__category', 'product__sku_summary')
+ORDER_ITEMS_PREFETCH = Prefetch(
+    'items',
+    queryset=OrderItem.objects.select_related('product__category', 'product__sku_summary', 'product_sku'),
+)
 
 @extend_schema(
     methods=['GET'],
@@ -29,7 +41,7 @@ class AuthenticatedUserWishlistListView(generics.ListCreateAPIView):
 
     def get_queryset(self):
         # Ensure only the user's own wishlist is visible
-        return Wishlist.objects.filter(user=self.request.user)
+        return Wishlist.objects.filter(user=self.request.user).select_related(*WISHLIST_RELATED)
 
     def perform_create(self, serializer):
         # Automatically associate the current user with the new wishlist
@@ -57,7 +69,7 @@ class AuthenticatedUserWishlistDetailView(generics.RetrieveDestroyAPIView):
 
     def get_queryset(self):
         # Ensure only the user's own wishlist is accessible
-        return Wishlist.objects.filter(user=self.request.user)
+        return Wishlist.objects.filter(user=self.request.user).select_related(*WISHLIST_RELATED)
 
     def delete(self, request, *args, **kwargs):
         # Optional: Ensure users can only delete their own wishlist
@@ -78,7 +90,7 @@ class AdminWishlistListView(generics.ListAPIView):
     Admin view for listing all wishlists.
     Accessible only to admin or superuser.
     """
-    queryset = Wishlist.objects.all()
+    queryset = Wishlist.objects.select_related(*WISHLIST_RELATED)
     serializer_class = WishlistDetailSerializer
     permission_classes = [IsAuthenticated, IsAdminUser]
 
@@ -196,7 +208,31 @@ class AdminOrderListView(generics.ListAPIView):
     """
     serializer_class = AdminOrderDetailsSerializer
     permission_classes = [IsAuthenticated, IsAdminUser]
-    queryset = OrderDetails.objects.all()
+    queryset = OrderDetails.objects.prefetch_related(ORDER_ITEMS_PREFETCH)
+
+
+# Admin: Download the order history
+@extend_schema(
+    methods=['GET'],
+    summary="Export Orders",
+    description="Stream all orders as CSV or JSONL, one row per order item, optionally gzipped. Accessible to admin users only.",
+    parameters=[ExportSerializer],
+    responses={(200, 'application/octet-stream'): OpenApiTypes.BINARY},
+    tags=["Orders (Admin)"]
+)
+class AdminOrderExportView(generics.GenericAPIView):
+    """
+    Admin Access:
+    - GET: Download every order item with its order, user and payment status.
+    """
+    serializer_class = ExportSerializer
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        file_format, compress = serializer.validated_data['file_format'], serializer.validated_data['gzip']
+        return export_response(order_rows(), ORDER_FIELDS, file_format, 'orders', compress)
 
 
 # Admin: Retrieve, update, and delete specific order
@@ -228,7 +264,7 @@ class AdminOrderDetailView(generics.RetrieveUpdateDestroyAPIView):
     """
     serializer_class = AdminOrderDetailsSerializer
     permission_classes = [IsAuthenticated, IsAdminUser]
-    queryset = OrderDetails.objects.all()
+    queryset = OrderDetails.objects.prefetch_related(ORDER_ITEMS_PREFETCH)
 
 
 # Admin: Retrieve, update, and delete specific order item
@@ -290,7 +326,7 @@ class UserOrderListCreateView(generics.ListCreateAPIView):
         """
         Return orders belonging to the authenticated user.
         """
-        return OrderDetails.objects.filter(user=self.request.user)
+        return OrderDetails.objects.filter(user=self.request.user).prefetch_related(ORDER_ITEMS_PREFETCH)
 
     def perform_create(self, serializer):
         """
@@ -321,7 +357,7 @@ class UserOrderDetailView(generics.RetrieveAPIView):
         """
         Ensure the user can only retrieve their own orders.
         """
-        return OrderDetails.objects.filter(user=self.request.user)
+        return OrderDetails.objects.filter(user=self.request.user).prefetch_related(ORDER_ITEMS_PREFETCH)
 
 
 # User: List all items in a specific order
@@ -344,6 +380,8 @@ class UserOrderItemListView(generics.ListAPIView):
         Return order items for the authenticated user's specific order.
         """
         order_id = self.kwargs.get('order_id')
-        return OrderItem.objects.filter(order__id=order_id, order__user=self.request.user)
+        return OrderItem.objects.filter(order__id=order_id, order__user=self.request.user).select_related(
+            'product__category', 'product__sku_summary', 'product_sku'
+        )
 
 
@@ -0,0 +1,59 @@
+import requests
+from django.conf import settings
+from django.db import transaction
+from tasks.base import task
+from tasks.tasks import send_email
+from .models import PaymentDetails
+
+# Zarinpal codes of a verified payment: verified now, or by an earlier call
+VERIFIED_CODES = (100, 101)
+
+
+@task(max_retries=5, retry_backoff=15, retry_for=(requests.RequestException,))
+def verify_payment(payment_id):
+    """
+    Verify a pending payment with Zarinpal after its callback, then deduct the ordered stock and email a receipt.
+    Retried while the gateway is unreachable. The payment row stays locked during the call, so a repeated
+    callback can't verify it and deduct the stock twice.
+    """
+    with transaction.atomic():
+        payment = PaymentDetails.objects.select_for_update(of=('self',)).select_related('order', 'user').get(pk=payment_id)
+        if payment.status != 'pending':
+            return {'status': payment.status}
+
+        data = {
+            'merchant_id': settings.ZARINPAL_MERCHANT_ID,
+            'amount': int(float(payment.amount)),
+            'authority': payment.authority,
+        }
+        response = requests.post(settings.ZARINPAL_VERIFY_URL, json=data, timeout=settings.ZARINPAL_TIMEOUT)
+        response_data = response.json().get('data') or {}  # An empty list when the gateway reports errors
+
+        # 101 answers a retry after a response lost on the way back: the payment went through
+        if response_data.get('code') not in VERIFIED_CODES or not response_data.get('ref_id'):
+            payment.status = 'failed'
+            payment.save()
+            return {'status': 'failed', 'details': response_data.get('message', 'Unknown error')}
+
+        payment.status = 'successful'
+        payment.ref_id = response_data['ref_id']
+        payment.save()
+
+        # Update the product quantities for the associated order
+        insufficient = []
+        if payment.order:
+            for item in payment.order.items.select_related('product_sku'):
+                sku = item.product_sku
+                if sku.quantity >= item.quantity:  # Check stock availability
+                    sku.quantity -= item.quantity  # Deduct ordered quantity
+                    sku.save()
+                else:
+                    insufficient.append(sku.sku)
+
+    if payment.user.email:
+        send_email.delay(
+            f"Payment received for order {payment.order_id}",
+            f"We received your payment of {payment.amount} Tomans. Reference: {payment.ref_id}.",
+            [payment.user.email],
+        )
+    return {'status': 'successful', 'ref_id': payment.ref_id, 'insufficient_stock': insufficient}
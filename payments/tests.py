@@ -1,3 +1,106 @@
-from django.test import TestCase
+from io import StringIO
+from unittest import mock
+import requests
+from django.core import mail
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from iranian_cities.models import Ostan, Shahrestan
+from rest_framework import status
+from rest_framework.test import APIClient
+from accounts.models import User
+from catalog.models import Category, Product, ProductSKU
+from locations.models import Address
+from orders.models import OrderDetails, OrderItem
+from tasks.models import Task
+from .models import PaymentDetails
 
-# Create your tests here.
+
+def gateway_response(data):
+    response = mock.Mock()
+    response.json.return_value = {'data': data}
+    return response
+
+
+@override_settings(TASKS_EAGER=False, TASK_BROKER='database')
+class PaymentVerifyTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='customer', password='TestPassword123!')
+        User.objects.filter(pk=self.user.pk).update(email='customer@example.com')  # create_user() keeps only the username
+        province = Ostan.objects.create(name='Tehran', amar_code=1)
+        city = Shahrestan.objects.create(ostan=province, name='Tehran', amar_code=1)
+        address = Address.objects.create(user=self.user, province=province, city=city)
+        product = Product.objects.create(name='Runner', description='', summary='', category=Category.objects.create(name='Shoes'))
+        self.sku = ProductSKU.objects.create(sku='R-1', product=product, price=100, quantity=5)
+        order = OrderDetails.objects.create(user=self.user, address=address, total=300)
+        OrderItem.objects.create(order=order, product=product, product_sku=self.sku, quantity=3, price=100)
+        self.payment = PaymentDetails.objects.create(user=self.user, order=order, amount=300, authority='A1')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def verify(self):
+        return self.client.get(reverse('payment-verify'), {'Authority': 'A1'})
+
+    # Test the callback only queues the verification, which the worker completes
+    def test_verification_runs_in_background(self):
+        with mock.patch('payments.tasks.requests.post') as post:
+            response = self.verify()
+            self.assertEqual((response.status_code, response.data['status']), (status.HTTP_202_ACCEPTED, 'pending'))
+            post.assert_not_called()
+
+            post.return_value = gateway_response({'code': 100, 'ref_id': 123456, 'message': 'Verified'})
+            with self.settings(TASKS_EAGER=True):
+                Task.objects.all().delete()
+                response = self.verify()
+
+        self.assertEqual((response.status_code, response.data['status']), (status.HTTP_200_OK, 'successful'))
+        self.assertEqual(post.call_args.kwargs['timeout'], 10)
+        self.sku.refresh_from_db()
+        self.assertEqual(self.sku.quantity, 2)
+        self.assertEqual(mail.outbox[0].to, ['customer@example.com'])
+
+    # Test an unreachable gateway is retried instead of failing the payment
+    @override_settings(TASKS_EAGER=True)
+    def test_gateway_error_retried(self):
+        with mock.patch('payments.tasks.requests.post', side_effect=requests.ConnectionError("Timed out")):
+            response = self.verify()
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        task = Task.objects.get()
+        self.assertEqual((task.status, task.attempts, task.max_retries), ('queued', 1, 5))
+        self.sku.refresh_from_db()
+        self.assertEqual(self.sku.quantity, 5)
+
+    # Test a verified payment isn't verified, nor its stock deducted, again
+    @override_settings(TASKS_EAGER=True)
+    def test_verified_payment_not_repeated(self):
+        PaymentDetails.objects.filter(pk=self.payment.pk).update(status='successful')
+        with mock.patch('payments.tasks.requests.post') as post:
+            response = self.verify()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        post.assert_not_called()
+        self.assertFalse(Task.objects.exists())
+
+    # Test a retry after a lost response, answered "already verified", completes the payment
+    @override_settings(TASKS_EAGER=True)
+    def test_already_verified_is_successful(self):
+        responses = [requests.ReadTimeout("Timed out"), gateway_response({'code': 101, 'ref_id': 123456, 'message': 'Verified'})]
+        with mock.patch('payments.tasks.requests.post', side_effect=responses):
+            self.verify()
+            Task.objects.update(run_at=timezone.now())
+            call_command('task_worker', '--burst', stdout=StringIO())
+
+        self.payment.refresh_from_db()
+        self.assertEqual((self.payment.status, self.payment.ref_id), ('successful', '123456'))
+        self.sku.refresh_from_db()
+        self.assertEqual(self.sku.quantity, 2)
+
+    # Test a malformed gateway reply fails the payment instead of leaving it pending
+    @override_settings(TASKS_EAGER=True)
+    def test_malformed_reply_fails(self):
+        with mock.patch('payments.tasks.requests.post', return_value=gateway_response([])):
+            response = self.verify()
+
+        self.assertEqual((response.status_code, response.data['status']), (status.HTTP_200_OK, 'failed'))
+        self.assertEqual(Task.objects.get().status, 'succeeded')
@@ -7,6 +7,7 @@ from django.conf import settings
 from .models import PaymentDetails
 from orders.models import OrderDetails
 from .serializers import PaymentDetailsSerializer
+from .tasks import verify_payment
 import requests
 from rest_framework import status, serializers
 
@@ -67,7 +68,7 @@ class PaymentRequestView(APIView):
             'callback_url': settings.ZARINPAL_CALLBACK_URL,
         }
         try:
-            response = requests.post(settings.ZARINPAL_REQUEST_URL, json=data)
+            response = requests.post(settings.ZARINPAL_REQUEST_URL, json=data, timeout=settings.ZARINPAL_TIMEOUT)
             response_data = response.json()
 
             if response_data.get('data', {}).get('code') == 100:
@@ -87,12 +88,17 @@ class PaymentRequestView(APIView):
 @extend_schema(
     methods=["GET"],
     summary="Verify Payment",
-    description="Verify the status of a payment after a callback from Zarinpal. The authority parameter is required.",
+    description=(
+        "Start verifying a payment after a callback from Zarinpal. The authority parameter is required. "
+        "Verification runs in the background and answers 202 while the payment is pending: poll the payment "
+        "until its status is successful or failed."
+    ),
+    responses={200: PaymentDetailsSerializer, 202: PaymentDetailsSerializer},
     tags=["Payments"]
 )
 class PaymentVerifyView(RetrieveAPIView):
     """
-    Verify the payment status after Zarinpal callback.
+    Queue the verification of the payment after Zarinpal callback.
     """
     queryset = PaymentDetails.objects.all()
     serializer_class = PaymentDetailsSerializer
@@ -106,50 +112,13 @@ class PaymentVerifyView(RetrieveAPIView):
         if not payment:
             return Response({'error': 'Payment not found'}, status=status.HTTP_404_NOT_FOUND)
 
-        # Prepare data for Zarinpal verification
-        data = {
-            'merchant_id': settings.ZARINPAL_MERCHANT_ID,
-            'amount': int(float(payment.amount)),
-            'authority': authority,
-        }
-        try:
-            response = requests.post(settings.ZARINPAL_VERIFY_URL, json=data)
-            response_data = response.json()
-
-            # Handle the response from Zarinpal
-            if response_data.get('data', {}).get('code') == 100:
-                payment.status = 'successful'
-                payment.ref_id = response_data['data']['ref_id']
-                payment.save()
-                
-                # Update the product quantities for the associated order
-                order = payment.order
-                if order:
-                    order_items = order.items.all()
-                    for item in order_items:
-                        sku = item.product_sku
-                        if sku.quantity >= item.quantity:  # Check stock availability
-                            sku.quantity -= item.quantity  # Deduct ordered quantity
-                            sku.save()
-                        else:
-                            return Response({
-                                'error': f"Insufficient stock for {sku.sku}",
-                                'available_quantity': sku.quantity,
-                            }, status=status.HTTP_400_BAD_REQUEST)
-                
-                return Response(self.serializer_class(payment).data, status=status.HTTP_200_OK)
-            else:
-                payment.status = 'failed'
-                payment.save()
-                return Response({
-                    'error': 'Payment verification failed',
-                    'details': response_data.get('data', {}).get('message', 'Unknown error'),
-                }, status=status.HTTP_400_BAD_REQUEST)
-
-        except requests.RequestException as e:
-            return Response({'error': 'Failed to connect to payment gateway', 'details': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
-        except KeyError:
-            return Response({'error': 'Unexpected response from payment gateway'}, status=status.HTTP_502_BAD_GATEWAY)
+        if payment.status != 'pending':
+            return Response(self.serializer_class(payment).data, status=status.HTTP_200_OK)
+        # The gateway call, stock update and receipt email run in a task worker, with retries
+        verify_payment.delay(payment.pk)
+        payment.refresh_from_db()  # Already verified when tasks run eagerly
+        code = status.HTTP_202_ACCEPTED if payment.status == 'pending' else status.HTTP_200_OK
+        return Response(self.serializer_class(payment).data, status=code)
 
 
 @extend_schema(
@@ -0,0 +1,11 @@
+from django.contrib import admin
+from .models import Task
+
+
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ['name', 'status', 'attempts', 'run_at', 'created_at', 'finished_at']
+    list_filter = ['status', 'name']
+    readonly_fields = ['created_at', 'started_at', 'heartbeat_at', 'finished_at']
+
+
+admin.site.register(Task, TaskAdmin)
@@ -0,0 +1,66 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+# Registered task functions by name, filled by the @task decorators of the apps' tasks.py modules
+REGISTRY = {}
+
+
+class TaskFunction:
+    """
+    A function run by the workers. Calling it runs it right away; delay() and schedule() queue it instead, with
+    JSON serializable arguments, and return its Task row to follow its status and result.
+    """
+
+    def __init__(self, function, name, max_retries, retry_backoff, retry_for):
+        self.function = function
+        self.name = name
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.retry_for = retry_for
+        self.__doc__ = function.__doc__
+
+    def __call__(self, *args, **kwargs):
+        return self.function(*args, **kwargs)
+
+    def delay(self, *args, **kwargs):
+        return self.schedule(None, *args, **kwargs)
+
+    def schedule(self, when, *args, **kwargs):
+        """Queue the task to run at `when`, a datetime or a delay (timedelta or seconds); None runs it as soon as possible."""
+        from .brokers import get_broker
+        from .models import Task
+        from .worker import execute
+
+        if isinstance(when, (int, float)):
+            when = timedelta(seconds=when)
+        if isinstance(when, timedelta):
+            when = timezone.now() + when
+        task = Task.objects.create(
+            name=self.name, args=list(args), kwargs=kwargs, run_at=when or timezone.now(),
+            max_retries=self.max_retries, retry_backoff=self.retry_backoff,
+        )
+        if settings.TASKS_EAGER:
+            # Run in the caller, e.g. in tests: retries aren't waited for
+            Task.objects.filter(pk=task.pk).update(run_at=timezone.now())
+            if (claimed := Task.claim(task.pk)) is not None:
+                execute(claimed)
+                task.refresh_from_db()
+            return task
+        if when is None or when <= timezone.now():
+            # Workers can only see the row once it's committed
+            transaction.on_commit(lambda: get_broker().notify(task.pk))
+        return task
+
+
+def task(name=None, max_retries=0, retry_backoff=10, retry_for=(Exception,)):
+    """
+    Register a function as a task, under `name` or its module and function name. Failures raising one of
+    `retry_for` are retried up to `max_retries` times, `retry_backoff` seconds later, doubled on each retry.
+    """
+    def decorator(function):
+        task_name = name or f'{function.__module__}.{function.__name__}'
+        REGISTRY[task_name] = TaskFunction(function, task_name, max_retries, retry_backoff, retry_for)
+        return REGISTRY[task_name]
+    return decorator
@@ -0,0 +1,63 @@
+import logging
+import time
+from django.conf import settings
+from .models import Task
+
+# Brokers only wake workers up: queued tasks are rows of the Task table, which workers also poll on their own
+# every few seconds. A notification lost with Redis (down, restarted) only delays its task until the next poll.
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseBroker:
+    """No broker but the table: workers poll it for due tasks."""
+
+    def notify(self, task_id):
+        pass
+
+    def wait(self, timeout):
+        """Ids of tasks to try to claim, after up to `timeout` seconds."""
+        ids = Task.due_ids()
+        if not ids:
+            time.sleep(timeout)
+        return ids
+
+
+class RedisBroker:
+    """Task ids pushed to a Redis list, workers block on it so a task starts as soon as it's committed."""
+    KEY = 'tasks:queue'
+
+    def __init__(self):
+        import redis
+        self.redis = redis.Redis(
+            host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=settings.REDIS_DB, socket_connect_timeout=1,
+        )
+
+    def notify(self, task_id):
+        try:
+            self.redis.lpush(self.KEY, str(task_id))
+        except Exception as e:
+            logger.warning("Couldn't notify the workers of task %s, it will be found by polling: %s", task_id, e)
+
+    def wait(self, timeout):
+        try:
+            item = self.redis.brpop(self.KEY, timeout=max(int(timeout), 1))
+        except Exception as e:
+            logger.warning("Redis unavailable, polling the task table: %s", e)
+            return DatabaseBroker().wait(timeout)
+        return [item[1].decode()] if item else []
+
+
+BROKERS = {
+    'database': DatabaseBroker,
+    'redis': RedisBroker,
+}
+
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None or not isinstance(_broker, BROKERS[settings.TASK_BROKER]):
+        _broker = BROKERS[settings.TASK_BROKER]()
+    return _broker
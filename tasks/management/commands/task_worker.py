@@ -0,0 +1,63 @@
+import multiprocessing
+import signal
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from tasks.worker import Worker
+
+
+def run_worker():
+    worker = Worker()
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Stopped by the supervisor
+    worker.run()
+
+
+class Command(BaseCommand):
+    help = "Run queued background tasks in a pool of worker processes, restarting any that dies."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=settings.TASK_WORKERS, help="Worker processes, 0 runs tasks in this process.")
+        parser.add_argument('--burst', action='store_true', help="Run the due tasks in this process, then exit.")
+        parser.add_argument('--shutdown-timeout', type=int, default=60, help="Seconds a stopping worker gets to finish its task.")
+
+    def handle(self, *args, **options):
+        if options['burst'] or options['processes'] == 0:
+            worker = Worker()
+            signal.signal(signal.SIGTERM, worker.stop)
+            worker.run(burst=options['burst'])
+            return
+
+        stopping = False
+
+        def stop(*args):
+            nonlocal stopping
+            stopping = True
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        # Forked workers must open their own database connections
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        workers = []
+        self.stdout.write(f"Starting {options['processes']} task workers.")
+        while not stopping:
+            for process in [process for process in workers if not process.is_alive()]:
+                self.stderr.write(f"Task worker {process.pid} exited with {process.exitcode}, restarting it.")
+                workers.remove(process)
+            while len(workers) < options['processes']:
+                process = context.Process(target=run_worker, daemon=True)
+                process.start()
+                workers.append(process)
+            time.sleep(1)
+
+        for process in workers:
+            process.terminate()
+        deadline = time.monotonic() + options['shutdown_timeout']
+        for process in workers:
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                process.kill()
+        self.stdout.write(self.style.SUCCESS("Task workers stopped."))
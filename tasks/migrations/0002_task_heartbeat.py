@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:29
+
+from django.db import migrations, models
+
+
+def start_heartbeats(apps, schema_editor):
+    # Tasks running during the upgrade beat from their start, so they're requeued if their worker is gone
+    Task = apps.get_model('tasks', 'Task')
+    Task.objects.filter(status='running').update(heartbeat_at=models.F('started_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(start_heartbeats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,98 @@
+import random
+import uuid
+from datetime import timedelta
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.db.models import F
+from django.utils import timezone
+
+
+class Task(models.Model):
+    """
+    A call of a registered task function (see tasks/base.py), queued by a request and run by a worker. The row
+    is the queue entry, the schedule and the result alike; brokers only tell workers that a task is waiting.
+    """
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    name = models.CharField(max_length=200)
+    args = models.JSONField(default=list, encoder=DjangoJSONEncoder)
+    kwargs = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    run_at = models.DateTimeField(default=timezone.now)  # Not run before this, moved later by retries
+    attempts = models.PositiveIntegerField(default=0)
+    max_retries = models.PositiveIntegerField(default=0)
+    retry_backoff = models.PositiveIntegerField(default=10)  # Seconds before the first retry, doubled on each one
+    result = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)  # Touched by the worker while the task runs
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    MAX_BACKOFF = 3600
+    HEARTBEAT_INTERVAL = 30  # Seconds between two heartbeats of a running task
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'run_at'], name='task_status_run_at_idx')]
+
+    def __str__(self):
+        return f"{self.name} ({self.status})"
+
+    @classmethod
+    def due_ids(cls, limit=10):
+        """Ids of queued tasks whose time has come, oldest first."""
+        return list(
+            cls.objects.filter(status='queued', run_at__lte=timezone.now()).order_by('run_at').values_list('id', flat=True)[:limit]
+        )
+
+    @classmethod
+    def claim(cls, pk):
+        """
+        Mark a due queued task as running and return it, or None when it's gone, not due or another worker got it
+        first. A conditional update, so no database locks are needed and several notifications of a task are harmless.
+        """
+        now = timezone.now()
+        claimed = cls.objects.filter(pk=pk, status='queued', run_at__lte=now).update(
+            status='running', attempts=F('attempts') + 1, started_at=now, heartbeat_at=now,
+        )
+        return cls.objects.get(pk=pk) if claimed else None
+
+    def succeed(self, result):
+        self.status, self.result, self.error, self.finished_at = 'succeeded', result, '', timezone.now()
+        return self._save_run(['status', 'result', 'error', 'finished_at'])
+
+    def fail(self, error, retry=True):
+        """Record the error, and queue the task again after an exponential backoff if it has retries left."""
+        self.error = error
+        if retry and self.attempts <= self.max_retries:
+            delay = min(self.retry_backoff * 2 ** (self.attempts - 1), self.MAX_BACKOFF)
+            self.status = 'queued'
+            self.run_at = timezone.now() + timedelta(seconds=delay * random.uniform(1, 1.25))  # Jitter spreads out retries
+        else:
+            self.status, self.finished_at = 'failed', timezone.now()
+        return self._save_run(['status', 'error', 'run_at', 'finished_at'])
+
+    def _save_run(self, fields):
+        """
+        Save the outcome of this attempt, unless the task was requeued meanwhile and a later attempt owns the row.
+        Returns whether it was saved.
+        """
+        return bool(Task.objects.filter(pk=self.pk, status='running', attempts=self.attempts).update(
+            **{field: getattr(self, field) for field in fields}
+        ))
+
+    @classmethod
+    def requeue_stale(cls, timeout):
+        """
+        Queue again, or fail, the running tasks without a heartbeat for `timeout` seconds: their worker died.
+        Tasks that are slow but alive keep beating, and are left alone.
+        """
+        cutoff = timezone.now() - timedelta(seconds=timeout)
+        stale = cls.objects.filter(status='running', heartbeat_at__lt=cutoff)
+        return sum(task.fail(f"Abandoned by its worker, no heartbeat for {timeout}s.") for task in stale)
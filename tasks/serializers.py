@@ -0,0 +1,8 @@
+from rest_framework import serializers
+from .models import Task
+
+
+class TaskSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Task
+        fields = ['id', 'name', 'status', 'attempts', 'max_retries', 'run_at', 'result', 'error', 'created_at', 'started_at', 'heartbeat_at', 'finished_at']
@@ -0,0 +1,9 @@
+from smtplib import SMTPException
+from django.core.mail import send_mail
+from .base import task
+
+
+@task(max_retries=5, retry_backoff=60, retry_for=(SMTPException, OSError))
+def send_email(subject, message, recipient_list, html_message=None):
+    """Send an email with the configured backend, retried while the mail server is unreachable."""
+    return send_mail(subject, message, None, recipient_list, html_message=html_message)
@@ -0,0 +1,166 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+from django.core import mail
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+from accounts.models import User
+from tasks.base import task
+from tasks.models import Task
+from tasks.tasks import send_email
+
+calls = []
+
+
+@task()
+def add(a, b):
+    calls.append((a, b))
+    return a + b
+
+
+@task(max_retries=2, retry_backoff=10, retry_for=(ConnectionError,))
+def flaky():
+    raise ConnectionError("Gateway unreachable")
+
+
+@task(max_retries=2, retry_for=(ConnectionError,))
+def broken():
+    raise ValueError("Bad input")
+
+
+@override_settings(TASKS_EAGER=False, TASK_BROKER='database')
+class TaskQueueTest(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def run_worker(self):
+        call_command('task_worker', '--burst', stdout=StringIO())
+
+    # Test a queued task waits for a worker, which records its result
+    def test_worker_runs_queued_task(self):
+        queued = add.delay(2, 3)
+        self.assertEqual((queued.status, calls), ('queued', []))
+
+        self.run_worker()
+
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.result, queued.attempts), ('succeeded', 5, 1))
+        self.assertEqual(calls, [(2, 3)])
+
+    # Test a task isn't run before its scheduled time
+    def test_scheduled_task_waits(self):
+        scheduled = add.schedule(timedelta(hours=1), 1, 1)
+
+        self.run_worker()
+
+        scheduled.refresh_from_db()
+        self.assertEqual((scheduled.status, calls), ('queued', []))
+
+    # Test a retried failure is queued again with an exponential backoff, then fails for good
+    def test_retry_backoff(self):
+        queued = flaky.delay()
+
+        self.run_worker()
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), ('queued', 1))
+        self.assertIn('Gateway unreachable', queued.error)
+        self.assertGreaterEqual(queued.run_at, timezone.now() + timedelta(seconds=9))
+
+        Task.objects.filter(pk=queued.pk).update(run_at=timezone.now())
+        self.run_worker()
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), ('queued', 2))
+        self.assertGreaterEqual(queued.run_at, timezone.now() + timedelta(seconds=19))
+
+        Task.objects.filter(pk=queued.pk).update(run_at=timezone.now())
+        self.run_worker()
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), ('failed', 3))
+
+    # Test errors outside retry_for fail the task right away
+    def test_unexpected_error_not_retried(self):
+        queued = broken.delay()
+
+        self.run_worker()
+
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), ('failed', 1))
+        self.assertIn('ValueError: Bad input', queued.error)
+
+    # Test a task abandoned by a dead worker is retried like a failure
+    def test_stale_task_requeued(self):
+        queued = add.delay(1, 2)
+        Task.objects.filter(pk=queued.pk).update(
+            status='running', attempts=1, max_retries=1, heartbeat_at=timezone.now() - timedelta(minutes=10),
+        )
+
+        with self.settings(TASK_HEARTBEAT_TIMEOUT=60):
+            self.run_worker()
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, 'queued')
+        self.assertIn('Abandoned', queued.error)
+
+        Task.objects.filter(pk=queued.pk).update(run_at=timezone.now())
+        self.run_worker()
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts, queued.result), ('succeeded', 2, 3))
+
+    # Test a long task whose worker still beats isn't run a second time
+    def test_live_task_not_requeued(self):
+        queued = add.delay(1, 2)
+        Task.objects.filter(pk=queued.pk).update(
+            status='running', attempts=1, max_retries=1,
+            started_at=timezone.now() - timedelta(hours=1), heartbeat_at=timezone.now(),
+        )
+
+        with self.settings(TASK_HEARTBEAT_TIMEOUT=60):
+            self.run_worker()
+
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts, calls), ('running', 1, []))
+
+    # Test a requeued attempt's outcome doesn't overwrite the state of the attempt that replaced it
+    def test_superseded_attempt_dropped(self):
+        queued = add.delay(1, 2)
+        first = Task.claim(queued.pk)
+        Task.objects.filter(pk=queued.pk).update(attempts=2)  # Requeued and claimed again
+
+        self.assertFalse(first.succeed(3))
+
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.result), ('running', None))
+
+    # Test the workers are woken once the queueing transaction commits
+    def test_broker_notified_on_commit(self):
+        with mock.patch('tasks.brokers.DatabaseBroker.notify') as notify, self.captureOnCommitCallbacks(execute=True):
+            queued = add.delay(1, 2)
+        notify.assert_called_once_with(queued.pk)
+
+    # Test emails are sent by the workers
+    def test_send_email(self):
+        send_email.delay("Hello", "Body", ['customer@example.com'])
+        self.assertEqual(len(mail.outbox), 0)
+
+        self.run_worker()
+
+        self.assertEqual([message.subject for message in mail.outbox], ["Hello"])
+
+    # Test admins can follow a task's status
+    def test_task_detail(self):
+        admin = User.objects.create_superuser(
+            username='admin', phone_number='1234567890', first_name='Admin', last_name='User', password='TestPassword123!',
+        )
+        client = APIClient()
+        queued = add.delay(2, 2)
+        url = reverse('task-detail', args=[queued.pk])
+        self.assertEqual(client.get(url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+        client.force_authenticate(admin)
+        self.run_worker()
+        response = client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['status'], response.data['result']), ('succeeded', 4))
@@ -0,0 +1,7 @@
+from django.urls import path
+from .views import *
+
+urlpatterns = [
+    # Admin: Status and result of a background task (GET)
+    path('admin/tasks/<uuid:pk>/', TaskDetailView.as_view(), name='task-detail'),
+]
@@ -0,0 +1,18 @@
+from rest_framework import generics
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from drf_spectacular.utils import extend_schema
+from accounts.manager import IsSuperUser  # custom permission
+from .models import Task
+from .serializers import TaskSerializer
+
+
+@extend_schema(
+    methods=["GET"],
+    summary="Task status",
+    description="Status of a background task, with its result once it succeeded or its last error.",
+    tags=["Tasks (Admin)"],
+)
+class TaskDetailView(generics.RetrieveAPIView):
+    queryset = Task.objects.all()
+    serializer_class = TaskSerializer
+    permission_classes = [IsAuthenticated, IsAdminUser | IsSuperUser]
@@ -0,0 +1,96 @@
+import json
+import logging
+import threading
+import time
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections, connection
+from django.utils import timezone
+from .base import REGISTRY
+from .brokers import get_broker
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+
+class Heartbeat(threading.Thread):
+    """Touches a running task's row every HEARTBEAT_INTERVAL seconds, so sweeps can tell it from one whose worker died."""
+
+    def __init__(self, task):
+        super().__init__(daemon=True)
+        self.task = task
+        self.finished = threading.Event()
+
+    def run(self):
+        try:
+            while not self.finished.wait(Task.HEARTBEAT_INTERVAL):
+                Task.objects.filter(pk=self.task.pk, status='running', attempts=self.task.attempts).update(heartbeat_at=timezone.now())
+        finally:
+            connection.close()  # The thread's own connection
+
+    def stop(self):
+        self.finished.set()
+        self.join()
+
+
+def execute(task):
+    """Run a claimed task and record its result, or its error and next retry."""
+    task_function = REGISTRY.get(task.name)
+    if task_function is None:
+        task.fail(f"Unknown task {task.name}.", retry=False)
+        return
+    heartbeat = Heartbeat(task)
+    heartbeat.start()
+    try:
+        result = task_function(*task.args, **task.kwargs)
+    except Exception as e:
+        logger.warning("Task %s (%s) failed on attempt %s: %s", task.name, task.pk, task.attempts, e)
+        saved = task.fail(f"{type(e).__name__}: {e}", retry=isinstance(e, task_function.retry_for))
+    else:
+        try:
+            json.dumps(result, cls=DjangoJSONEncoder)
+        except TypeError:
+            result = repr(result)
+        saved = task.succeed(result)
+    finally:
+        heartbeat.stop()
+    if not saved:
+        logger.warning("Task %s (%s) attempt %s was superseded, its outcome is dropped.", task.name, task.pk, task.attempts)
+
+
+class Worker:
+    """
+    Claims and runs due tasks one at a time. Waits on the broker between tasks, and polls the table every
+    `sweep_interval` seconds for scheduled tasks, retries, missed notifications and tasks of dead workers.
+    """
+
+    def __init__(self, poll_interval=1, sweep_interval=5):
+        self.poll_interval = poll_interval
+        self.sweep_interval = sweep_interval
+        self.stopping = False
+
+    def stop(self, *args):
+        # Finish the current task, then exit
+        self.stopping = True
+
+    def run(self, burst=False):
+        """Run tasks until stopped, or with `burst` until none is due."""
+        broker = get_broker()
+        last_sweep = 0
+        while not self.stopping:
+            ids = [] if burst else broker.wait(self.poll_interval)
+            if burst or time.monotonic() - last_sweep >= self.sweep_interval:
+                last_sweep = time.monotonic()
+                Task.requeue_stale(settings.TASK_HEARTBEAT_TIMEOUT)
+                ids += [pk for pk in Task.due_ids() if pk not in ids]
+            if burst and not ids:
+                break
+
+            for pk in ids:
+                if self.stopping:
+                    break
+                close_old_connections()
+                task = Task.claim(pk)
+                if task is not None:
+                    execute(task)
+        close_old_connections()